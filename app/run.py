@@ -14,14 +14,19 @@
 
 import argparse
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import gradio as gr
 import openai
 import openai.error
 import tenacity
 from colorama import Fore
-from utils import save_markdown_file, split_markdown_code
+from utils import (
+    CaseWriter,
+    save_markdown_file,
+    split_markdown_code,
+    start_metrics,
+)
 
 from wada.agents import TopicAgent
 from wada.debate import Debate
@@ -31,6 +36,8 @@ ChatBotHistory = List[Tuple[Optional[str], Optional[str]]]
 
 DEFAULT_TOPIC = "Living in Beijing or Chengdu?"
 
+case_writer = CaseWriter()
+
 
 @dataclass
 class State:
@@ -89,6 +96,9 @@ def parse_arguments():
         '--concurrency-count', type=int, default=1,
         help='Number if concurrent threads at Gradio websocket queue. ' +
         'Increase to serve more requests but keep an eye on RAM usage.')
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='Port to serve the Prometheus metrics on, off by default')
     args, unknown = parser.parse_known_args()
     if len(unknown) > 0:
         print("Unknown args: ", unknown)
@@ -174,10 +184,14 @@ def send_new_msg(
 
 def start_debate(
     state: State
-) -> Union[Dict, Tuple[State, ChatBotHistory, str, Dict, Dict]]:
+) -> Iterator[Union[Dict, Tuple[State, Union[Dict, ChatBotHistory], Union[
+        Dict, str], Dict, Dict]]]:
+    r"""Runs the debate and pushes the transcript to the page whenever a
+    round is added, instead of having the page poll for it."""
     try:
         if not state.ready_for_debate:
-            return state, [], "", gr.update(interactive=True), gr.update()
+            yield state, [], "", gr.update(interactive=True), gr.update()
+            return
 
         debate_session = Debate(topic=state.topic_agent.topic)
 
@@ -189,6 +203,10 @@ def start_debate(
 
         state.debate = debate_session
 
+        yield state, gr.update(
+            value=state.debate_history,
+            visible=True), gr.update(), gr.update(), gr.update()
+
         chat_turn_limit, n = 50, 0
         while n < chat_turn_limit:
             n += 1
@@ -221,38 +239,29 @@ def start_debate(
                 (split_markdown_code(debater_a_reply.content), None))
             state.debate_history.append(
                 (None, split_markdown_code(debater_b_reply.content)))
+            yield state, state.debate_history, gr.update(), gr.update(
+            ), gr.update()
 
             if "DEBATE_TOPIC_DONE" in debater_b_reply.content or "DEBATE_TOPIC_DONE" in debater_a_reply.content:
                 break
 
-            shouldContinue, result = debate_session.host.step(
-                debater_a_reply_str + debater_b_reply_str)
+            shouldContinue, result = debate_session.judge(debater_a_reply_str +
+                                                          debater_b_reply_str)
 
             if not shouldContinue:
-                return state, state.debate_history, gr.update(
+                yield state, state.debate_history, gr.update(
                     value=result, visible=True), gr.update(
                         interactive=True), gr.update(visible=True)
+                return
 
-        return state, state.debate_history, gr.update(
+        yield state, state.debate_history, gr.update(
             value="Reach limit",
             visible=True), gr.update(interactive=True), gr.update()
 
     except (openai.error.RateLimitError, tenacity.RetryError,
             RuntimeError) as ex:
         print("OpenAI API exception 0 " + str(ex))
-        return state, [], "", gr.update(interactive=True), gr.update()
-
-
-def update_state(state: State) -> Union[Dict, Tuple[State, ChatBotHistory]]:
-    debate_cb_dict = dict()
-
-    if state.ready_for_debate:
-        debate_cb_dict['visible'] = True
-
-    if state.debate_history is not None:
-        debate_cb_dict['value'] = state.debate_history
-
-    return (state, gr.update(**debate_cb_dict))
+        yield state, [], "", gr.update(interactive=True), gr.update()
 
 
 def change_topic(topic: str) -> Dict:
@@ -275,8 +284,10 @@ def refresh_page(state: State):
 
 
 def save(state: State) -> None:
-    result = State.export(state)
-    save_markdown_file(result)
+    # The history is copied, so the page can go on while the file is written.
+    result = dict(State.export(state),
+                  debate_history=list(state.debate_history))
+    case_writer.submit(save_markdown_file, result)
 
 
 def main():
@@ -286,11 +297,15 @@ def main():
 
     print("Getting Agents web server online...")
 
+    if args.metrics_port is not None:
+        start_metrics(demo, args.metrics_port)
+
     demo.queue(args.concurrency_count) \
         .launch(share=True, inbrowser=args.inbrowser,
                 server_name="127.0.0.1", server_port=args.server_port,
                 debug=True)
 
+    case_writer.close()
     print("Exiting.")
 
 
@@ -370,10 +385,7 @@ with gr.Blocks(css=css_str) as demo:
               queue=False) \
         .then(start_debate,
               state,
-              [state, debate_cb, decision_ta, reset_bn, save_bn],
-              queue=False)
-
-    demo.load(update_state, state, [state, debate_cb], every=0.5)
+              [state, debate_cb, decision_ta, reset_bn, save_bn])
 
     reset_bn.click(refresh_page, state, [
         state, start_bn, topic_ta, specified_aspects_ta, topic_background_ta,
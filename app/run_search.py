@@ -13,17 +13,21 @@
 # limitations under the License.
 
 import argparse
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+import asyncio
+import os
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import gradio as gr
 import openai
 import openai.error
 import tenacity
-from utils import save_markdown_file, split_markdown_code
+from utils import CaseWriter, split_markdown_code, start_metrics
 
-from wada.agents import TopicAgent
+from wada.agents import ChatAgent, TopicAgent
+from wada.archive import ArchivedDebate, TranscriptArchive
 from wada.debate_simulator import DebateSimulator
+from wada.messages import ChatMessage
 from wada.topic import Topic
 from wada.typing import ModelType, TopicType
 
@@ -31,49 +35,61 @@ ChatBotHistory = List[Tuple[Optional[str], Optional[str]]]
 
 DEFAULT_TOPIC = "As a new graduate, should I start my career in my hometown Chengdu or the capital city Beijing?"
 
+# The archive the saved debates go to, opened by `main`.
+archive: Optional[TranscriptArchive] = None
+# The background thread writing the saved debates, started by `main`.
+case_writer: Optional[CaseWriter] = None
+
 
 @dataclass
 class State:
     topic_agent: Optional[TopicAgent]
     debate: Optional[DebateSimulator]
     chat: ChatBotHistory
-    debate_history: ChatBotHistory
     ready_for_debate: bool
+    # The rows of the chatbot rendered so far from the transcript of the
+    # debate: the introductions of the debaters, then one row per message.
+    debate_history: ChatBotHistory = field(default_factory=list)
 
     @classmethod
     def empty(cls) -> 'State':
-        return cls(None, None, [], [], False)
+        return cls(None, None, [], False)
 
     @staticmethod
     def construct_inplace(state: 'State', topic_agent: Optional[TopicAgent],
                           session: Optional[DebateSimulator],
-                          chat: ChatBotHistory, debate_history: ChatBotHistory,
+                          chat: ChatBotHistory,
                           ready_for_debate: bool = False):
         state.topic_agent = topic_agent
         state.debate = session
         state.chat = chat
-        state.debate_history = debate_history
         state.ready_for_debate = ready_for_debate
-
-    @staticmethod
-    def export(state: 'State', catagory: str):
-        topic_abbr = state.topic_agent.abbreviate_topic()
-        result = {
-            'model': state.topic_agent.model.value,
-            'topic': state.topic_agent.topic.content,
-            'topic_pro': state.topic_agent.topic.pro,
-            'topic_con': state.topic_agent.topic.con,
-            'topic_abbr':
-            topic_abbr if topic_abbr else state.topic_agent.topic.content,
-            'catagory': catagory,
-            'specified_aspects': state.topic_agent.topic.specified_aspects,
-            'background': state.topic_agent.topic.background,
-            'chat_history': state.chat,
-            'preference': state.topic_agent.topic.preference,
-            'debate_history': state.debate.history,
-            'judgement': state.debate.host.judgement,
-        }
-        return result
+        state.debate_history = []
+
+    def get_debate_history(self) -> ChatBotHistory:
+        r"""Renders the debate for the chatbot from the transcript of the
+        simulator, which is the only copy of the debate the state holds.
+        Only the messages added since the last call are rendered."""
+        debate = self.debate
+        debate_history = self.debate_history
+        if not debate_history:
+            topic = self.topic_agent.topic
+            debate_history.extend([
+                (split_markdown_code(f"I am {debate.debater_a_name}, I will "
+                                     f"be arguing for: {topic.pro}"), None),
+                (None,
+                 split_markdown_code(f"I am {debate.debater_b_name}, I will "
+                                     f"be arguing for: {topic.con}")),
+            ])
+        # The opening of the host is not shown, and the first two rows are
+        # the introductions.
+        for message in debate.history.window(len(debate_history) - 1):
+            content = split_markdown_code(message.content)
+            if message.role_name == debate.debater_a_name:
+                debate_history.append((content, None))
+            else:
+                debate_history.append((None, content))
+        return debate_history
 
 
 def parse_arguments():
@@ -90,6 +106,13 @@ def parse_arguments():
         '--concurrency-count', type=int, default=1,
         help='Number if concurrent threads at Gradio websocket queue. ' +
         'Increase to serve more requests but keep an eye on RAM usage.')
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='Port to serve the Prometheus metrics on, off by default')
+    parser.add_argument(
+        '--archive-path', type=str,
+        default=os.path.join('app', 'cases', 'archive.db'),
+        help='SQLite database the saved debates are appended to')
     args, unknown = parser.parse_known_args()
     if len(unknown) > 0:
         print("Unknown args: ", unknown)
@@ -97,7 +120,7 @@ def parse_arguments():
 
 
 def cleanup_on_launch(state) -> Tuple[State, Dict, Dict, Dict, Dict]:
-    State.construct_inplace(state, None, None, [], [], False)
+    State.construct_inplace(state, None, None, [], False)
     return state, gr.update(interactive=False), gr.update(
         interactive=False), gr.update(visible=True), gr.update(
             interactive=False)
@@ -112,9 +135,13 @@ def specify_topic(
     try:
         model = ModelType.GPT_3_5_TURBO if model_type == "GPT 3.5" else ModelType.GPT_4
         topic_agent = TopicAgent(topic=Topic(content=topic), model=model)
-        (pos, neg) = topic_agent.break_down_topic()
-        print(pos, neg)
-        specified_aspects = topic_agent.specify_topic()
+        # Breaks down the topic, specifies the aspects, collects the
+        # background and asks the first question in two rounds of requests.
+        (is_summary, content) = asyncio.run(topic_agent.aprepare())
+        if is_summary:
+            raise RuntimeError("Not a question")
+        state.chat.append((None, split_markdown_code(content)))
+        specified_aspects = topic_agent.topic.specified_aspects
         state.topic_agent = topic_agent
 
     except (openai.error.RateLimitError, tenacity.RetryError,
@@ -129,16 +156,9 @@ def collect_bg(
     state: State
 ) -> Union[Dict, Tuple[State, str, ChatBotHistory, Dict, Dict]]:
 
-    try:
-        background = state.topic_agent.collect_bg()
-        (is_summary, content) = state.topic_agent.collect_pref()
-        if is_summary:
-            raise RuntimeError("Not a question")
-        state.chat.append((None, split_markdown_code(content)))
-    except (openai.error.RateLimitError, tenacity.RetryError,
-            RuntimeError) as ex:
-        print("OpenAI API exception 0 " + str(ex))
-        return state, str(ex), [], gr.update(), gr.update(visible=True)
+    # The background and the first question are collected together with
+    # the aspects in specify_topic.
+    background = state.topic_agent.topic.background
 
     return state, background, gr.update(
         value=state.chat,
@@ -176,37 +196,37 @@ def send_new_msg(
 
 def start_debate(
     state: State
-) -> Union[Dict, Tuple[State, ChatBotHistory, str, Dict, Dict, Dict]]:
+) -> Iterator[Union[Dict, Tuple[State, Union[Dict, ChatBotHistory], Union[
+        Dict, str], Dict, Dict, Dict]]]:
+    r"""Runs the debate and pushes the transcript to the page whenever a
+    round is added, instead of having the page poll for it."""
     try:
         if not state.ready_for_debate:
-            return state, [], "", gr.update(
+            yield state, [], "", gr.update(
                 interactive=True), gr.update(), gr.update()
+            return
 
         debate_session = DebateSimulator(
             topic=state.topic_agent.topic,
             verbose=True,
         )
 
-        intro_a = f"I am {debate_session.debater_a_name}, I will be arguing for: {state.topic_agent.topic.pro}"
-        intro_b = f"I am {debate_session.debater_b_name}, I will be arguing for: {state.topic_agent.topic.con}"
-
-        state.debate_history.append((split_markdown_code(intro_a), None))
-        state.debate_history.append((None, split_markdown_code(intro_b)))
-
         state.debate = debate_session
+        state.debate_history = []
         debate_session.reset()
 
+        yield state, gr.update(
+            value=state.get_debate_history(),
+            visible=True), gr.update(), gr.update(), gr.update(), gr.update()
+
         judge_result = ""
 
         while debate_session.terminated is False:
-            debater_a_reply, debater_b_reply, judge_result = debate_session.step(
-            )
-            state.debate_history.append(
-                (split_markdown_code(debater_a_reply), None))
-            state.debate_history.append(
-                (None, split_markdown_code(debater_b_reply)))
-
-        return state, state.debate_history, gr.update(
+            _, _, judge_result = debate_session.step()
+            yield state, state.get_debate_history(), gr.update(), gr.update(
+            ), gr.update(), gr.update()
+
+        yield state, state.get_debate_history(), gr.update(
             value=judge_result,
             visible=True), gr.update(interactive=True), gr.update(
                 visible=True), gr.update(visible=True)
@@ -214,21 +234,10 @@ def start_debate(
     except (openai.error.RateLimitError, tenacity.RetryError,
             RuntimeError) as ex:
         print("OpenAI API exception 0 " + str(ex))
-        return state, [], "", gr.update(
+        yield state, [], "", gr.update(
             interactive=True), gr.update(), gr.update()
 
 
-def update_state(state: State) -> Union[Dict, Tuple[State, ChatBotHistory]]:
-    debate_cb_dict = dict()
-    if state.ready_for_debate:
-        debate_cb_dict['visible'] = True
-
-    if state.debate_history is not None:
-        debate_cb_dict['value'] = state.debate_history
-
-    return (state, gr.update(**debate_cb_dict))
-
-
 def change_topic(topic: str) -> Dict:
     if topic.strip() == "":
         return gr.update(interactive=False)
@@ -237,7 +246,7 @@ def change_topic(topic: str) -> Dict:
 
 
 def reset_page(state):
-    State.construct_inplace(state, None, None, [], [], False)
+    State.construct_inplace(state, None, None, [], False)
     return (
         state,
         gr.update(interactive=True),
@@ -256,22 +265,43 @@ def reset_page(state):
     )
 
 
+def archive_debate(agent: ChatAgent, message: ChatMessage,
+                   debate: ArchivedDebate) -> int:
+    abbr = case_writer.abbreviate(debate.topic, agent, message)
+    debate.topic = replace(debate.topic, abbr=abbr)
+    return archive.add(debate)
+
+
 def save(state: State, catagory: str) -> Tuple[State, Dict]:
-    result = State.export(state, catagory)
-    save_markdown_file(result)
+    # The transcript and the topic are copied here, and the topic is
+    # abbreviated by a fork of the topic agent, so that the page can go on
+    # with the agent while the debate is written.
+    debate = ArchivedDebate.from_simulator(state.debate)
+    debate.topic = replace(debate.topic, catagory=TopicType(catagory))
+    topic_agent = state.topic_agent
+    case_writer.submit(archive_debate,
+                       topic_agent.fork(topic_agent.stored_messages[1:]),
+                       topic_agent.get_abbreviate_message(), debate)
     return state, gr.update(visible=True)
 
 
 def main():
+    global archive, case_writer
     args = parse_arguments()
+    archive = TranscriptArchive(args.archive_path)
+    case_writer = CaseWriter()
 
     print("Getting Agents web server online...")
 
+    if args.metrics_port is not None:
+        start_metrics(demo, args.metrics_port)
+
     demo.queue(args.concurrency_count) \
         .launch(inbrowser=args.inbrowser,
                 server_name="127.0.0.1", server_port=args.server_port,
                 debug=True)
 
+    case_writer.close()
     print("Exiting.")
 
 
@@ -360,10 +390,7 @@ with gr.Blocks(css=css_str, title="WADA") as demo:
               queue=False) \
         .then(start_debate,
               state,
-              [state, debate_cb, decision_ta, reset_bn, save_bn, topic_catagory_dd],
-              queue=False)
-
-    demo.load(update_state, state, [state, debate_cb], every=0.5)
+              [state, debate_cb, decision_ta, reset_bn, save_bn, topic_catagory_dd])
 
     reset_bn.click(
         reset_page, state, outputs=[
@@ -15,13 +15,37 @@
 #
 # Modifications:
 # - Added test_save_markdown_file test
+# - Added test_load_template and test_case_writer tests
 
+import os
+import threading
 from unittest import TestCase
 
-from app.utils import save_markdown_file, split_markdown_code
+from app.utils import (
+    CaseWriter,
+    load_template,
+    quote_history,
+    save_markdown_file,
+    split_markdown_code,
+)
 from wada.messages import UserChatMessage
+from wada.topic import Topic
 from wada.typing import RoleType
 
+TEMPLATE_FILE = os.path.join(os.path.dirname(__file__), "..", "template.md")
+
+
+class AbbreviatingAgent:
+
+    def __init__(self) -> None:
+        self.num_calls = 0
+
+    def step(self, message: UserChatMessage):
+        self.num_calls += 1
+        reply = UserChatMessage(role_name='Topic', role_type=RoleType.TOPIC,
+                                content='Beijing or Chengdu')
+        return [reply], False, {}
+
 
 class TestTextUtils(TestCase):
 
@@ -60,6 +84,47 @@ class TestTextUtils(TestCase):
 
         save_markdown_file(result)
 
+    def test_load_template(self):
+        template = load_template(TEMPLATE_FILE)
+        self.assertIs(load_template(TEMPLATE_FILE), template)
+
+        history = [
+            UserChatMessage(role_name='AI Debater A',
+                            role_type=RoleType.DEBATER,
+                            content='Beijing.\nMore jobs.')
+        ]
+        markdown = template.render(topic_abbr='Beijing or Chengdu',
+                                   debate_history=quote_history(history))
+        self.assertIn('> Beijing.\n\n> More jobs.', markdown)
+        self.assertEqual(history[0].content, 'Beijing.\nMore jobs.')
+
+    def test_case_writer(self):
+        writer = CaseWriter()
+        release = threading.Event()
+        saved = []
+        # The first save holds the thread, and the others wait in order.
+        writer.submit(release.wait)
+        writer.submit(saved.append, 1)
+        last = writer.submit(saved.append, 2)
+        self.assertEqual(saved, [])
+        release.set()
+        last.result(timeout=5)
+        self.assertEqual(saved, [1, 2])
+
+        topic = Topic(content='Beijing or Chengdu?')
+        message = UserChatMessage(role_name='Topic', role_type=RoleType.TOPIC,
+                                  content='Abbreviate the topic.')
+        agent, other_agent = AbbreviatingAgent(), AbbreviatingAgent()
+        for abbreviating_agent in (agent, agent, other_agent):
+            abbr = writer.submit(writer.abbreviate, topic, abbreviating_agent,
+                                 message)
+            self.assertEqual(abbr.result(timeout=5), 'Beijing or Chengdu')
+        self.assertEqual(agent.num_calls, 1)
+        self.assertEqual(other_agent.num_calls, 0)
+        # The topic the writer was given is left as it is.
+        self.assertEqual(topic.abbr, '')
+        writer.close()
+
     def test_split_markdown_code_newline(self):
         inp = ("Solution: To preprocess the historical stock data, we "
                "can perform the following steps:\n\n1. Remove any unnecessary"
@@ -15,13 +15,24 @@
 #
 # Modifications:
 # - Added save_markdown_file method
+# - Added start_metrics method
+# - Added save_archived_markdown_file method
+# - Added load_template method and CaseWriter class
 
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any
+from functools import lru_cache
+from typing import Any, Callable, Dict, List
 
 from jinja2 import Template
 
+from wada.agents import ChatAgent
+from wada.archive import TranscriptArchive
+from wada.messages import ChatMessage
+from wada.metrics import metrics, start_metrics_server
+from wada.topic import Topic
+
 
 def split_markdown_code(string: str) -> str:
     """ Split a multiline block of markdown code (triple-quotes) into
@@ -53,22 +64,169 @@ def split_markdown_code(string: str) -> str:
     return out_str_cleanup
 
 
+@lru_cache(maxsize=None)
+def load_template(template_file: str = "app\\template.md") -> Template:
+    """ Read and compile a markdown template, once per process.
+
+    Args:
+        template_file (str): markdown template
+
+    Returns:
+        Template: the compiled template
+    """
+    with open(template_file, "r") as file:
+        return Template(file.read())
+
+
+def quote_history(debate_history: List[Any]) -> List[Dict[str, str]]:
+    """ Quote the contents of the messages for the markdown template, in
+    copies, so that the history itself is left as it is.
+
+    Args:
+        debate_history (List[Any]): messages with a role name and a content
+
+    Returns:
+        List[Dict[str, str]]: the quoted messages
+    """
+    return [
+        dict(role_name=message.role_name,
+             content=message.content.replace('\n', '\n\n> '))
+        for message in debate_history
+    ]
+
+
 def save_markdown_file(
     data: Any,
     template_file: str = "app\\template.md",
-) -> None:
+) -> str:
     """ Save a markdown file with the given data.
-    """
-    with open(template_file, "r") as file:
-        template = Template(file.read())
 
-    for i in range(len(data["debate_history"])):
-        data["debate_history"][i].content = data["debate_history"][
-            i].content.replace('\n', '\n\n> ')
+    Args:
+        data (Any): fields of the markdown template
+        template_file (str): markdown template
 
-    filled_template = template.render(**data)
+    Returns:
+        str: path of the markdown file
+    """
+    template = load_template(template_file)
+    filled_template = template.render(
+        **dict(data, debate_history=quote_history(data["debate_history"])))
 
     time_str = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     output_file = f"app\\cases\\{data['catagory']}\\{time_str}.md"
     with open(output_file, "w") as file:
         file.write(filled_template)
+    return output_file
+
+
+def save_archived_markdown_file(
+    archive: TranscriptArchive,
+    debate_id: int,
+    template_file: str = "app\\template.md",
+) -> str:
+    """ Render a debate of the archive with the markdown template and save
+    it under the cases of its category, as the app used to on every save.
+
+    Args:
+        archive (TranscriptArchive): archive of the debates
+        debate_id (int): id of the debate in the archive
+        template_file (str): markdown template
+
+    Returns:
+        str: path of the markdown file
+    """
+    template = load_template(template_file)
+    debate = archive.get(debate_id)
+    time_str = datetime.fromtimestamp(
+        debate.created_at).strftime("%Y-%m-%d-%H-%M-%S")
+    output_file = (f"app\\cases\\{debate.topic.catagory.value}\\"
+                   f"{time_str}.md")
+    with open(output_file, "w") as file:
+        file.write(archive.render_markdown(debate_id, template))
+    return output_file
+
+
+class CaseWriter:
+    """ Save cases on a background thread, one at a time and in the order
+    they were saved, so that a save answers the page at once and never
+    holds a Gradio worker on the model or the disk. The topics are
+    abbreviated on the same thread, by a fork of the topic agent, and the
+    abbreviations are kept by topic, so saving a debate again does not ask
+    the model again.
+    """
+
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix="case-writer")
+        # Only used on the thread of the executor.
+        self.abbreviations: Dict[str, str] = {}
+
+    def abbreviate(self, topic: Topic, agent: ChatAgent,
+                   message: ChatMessage) -> str:
+        """ Abbreviate a topic, from the cache if the topic was abbreviated
+        before.
+
+        Args:
+            topic (Topic): copy of the topic
+            agent (ChatAgent): fork of the topic agent, see
+                :meth:`TopicAgent.fork`, which only this thread uses
+            message (ChatMessage): message asking for the abbreviation, see
+                :meth:`TopicAgent.get_abbreviate_message`
+
+        Returns:
+            str: the abbreviation
+        """
+        abbr = topic.abbr or self.abbreviations.get(topic.content)
+        if not abbr:
+            replies, terminated, info = agent.step(message)
+            if terminated or replies is None:
+                raise ValueError(f"Abbreviating topic failed due to {info}")
+            abbr = replies[0].content
+        self.abbreviations[topic.content] = abbr
+        return abbr
+
+    def submit(self, save: Callable[..., Any], *args: Any) -> Future:
+        """ Queue a save, whose errors are printed as they happen since
+        nobody waits for it.
+
+        Args:
+            save (Callable[..., Any]): function writing the case
+            *args (Any): arguments of the function, which must not change
+                after the call
+
+        Returns:
+            Future: the result of the save
+        """
+        future = self.executor.submit(save, *args)
+        future.add_done_callback(self.report)
+        return future
+
+    @staticmethod
+    def report(future: Future) -> None:
+        if future.exception() is not None:
+            print("Saving the case failed: " + repr(future.exception()))
+
+    def close(self) -> None:
+        """ Wait for the queued saves and stop the thread. """
+        self.executor.shutdown(wait=True)
+
+
+def start_metrics(demo: Any, port: int) -> None:
+    """ Serve the Prometheus metrics of the app on
+    http://127.0.0.1:<port>/metrics, next to the Gradio server, with the
+    number of events waiting in the Gradio queue.
+
+    Args:
+        demo (gr.Blocks): the app, whose queue is enabled
+        port (int): port of the metrics endpoint
+    """
+
+    def get_queue_depth() -> float:
+        # The queue is internal to Gradio, so it is read defensively.
+        queue = getattr(demo, "_queue", None)
+        return len(getattr(queue, "event_queue", None) or [])
+
+    metrics.gauge("wada_app_queue_depth", "Events waiting in the Gradio "
+                  "queue.").set_function(get_queue_depth)
+    start_metrics_server(port)
+    print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
@@ -0,0 +1,505 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from wada.agents import TopicAgent
+from wada.backends import FakeBackend
+from wada.debate import Debate
+from wada.topic import Topic
+
+Func = Callable[..., Any]
+Phases = Dict[str, Dict[str, float]]
+
+SCENARIOS = ("topic", "debate", "simulator")
+
+# The metrics compared with a baseline, the lower the better.
+REGRESSION_METRICS = (
+    "calls_per_session",
+    "prompt_tokens_per_session",
+    "prompt_growth",
+    "overhead_per_call_ms",
+    "memory_peak_kib",
+)
+
+ANSWER = ("I care most about the cost of living, and I would like a job "
+          "with room to grow.")
+
+
+def make_topic() -> Topic:
+    return Topic(
+        content="Living in Beijing or Chengdu?", pro="Living in Beijing",
+        con="Living in Chengdu",
+        background=("Beijing offers more jobs but costs more. Chengdu is "
+                    "cheaper, milder and more relaxed."),
+        preference=("The person prioritizes job options and prefers a "
+                    "milder climate."),
+        specified_aspects=("1. Job opportunities; 2. Cost of living; "
+                           "3. Climate and environment"))
+
+
+class LatencyModel:
+    r"""Draws latencies from a log-normal distribution, the usual shape of
+    LLM and web API latencies: most requests take about the median, and a
+    long tail takes several times longer. LLM latencies also grow with the
+    tokens of the request, mostly the generated ones.
+
+    Args:
+        median (float): The median latency in seconds.
+        sigma (float): The standard deviation of the log of the latency,
+            the larger the longer the tail. (default: :obj:`0.5`)
+        per_prompt_token (float): The seconds added per prompt token.
+            (default: :obj:`0.0`)
+        per_completion_token (float): The seconds added per completion
+            token. (default: :obj:`0.0`)
+        scale (float): The factor applied to every latency, to run the
+            benchmarks faster than real time. (default: :obj:`1.0`)
+        seed (Optional[int]): The seed of the draws. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        median: float,
+        sigma: float = 0.5,
+        per_prompt_token: float = 0.0,
+        per_completion_token: float = 0.0,
+        scale: float = 1.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.median = median
+        self.sigma = sigma
+        self.per_prompt_token = per_prompt_token
+        self.per_completion_token = per_completion_token
+        self.scale = scale
+        self.random = random.Random(seed)
+
+    def __call__(self, prompt_tokens: int = 0,
+                 completion_tokens: int = 0) -> float:
+        if self.scale == 0:
+            return 0.0
+        latency = self.random.lognormvariate(math.log(self.median), self.sigma)
+        latency += (self.per_prompt_token * prompt_tokens +
+                    self.per_completion_token * completion_tokens)
+        return latency * self.scale
+
+
+@dataclass
+class Call:
+    phase: str
+    round: int
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+
+
+class Recorder:
+    r"""Collects the requests, tool calls and time of each phase of a
+    session. The phases run one after the other, so the time a phase spends
+    neither waiting for the LLM nor for a tool is the overhead of the
+    orchestration."""
+
+    def __init__(self) -> None:
+        self.phase = "setup"
+        self.round = 0
+        self.calls: List[Call] = []
+        self.phase_times: Dict[str, float] = defaultdict(float)
+        self.tool_times: Dict[str, float] = defaultdict(float)
+        self.num_tool_calls = 0
+
+    @contextlib.contextmanager
+    def timing(self, phase: str) -> Iterator[None]:
+        previous, self.phase = self.phase, phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[phase] += time.perf_counter() - start
+            self.phase = previous
+
+    def timed(self, phase: str, func: Func) -> Func:
+
+        def timed_func(*args: Any, **kwargs: Any) -> Any:
+            with self.timing(phase):
+                return func(*args, **kwargs)
+
+        return timed_func
+
+    def record_call(self, usage: Dict[str, int], latency: float) -> None:
+        self.calls.append(
+            Call(self.phase, self.round, usage["prompt_tokens"],
+                 usage["completion_tokens"], latency))
+
+    def record_tool(self, latency: float) -> None:
+        self.tool_times[self.phase] += latency
+        self.num_tool_calls += 1
+
+
+class BenchmarkBackend(FakeBackend):
+    r"""A :class:`FakeBackend` scripted for debates that reports every
+    request to a :class:`Recorder`."""
+
+    def __init__(self, *args: Any, recorder: Recorder, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.recorder = recorder
+
+    def respond(self, kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        response, latency = super().respond(kwargs)
+        self.recorder.record_call(response["usage"], latency)
+        return response, latency
+
+
+def make_tools(recorder: Recorder, latency: LatencyModel) -> List[Any]:
+    r"""Returns stand-ins for the search tools of the debaters, which sleep
+    for a latency drawn from :obj:`latency`."""
+    from langchain.agents import Tool
+
+    def search(query: str) -> str:
+        seconds = latency()
+        time.sleep(seconds)
+        recorder.record_tool(seconds)
+        return (f"{query}: Beijing has more jobs in technology and finance. "
+                "Chengdu has a lower cost of living and a milder climate.")
+
+    search_description = (
+        "A search engine. Useful for when you need to answer questions "
+        "about current events. Input should be a search query")
+    wikipedia_description = (
+        "An online encyclopedia providing information on various topics. "
+        "Input should be a search query")
+    return [
+        Tool(name="Search", func=search, description=search_description),
+        Tool(name="Wikipedia", func=search, description=wikipedia_description),
+    ]
+
+
+def run_topic(backend: FakeBackend, recorder: Recorder,
+              args: argparse.Namespace) -> Any:
+    r"""Elicits the topic like :meth:`TopicAgent.start`, answering the
+    questions with a fixed answer instead of reading the console."""
+    agent = TopicAgent(make_topic(), backend=backend)
+    agent.reset()
+    with recorder.timing("break_down"):
+        agent.break_down_topic()
+    with recorder.timing("specify"):
+        agent.specify_topic()
+    with recorder.timing("collect_bg"):
+        agent.collect_bg()
+    answer = None
+    for n in range(agent.question_limit):
+        recorder.round = n + 1
+        with recorder.timing("collect_pref"):
+            is_summary, _ = agent.collect_pref(answer)
+        if is_summary:
+            break
+        answer = ANSWER
+    return agent
+
+
+def run_debate(backend: FakeBackend, recorder: Recorder,
+               args: argparse.Namespace) -> Any:
+    r"""Runs a :class:`Debate` between two chat agents like the web app."""
+    agent_kwargs = dict(backend=backend)
+    debate = Debate(make_topic(), debater_a_agent_kwargs=agent_kwargs,
+                    debater_b_agent_kwargs=agent_kwargs,
+                    host_kwargs=agent_kwargs)
+    debate.debater_a_agent.step = recorder.timed("debater_a",
+                                                 debate.debater_a_agent.step)
+    debate.debater_b_agent.step = recorder.timed("debater_b",
+                                                 debate.debater_b_agent.step)
+    debate.host.step = recorder.timed("host", debate.host.step)
+
+    recorder.round = 1
+    debater_a_return, debater_b_return = debate.init_chat()
+    while True:
+        debater_a_reply, debater_b_reply = (debater_a_return[0],
+                                            debater_b_return[0])
+        debate_continue, _ = debate.host.step(
+            f"{debate.debater_a_name}:\n\n{debater_a_reply.content}\n"
+            f"{debate.debater_b_name}:\n\n{debater_b_reply.content}\n")
+        if not debate_continue or recorder.round == args.turn_limit:
+            break
+        recorder.round += 1
+        debater_a_return, debater_b_return = debate.step(debater_b_reply)
+    return debate
+
+
+def run_simulator(backend: FakeBackend, recorder: Recorder,
+                  args: argparse.Namespace) -> Any:
+    r"""Runs a :class:`DebateSimulator` between two ReAct debaters that look
+    up every answer with a search tool."""
+    from wada.debate_simulator import DebateSimulator
+
+    tool_latency = LatencyModel(args.tool_median, args.tool_sigma,
+                                scale=args.latency_scale, seed=args.seed)
+    tools = make_tools(recorder, tool_latency)
+    agent_kwargs = dict(tools=tools, backend=backend)
+    simulator = DebateSimulator(make_topic(), turn_limit=args.turn_limit,
+                                debater_a_agent_kwargs=agent_kwargs,
+                                debater_b_agent_kwargs=agent_kwargs,
+                                host_kwargs=dict(backend=backend))
+    simulator.debater_a_agent.step = recorder.timed(
+        "debater_a", simulator.debater_a_agent.step)
+    simulator.debater_b_agent.step = recorder.timed(
+        "debater_b", simulator.debater_b_agent.step)
+    simulator.host.step = recorder.timed("host", simulator.host.step)
+
+    simulator.reset()
+    while not simulator.terminated:
+        recorder.round = simulator.round + 1
+        simulator.step()
+    return simulator
+
+
+RUNNERS = {
+    "topic": run_topic,
+    "debate": run_debate,
+    "simulator": run_simulator,
+}
+
+
+def run_session(scenario: str, args: argparse.Namespace,
+                latency_scale: float) -> Tuple[Recorder, float, Any]:
+    recorder = Recorder()
+    llm_latency = LatencyModel(args.llm_median, args.llm_sigma,
+                               per_prompt_token=args.per_prompt_token,
+                               per_completion_token=args.per_completion_token,
+                               scale=latency_scale, seed=args.seed)
+    backend = BenchmarkBackend.for_debate(num_rounds=args.num_rounds,
+                                          use_tools=scenario == "simulator",
+                                          latency=llm_latency,
+                                          record_requests=False,
+                                          recorder=recorder)
+    # The agents print the debate, which is not what is measured.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        session = RUNNERS[scenario](backend, recorder, args)
+        wall_time = time.perf_counter() - start
+    return recorder, wall_time, session
+
+
+def measure_memory(scenario: str,
+                   args: argparse.Namespace) -> Tuple[float, float]:
+    r"""Returns the peak and the retained memory in KiB of a session run
+    without latencies, as tracing the allocations slows everything down."""
+    tracemalloc.start()
+    try:
+        _, _, session = run_session(scenario, args, latency_scale=0.0)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del session
+    return peak / 1024, retained / 1024
+
+
+def summarize_phases(recorders: List[Recorder]) -> Phases:
+    phases: Phases = defaultdict(lambda: defaultdict(float))
+    for recorder in recorders:
+        for phase, seconds in recorder.phase_times.items():
+            llm_time = sum(call.latency for call in recorder.calls
+                           if call.phase == phase)
+            tool_time = recorder.tool_times[phase]
+            phases[phase]["time"] += seconds
+            phases[phase]["llm"] += llm_time
+            phases[phase]["tool"] += tool_time
+            phases[phase]["overhead"] += seconds - llm_time - tool_time
+            phases[phase]["calls"] += sum(1 for call in recorder.calls
+                                          if call.phase == phase)
+    return {
+        phase: {key: value / len(recorders)
+                for key, value in values.items()}
+        for phase, values in phases.items()
+    }
+
+
+def get_tokens_per_round(recorder: Recorder) -> List[Dict[str, int]]:
+    rounds: Dict[int, Dict[str, int]] = {}
+    for call in recorder.calls:
+        if call.round == 0:
+            continue
+        tokens = rounds.setdefault(call.round, dict(prompt=0, completion=0))
+        tokens["prompt"] += call.prompt_tokens
+        tokens["completion"] += call.completion_tokens
+    return [rounds[n] for n in sorted(rounds)]
+
+
+def run_scenario(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    for _ in range(args.warmup):
+        run_session(scenario, args, args.latency_scale)
+    recorders, wall_times = [], []
+    for _ in range(args.repetitions):
+        recorder, wall_time, _ = run_session(scenario, args,
+                                             args.latency_scale)
+        recorders.append(recorder)
+        wall_times.append(wall_time)
+
+    num_calls = statistics.mean(len(r.calls) for r in recorders)
+    llm_times = [sum(call.latency for call in r.calls) for r in recorders]
+    tool_times = [sum(r.tool_times.values()) for r in recorders]
+    overheads = [
+        wall_time - llm_times[i] - tool_times[i]
+        for i, wall_time in enumerate(wall_times)
+    ]
+    tokens_per_round = get_tokens_per_round(recorders[0])
+    prompt_growth = 1.0
+    if len(tokens_per_round) > 1:
+        prompt_growth = (tokens_per_round[-1]["prompt"] /
+                         max(1, tokens_per_round[0]["prompt"]))
+    memory_peak, memory_retained = measure_memory(scenario, args)
+
+    overhead = statistics.mean(overheads)
+    return dict(
+        wall_time=statistics.mean(wall_times),
+        wall_time_max=max(wall_times),
+        llm_time=statistics.mean(llm_times),
+        tool_time=statistics.mean(tool_times),
+        overhead=overhead,
+        overhead_per_call_ms=1000 * overhead / max(1, num_calls),
+        calls_per_session=num_calls,
+        tool_calls_per_session=statistics.mean(r.num_tool_calls
+                                               for r in recorders),
+        prompt_tokens_per_session=statistics.mean(
+            sum(call.prompt_tokens for call in r.calls) for r in recorders),
+        completion_tokens_per_session=statistics.mean(
+            sum(call.completion_tokens for call in r.calls)
+            for r in recorders),
+        rounds=len(tokens_per_round),
+        tokens_per_round=tokens_per_round,
+        prompt_growth=prompt_growth,
+        memory_peak_kib=memory_peak,
+        memory_retained_kib=memory_retained,
+        phases=summarize_phases(recorders),
+    )
+
+
+def print_report(scenario: str, result: Dict[str, Any]) -> None:
+    print(f"== {scenario} ==")
+    print(f"wall time     {result['wall_time']:.3f}s "
+          f"(llm {result['llm_time']:.3f}s, tool {result['tool_time']:.3f}s, "
+          f"overhead {result['overhead']:.3f}s)")
+    print(f"calls         {result['calls_per_session']:.1f} LLM, "
+          f"{result['tool_calls_per_session']:.1f} tool; overhead "
+          f"{result['overhead_per_call_ms']:.2f}ms per LLM call")
+    print(f"tokens        {result['prompt_tokens_per_session']:.0f} prompt, "
+          f"{result['completion_tokens_per_session']:.0f} completion; "
+          f"prompt growth x{result['prompt_growth']:.2f} over "
+          f"{result['rounds']} rounds")
+    rounds = [
+        f"{tokens['prompt']}+{tokens['completion']}"
+        for tokens in result["tokens_per_round"]
+    ]
+    print("per round     " + ", ".join(rounds))
+    print(f"memory        {result['memory_peak_kib']:.0f}KiB peak, "
+          f"{result['memory_retained_kib']:.0f}KiB retained")
+    for phase, values in result["phases"].items():
+        print(f"  {phase:<13}{values['time']:.3f}s "
+              f"(llm {values['llm']:.3f}s, tool {values['tool']:.3f}s, "
+              f"overhead {values['overhead']:.3f}s, "
+              f"{values['calls']:.1f} calls)")
+    print()
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]],
+                     baseline: Dict[str, Dict[str, Any]],
+                     tolerance: float) -> List[str]:
+    r"""Returns the metrics that got worse than the baseline by more than
+    :obj:`tolerance`, relative to the baseline value."""
+    regressions = []
+    for scenario, result in results.items():
+        for metric in REGRESSION_METRICS:
+            if metric not in baseline.get(scenario, {}):
+                continue
+            value, reference = result[metric], baseline[scenario][metric]
+            if value > reference * (1 + tolerance):
+                regressions.append(f"{scenario}.{metric}: {value:.2f} > "
+                                   f"{reference:.2f} (+{tolerance:.0%})")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser("WADA benchmarks")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                        default=list(SCENARIOS), help='Scenarios to run')
+    parser.add_argument('--repetitions', type=int, default=5,
+                        help='Sessions run per scenario')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Sessions run before measuring')
+    parser.add_argument('--num-rounds', type=int, default=3,
+                        help='Rounds after which the host ends a debate')
+    parser.add_argument('--turn-limit', type=int, default=10,
+                        help='Maximum number of rounds of a debate')
+    parser.add_argument(
+        '--latency-scale', type=float, default=0.01,
+        help='Factor applied to the latencies, 1 for real time')
+    parser.add_argument('--llm-median', type=float, default=1.5,
+                        help='Median LLM latency in seconds')
+    parser.add_argument('--llm-sigma', type=float, default=0.5,
+                        help='Spread of the log of the LLM latency')
+    parser.add_argument('--per-prompt-token', type=float, default=0.0002,
+                        help='LLM seconds per prompt token')
+    parser.add_argument('--per-completion-token', type=float, default=0.03,
+                        help='LLM seconds per completion token')
+    parser.add_argument('--tool-median', type=float, default=0.8,
+                        help='Median tool latency in seconds')
+    parser.add_argument('--tool-sigma', type=float, default=0.8,
+                        help='Spread of the log of the tool latency')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the latencies')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Fail if worse than the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative regression from the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Entry point. """
+
+    args = parse_args(argv)
+    results = {}
+    for scenario in args.scenarios:
+        results[scenario] = run_scenario(scenario, args)
+        print_report(scenario, results[scenario])
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,340 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import openai
+import openai.error
+import pytest
+
+from wada.agents import ChatAgent, HostAgent
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.rate_limit import rate_limiters
+from wada.retry import circuit_breakers
+from wada.typing import ModelType, OverflowPolicy, RoleType
+from wada.utils import num_tokens_from_messages
+
+
+def make_response(content: str) -> dict:
+    return {
+        "id":
+        "chatcmpl-test",
+        "usage": {
+            "prompt_tokens": 10,
+            "completion_tokens": 5,
+            "total_tokens": 15
+        },
+        "choices": [{
+            "message": {
+                "role": "assistant",
+                "content": content
+            },
+            "finish_reason": "stop",
+        }],
+    }
+
+
+@pytest.fixture
+def chat_agent() -> ChatAgent:
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    return ChatAgent(sys_msg)
+
+
+@pytest.fixture
+def user_msg() -> UserChatMessage:
+    return UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                           content="Give me your first argument.")
+
+
+def test_chat_agent_step(monkeypatch, offline_encoding, chat_agent, user_msg):
+    monkeypatch.setattr(openai.ChatCompletion, "create",
+                        lambda **kwargs: make_response("Argument"))
+
+    replies, terminated, info = chat_agent.step(user_msg)
+    assert not terminated
+    assert replies[0].content == "Argument"
+    assert info["usage"]["total_tokens"] == 15
+    assert len(chat_agent.stored_messages) == 2
+
+
+def test_chat_agent_astep(monkeypatch, offline_encoding, chat_agent, user_msg):
+
+    async def acreate(**kwargs):
+        return make_response("Argument")
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    async def run_many():
+        agents = [ChatAgent(chat_agent.system_message) for _ in range(8)]
+        return await asyncio.gather(*[a.astep(user_msg) for a in agents])
+
+    results = asyncio.run(run_many())
+    assert len(results) == 8
+    for replies, terminated, info in results:
+        assert not terminated
+        assert replies[0].content == "Argument"
+
+
+def test_host_agent_astep(monkeypatch, offline_encoding):
+
+    async def acreate(**kwargs):
+        return make_response("<<<END>>> Option B fits better.")
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    host_sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", summary="", aspects=""),
+        role_tuple=("Host", RoleType.HOST))
+    host_agent = HostAgent(host_sys_msg)
+
+    debate_continue, judgement = asyncio.run(
+        host_agent.astep("A: ...\nB: ..."))
+    assert not debate_continue
+    assert judgement == "Option B fits better."
+    assert host_agent.judgement == judgement
+
+
+def test_chat_agent_token_counts(offline_encoding, chat_agent):
+    calls = []
+    encode = offline_encoding.encode
+    offline_encoding.encode = lambda text: calls.append(text) or encode(text)
+
+    def make_message(i: int) -> UserChatMessage:
+        return UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                               content=f"message number {i} " * (i + 1))
+
+    for i in range(5):
+        chat_agent.update_messages(make_message(i))
+    # The messages are counted when the window is first measured.
+    assert calls == []
+    chat_agent.get_num_tokens()
+    chat_agent.update_messages(make_message(5))
+    # Each message is encoded once, as role and content.
+    assert len(calls) == 14
+
+    openai_messages = [
+        message.to_openai_message() for message in chat_agent.stored_messages
+    ]
+    assert chat_agent.get_num_tokens() == num_tokens_from_messages(
+        openai_messages, chat_agent.model)
+    assert chat_agent.get_num_tokens(2) == num_tokens_from_messages(
+        openai_messages[:1] + openai_messages[-2:], chat_agent.model)
+    assert chat_agent.get_num_tokens(10) == chat_agent.get_num_tokens()
+
+
+def test_chat_agent_token_window(monkeypatch, offline_encoding, chat_agent):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs["messages"])
+        return make_response("ok")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    budget = chat_agent.get_num_tokens() + 3 * 24
+    chat_agent.message_window_tokens = budget
+    for i in range(10):
+        # 4 tokens of overhead, 1 for the role and 19 words of content.
+        msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                              content=" ".join([f"w{i}"] * 19))
+        _, _, info = chat_agent.step(msg)
+        assert info["num_tokens"] <= budget
+
+    assert requests[-1][0]["role"] == "system"
+    assert len(requests[-1]) == 1 + 3
+    assert requests[-1][-1]["content"].startswith("w9")
+    assert info["num_tokens"] == num_tokens_from_messages(
+        requests[-1], chat_agent.model)
+
+
+def make_user_msg(i: int, num_words: int = 19) -> UserChatMessage:
+    return UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                           content=" ".join([f"w{i}"] * num_words))
+
+
+def test_chat_agent_overflow_terminate(monkeypatch, offline_encoding,
+                                       chat_agent):
+    monkeypatch.setattr(openai.ChatCompletion, "create",
+                        lambda **kwargs: make_response("ok"))
+    chat_agent.model_token_limit = chat_agent.get_num_tokens() + 30
+
+    _, terminated, _ = chat_agent.step(make_user_msg(0))
+    assert not terminated
+    replies, terminated, info = chat_agent.step(make_user_msg(1))
+    assert terminated
+    assert replies is None
+    assert info["termination_reasons"] == ["max_tokens_exceeded"]
+
+
+def test_chat_agent_overflow_trim(monkeypatch, offline_encoding, chat_agent):
+    monkeypatch.setattr(openai.ChatCompletion, "create",
+                        lambda **kwargs: make_response("ok"))
+    chat_agent.overflow_policy = OverflowPolicy.TRIM
+    chat_agent.model_token_limit = chat_agent.get_num_tokens() + 100
+
+    for i in range(10):
+        _, terminated, info = chat_agent.step(make_user_msg(i))
+        assert not terminated
+        assert info["num_tokens"] < chat_agent.model_token_limit
+    assert len(chat_agent.stored_messages) == 11
+
+
+def test_chat_agent_overflow_summarize(monkeypatch, offline_encoding,
+                                       chat_agent):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs["messages"])
+        if "Summarize the conversation" in kwargs["messages"][-1]["content"]:
+            return make_response("they argued a lot")
+        return make_response("ok")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    chat_agent.overflow_policy = OverflowPolicy.SUMMARIZE
+    chat_agent.model_token_limit = chat_agent.get_num_tokens() + 100
+
+    for i in range(6):
+        _, terminated, info = chat_agent.step(make_user_msg(i))
+        assert not terminated
+        assert info["num_tokens"] < chat_agent.model_token_limit
+
+    summary = chat_agent.stored_messages[1]
+    assert summary.role == "system"
+    assert "they argued a lot" in summary.content
+    assert requests[-1][1]["content"] == summary.content
+    assert chat_agent.get_num_tokens() == num_tokens_from_messages([
+        message.to_openai_message() for message in chat_agent.stored_messages
+    ], chat_agent.model)
+
+
+def test_chat_agent_overflow_escalate(monkeypatch, offline_encoding):
+    engines = []
+
+    def create(**kwargs):
+        engines.append(kwargs["engine"])
+        return make_response("ok")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    chat_agent = ChatAgent(sys_msg, model=ModelType.GPT_3_5_TURBO,
+                           overflow_policy=OverflowPolicy.ESCALATE)
+
+    for i in range(5):
+        _, terminated, _ = chat_agent.step(make_user_msg(i, num_words=1000))
+        assert not terminated
+    assert engines[0] == ModelType.GPT_3_5_TURBO.value
+    assert engines[-1] == ModelType.GPT_4.value
+    assert chat_agent.model == ModelType.GPT_4
+
+
+def make_chunk(delta: dict, finish_reason: str = None) -> dict:
+    choice = dict(index=0, delta=delta, finish_reason=finish_reason)
+    return {"id": "chatcmpl-test", "choices": [choice]}
+
+
+def make_chunks(contents: list) -> list:
+    # Azure sends the content filter results first, without choices.
+    chunks = [dict(id="chatcmpl-test", choices=[])]
+    chunks.append(make_chunk({"role": "assistant"}))
+    chunks.extend(make_chunk({"content": content}) for content in contents)
+    chunks.append(make_chunk({}, "stop"))
+    return chunks
+
+
+def test_chat_agent_step_stream(monkeypatch, offline_encoding, chat_agent,
+                                user_msg):
+
+    def create(**kwargs):
+        assert kwargs["stream"]
+        return iter(make_chunks(["An ", "argument ", "here"]))
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    stream, terminated, info = chat_agent.step(user_msg, stream=True)
+    assert not terminated
+    assert info["usage"] is None
+    assert list(stream) == ["An ", "argument ", "here"]
+    assert stream.messages[0].content == "An argument here"
+    assert stream.messages[0].role == "assistant"
+    assert info["id"] == "chatcmpl-test"
+    assert info["termination_reasons"] == ["stop"]
+    assert info["usage"] == {
+        "prompt_tokens": info["num_tokens"],
+        "completion_tokens": 3,
+        "total_tokens": info["num_tokens"] + 3,
+    }
+
+
+def test_chat_agent_astep_stream(monkeypatch, offline_encoding, chat_agent,
+                                 user_msg):
+
+    async def acreate(**kwargs):
+
+        async def chunks():
+            for chunk in make_chunks(["An ", "argument"]):
+                yield chunk
+
+        return chunks()
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    async def consume():
+        stream, _, info = await chat_agent.astep(user_msg, stream=True)
+        return [delta async for delta in stream], stream, info
+
+    deltas, stream, info = asyncio.run(consume())
+    assert deltas == ["An ", "argument"]
+    assert stream.messages[0].content == "An argument"
+    assert info["usage"]["completion_tokens"] == 2
+
+
+def test_chat_agent_step_stream_error(monkeypatch, offline_encoding,
+                                      chat_agent, user_msg):
+
+    def chunks():
+        yield from make_chunks(["An "])[:3]
+        raise openai.error.APIError("reset", http_status=500)
+
+    monkeypatch.setattr(openai.ChatCompletion, "create",
+                        lambda **kwargs: chunks())
+    rate_limiters.reset()
+    circuit_breakers.reset()
+    rate_limiters.configure("gpt-4", max_concurrency=2)
+    limit = rate_limiters.get("gpt-4").concurrency
+
+    stream, _, _ = chat_agent.step(user_msg, stream=True)
+    deltas = iter(stream)
+    assert next(deltas) == "An "
+    # The stream holds the slot of its request until it is read.
+    assert limit.in_flight == 1
+    with pytest.raises(openai.error.APIError):
+        list(deltas)
+    assert limit.in_flight == 0
+    assert circuit_breakers.get("gpt-4").num_failures == 1
+    # The input is dropped from the history, like after a failed request.
+    assert len(chat_agent.stored_messages) == 1
+
+    monkeypatch.setattr(openai.ChatCompletion, "create",
+                        lambda **kwargs: iter(make_chunks(["Two"])))
+    stream, _, _ = chat_agent.step(user_msg, stream=True)
+    stream.close()
+    assert limit.in_flight == 0
+    assert len(chat_agent.stored_messages) == 1
+    rate_limiters.reset()
+    circuit_breakers.reset()
@@ -0,0 +1,62 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from langchain.llms.fake import FakeListLLM
+from langchain.schema import SystemMessage
+
+from wada.agents.debater_agent import ConversationSummaryWindowMemory
+
+
+def test_summary_window_memory():
+    llm = FakeListLLM(responses=[f"summary {i}" for i in range(1, 4)])
+    memory = ConversationSummaryWindowMemory(llm=llm, k=2,
+                                             return_messages=True,
+                                             memory_key="chat_history",
+                                             input_key="input")
+
+    for i in range(1, 6):
+        memory.save_context({"input": f"argument {i}"},
+                            {"output": f"rebuttal {i}"})
+        memory.prune()
+        assert len(memory.buffer) == 2 * min(i, 2)
+
+    history = memory.load_memory_variables({})["chat_history"]
+    assert isinstance(history[0], SystemMessage)
+    assert history[0].content == "summary 3"
+    contents = [message.content for message in history[1:]]
+    assert contents == ["argument 4", "rebuttal 4", "argument 5", "rebuttal 5"]
+
+    memory.clear()
+    assert memory.load_memory_variables({})["chat_history"] == []
+
+
+def test_summary_window_memory_rounds():
+    llm = FakeListLLM(responses=["summary"])
+    memory = ConversationSummaryWindowMemory(llm=llm, k=1,
+                                             return_messages=True,
+                                             memory_key="chat_history",
+                                             input_key="input")
+    # Every step of the ReAct loop of a round saves an exchange.
+    for output in ("Thought: search", "Final Answer: rebuttal 1"):
+        memory.save_context({"input": "argument 1"}, {"output": output})
+    asyncio.run(memory.aprune())
+    assert len(memory.buffer) == 4
+
+    memory.save_context({"input": "argument 2"}, {"output": "rebuttal 2"})
+    asyncio.run(memory.aprune())
+    assert memory.moving_summary_buffer == "summary"
+    contents = [message.content for message in memory.buffer]
+    assert contents == ["argument 2", "rebuttal 2"]
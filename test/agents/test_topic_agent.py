@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import re
+
+import openai
 import pytest
 
 from wada.agents import TopicAgent
@@ -49,3 +52,52 @@ def test_specify_topic(topic_agent: TopicAgent):
 def test_abbreviate_topic(topic_agent: TopicAgent):
     topic_abbr = topic_agent.abbreviate_topic()
     assert not len(topic_abbr) > 100
+
+
+def test_topic_aprepare(monkeypatch, offline_encoding, topic_agent):
+    replies = {
+        "break down": "PRO: Take the promotion\nCON: Stay in the role",
+        "aspects of information": "1. Salary\n2. Family time",
+        "collect enough information": "Promotions pay more. Roles vary.",
+        "subjective questions": "<QUESTION> How much do you travel now?",
+    }
+    requests = []
+    in_flight = []
+    concurrency = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs["messages"])
+        in_flight.append(1)
+        concurrency.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        content = next(reply for key, reply in replies.items()
+                       if key in kwargs["messages"][-1]["content"])
+        choice = dict(message=dict(role="assistant", content=content),
+                      finish_reason="stop")
+        return dict(id="chatcmpl-test", usage=None, choices=[choice])
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    is_summary, content = asyncio.run(topic_agent.aprepare())
+    assert not is_summary
+    assert content == replies["subjective questions"]
+    assert topic_agent.topic.pro == "Take the promotion"
+    assert topic_agent.topic.con == "Stay in the role"
+    assert topic_agent.topic.specified_aspects == replies[
+        "aspects of information"]
+    assert topic_agent.topic.background == replies[
+        "collect enough information"]
+
+    # Breakdown and aspects run together, then background and question.
+    assert len(requests) == 4
+    assert max(concurrency) == 2
+    assert [len(messages) for messages in requests] == [2, 2, 4, 4]
+    assert requests[2][2]["content"] == replies["aspects of information"]
+
+    stored = [message.content for message in topic_agent.stored_messages]
+    assert len(stored) == 9
+    assert stored[2] == replies["break down"]
+    assert stored[4] == replies["aspects of information"]
+    assert stored[6] == replies["collect enough information"]
+    assert stored[8] == replies["subjective questions"]
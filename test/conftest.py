@@ -0,0 +1,38 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Iterator, List
+
+import pytest
+import tiktoken
+
+from wada.utils import get_model_encoding
+
+
+class WhitespaceEncoding:
+    r"""A stand-in for a tiktoken encoding that does not need to download
+    BPE ranks, one token per whitespace separated word."""
+
+    def encode(self, text: str) -> List[str]:
+        return text.split()
+
+
+@pytest.fixture
+def offline_encoding(monkeypatch) -> Iterator[WhitespaceEncoding]:
+    encoding = WhitespaceEncoding()
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: encoding)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    get_model_encoding.cache_clear()
+    yield encoding
+    get_model_encoding.cache_clear()
@@ -21,6 +21,7 @@ def test_debate_prompt_template_dict():
     assert isinstance(template_dict.DEBATER_PROMPT, TextPrompt)
     assert isinstance(template_dict.HOST_DECISION_PROMPT, TextPrompt)
     assert isinstance(template_dict.HOST_JUDGE_PROMPT, TextPrompt)
+    assert isinstance(template_dict.HISTORY_SUMMARIZE_PROMPT, TextPrompt)
     assert isinstance(template_dict.HOST_PROMPT, TextPrompt)
     assert isinstance(template_dict.TOPIC_BREAK_DOWN_PROMPT, TextPrompt)
     assert isinstance(template_dict.TOPIC_COLLECT_BG_PROMPT, TextPrompt)
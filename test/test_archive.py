@@ -0,0 +1,117 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+from jinja2 import Template
+from test_debate_simulator import ScriptedDebater, ScriptedHost
+
+import wada.debate_simulator
+from wada.archive import ArchivedDebate, TranscriptArchive
+from wada.debate_simulator import DebateSimulator
+from wada.messages import UserChatMessage
+from wada.topic import Topic
+from wada.typing import RoleType, TopicType
+
+TEMPLATE_FILE = Path(__file__).parent.parent / "app" / "template.md"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = TranscriptArchive(str(tmp_path / "archive.db"))
+    yield archive
+    archive.close()
+
+
+def get_debate(category: TopicType, model: str,
+               created_at: float) -> ArchivedDebate:
+    topic = Topic(content="A or B?", pro="A", con="B", catagory=category)
+    messages = [
+        UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                        content="Go"),
+        UserChatMessage(role_name="Proposition", role_type=RoleType.DEBATER,
+                        content="A is cheaper.\nA is closer."),
+    ]
+    return ArchivedDebate(
+        topic, model, messages, judgement="A wins",
+        usage=dict(prompt_tokens=10, completion_tokens=5, total_tokens=15),
+        timings=dict(debaters=1.5, host=0.5), created_at=created_at)
+
+
+def test_archive_find(archive):
+    # 2023-06-27 and 2023-07-01 in UTC.
+    first = get_debate(TopicType.OTHER, "gpt-4", 1687870000)
+    second = get_debate(TopicType.FINANCIAL_DECISIONS, "gpt-35-turbo",
+                        1688200000)
+    assert archive.add(first) == first.id
+    archive.add(second)
+
+    loaded = archive.get(first.id)
+    assert loaded == first
+    assert loaded.date == "2023-06-27"
+    assert [debate.id for debate in archive.find()] == [first.id, second.id]
+    assert [
+        debate.id
+        for debate in archive.find(category=TopicType.FINANCIAL_DECISIONS)
+    ] == [second.id]
+    assert archive.count(model="gpt-4") == 1
+    assert archive.count(since="2023-06-28") == 1
+    assert archive.count(until="2023-06-27") == 1
+    with pytest.raises(KeyError):
+        archive.get(3)
+
+
+def test_archive_export(archive, tmp_path):
+    debate = get_debate(TopicType.OTHER, "gpt-4", 1687870000)
+    archive.add(debate)
+    archive.add(get_debate(TopicType.OTHER, "gpt-35-turbo", 1687870000))
+
+    path = str(tmp_path / "debates.jsonl.gz")
+    assert archive.export_jsonl(path, model="gpt-4") == 1
+    with gzip.open(path, "rt") as f:
+        record, = [json.loads(line) for line in f]
+    assert record["topic"]["catagory"] == "Other"
+    assert record["usage"]["total_tokens"] == 15
+    assert record["messages"][1]["content"] == "A is cheaper.\nA is closer."
+
+    template = Template(TEMPLATE_FILE.read_text())
+    markdown = archive.render_markdown(debate.id, template)
+    assert markdown.startswith("# A or B?")
+    assert "> A is cheaper.\n\n> A is closer." in markdown
+    assert "A wins" in markdown
+    # The archived transcript is not changed by rendering.
+    message = archive.get(debate.id).messages[1]
+    assert message.content == "A is cheaper.\nA is closer."
+
+
+def test_archive_simulator(archive, monkeypatch, offline_encoding):
+    monkeypatch.setattr(wada.debate_simulator, "DebaterAgent", ScriptedDebater)
+    topic = Topic(content="A or B?", pro="A", con="B",
+                  catagory=TopicType.LIFESTYLE_HEALTH)
+    simulator = DebateSimulator(topic=topic, turn_limit=5)
+    simulator.host = ScriptedHost(end_at=2)
+    simulator.reset()
+    while not simulator.terminated:
+        simulator.step()
+
+    debate = archive.get(archive.add(ArchivedDebate.from_simulator(simulator)))
+    assert debate.model == simulator.model_type.value
+    assert len(debate.messages) == len(simulator.history) == 5
+    assert debate.judgement == "B wins"
+    assert debate.usage["total_tokens"] == 25
+    assert set(debate.timings) == {"debaters", "host"}
+    assert archive.count(category=TopicType.LIFESTYLE_HEALTH) == 1
@@ -0,0 +1,98 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from benchmarks.run_benchmarks import (
+    LatencyModel,
+    find_regressions,
+    main,
+    parse_args,
+    run_scenario,
+)
+from wada.rate_limit import rate_limiters
+
+
+@pytest.fixture(autouse=True)
+def limiters():
+    rate_limiters.reset()
+    yield
+    rate_limiters.reset()
+
+
+def test_latency_model():
+    latency = LatencyModel(1.0, sigma=0.5, per_completion_token=0.01, seed=0)
+    latencies = sorted(latency(completion_tokens=100) for _ in range(1000))
+    # Log-normal around the median, with a tail to the right.
+    assert 1.8 < latencies[500] < 2.2
+    assert latencies[990] - latencies[500] > latencies[500] - latencies[10]
+    assert LatencyModel(1.0, scale=0.0)() == 0.0
+
+
+def test_debate_benchmark(offline_encoding):
+    args = parse_args([
+        "--repetitions", "2", "--warmup", "0", "--latency-scale", "0.001",
+        "--num-rounds", "3"
+    ])
+    result = run_scenario("debate", args)
+    # Two debaters and the host per round.
+    assert result["calls_per_session"] == 9
+    assert result["rounds"] == 3
+    assert set(result["phases"]) == {"debater_a", "debater_b", "host"}
+    assert result["phases"]["host"]["calls"] == 3
+    assert result["prompt_growth"] > 1
+    assert result["llm_time"] > 0
+    assert result["memory_peak_kib"] > 0
+
+    baseline = {"debate": dict(result, calls_per_session=6)}
+    regressions = find_regressions({"debate": result}, baseline, 0.2)
+    assert regressions == ["debate.calls_per_session: 9.00 > 6.00 (+20%)"]
+
+
+def test_topic_benchmark(offline_encoding, tmp_path, capsys):
+    output = tmp_path / "results.json"
+    assert main([
+        "--scenarios", "topic", "--repetitions", "1", "--latency-scale", "0",
+        "--output",
+        str(output)
+    ]) == 0
+    result = json.loads(output.read_text())["topic"]
+    # The setup, a question, the summary and its rephrasing.
+    assert result["calls_per_session"] == 6
+    assert set(result["phases"]) == {
+        "break_down", "specify", "collect_bg", "collect_pref"
+    }
+    assert "== topic ==" in capsys.readouterr().out
+
+    # Only the counts are compared, the timings and the memory peak vary
+    # from run to run.
+    counts = ("calls_per_session", "prompt_tokens_per_session",
+              "prompt_growth")
+    baseline_path = tmp_path / "baseline.json"
+    baseline = {metric: result[metric] for metric in counts}
+    baseline_path.write_text(json.dumps({"topic": baseline}))
+    args = [
+        "--scenarios", "topic", "--repetitions", "1", "--latency-scale", "0",
+        "--baseline",
+        str(baseline_path)
+    ]
+    assert main(args) == 0
+
+    baseline["calls_per_session"] = 4
+    baseline_path.write_text(json.dumps({"topic": baseline}))
+    assert main(args) == 1
+    assert ("Regression: topic.calls_per_session: 6.00 > 4.00 (+20%)"
+            in capsys.readouterr().out)
@@ -0,0 +1,214 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import wada.cache
+from wada.agents import ChatAgent
+from wada.cache import ResponseCache, ToolResultCache
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.typing import RoleType
+
+
+def make_response(content: str) -> dict:
+    return {
+        "id":
+        "chatcmpl-test",
+        "usage": {
+            "total_tokens": 15
+        },
+        "choices": [{
+            "message": {
+                "role": "assistant",
+                "content": content
+            },
+            "finish_reason": "stop",
+        }],
+    }
+
+
+def test_response_cache_key():
+    messages = [{"role": "user", "content": "Hi"}]
+    key = ResponseCache.make_key("gpt-4", messages, temperature=0.0)
+    assert key == ResponseCache.make_key("gpt-4", messages, temperature=0.0,
+                                         api_key="secret")
+    assert key != ResponseCache.make_key("gpt-4", messages, temperature=1.0)
+    assert key != ResponseCache.make_key("gpt-35-turbo", messages,
+                                         temperature=0.0)
+
+
+def test_response_cache_lru_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_size=10**9)
+    for i in range(3):
+        cache.set(str(i), make_response("x" * 1000 + str(i)))
+    entry_size = cache.stats["size"] // 3
+
+    cache.max_size = entry_size * 3
+    assert cache.get("0") is not None
+    cache.set("3", make_response("x" * 1000 + "3"))
+
+    assert cache.get("1") is None
+    assert cache.get("0")["choices"][0]["message"]["content"].endswith("0")
+    assert len(cache) == 3
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+
+def fill_cache(path: str, offset: int) -> None:
+    cache = ResponseCache(path)
+    for i in range(20):
+        cache.set(f"{offset}-{i}", make_response(str(i)))
+
+
+def test_response_cache_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    processes = [
+        multiprocessing.Process(target=fill_cache, args=(path, offset))
+        for offset in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert len(ResponseCache(path)) == 80
+
+
+def test_response_cache_threads(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.set("hit", make_response("A"))
+
+    def get(index: int) -> None:
+        cache.get("hit" if index % 2 else f"miss-{index}")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(get, range(400)))
+    assert cache.stats["hits"] == 200
+    assert cache.stats["misses"] == 200
+
+
+def test_response_cache_off_loop(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    threads = []
+    get = cache.get
+
+    def record_get(key):
+        threads.append(threading.get_ident())
+        return get(key)
+
+    cache.get = record_get
+
+    async def main():
+        await cache.aset("key", make_response("A"))
+        return await cache.aget("key")
+
+    assert asyncio.run(main()) == make_response("A")
+    assert threads and threading.get_ident() not in threads
+
+
+def test_chat_agent_response_cache(monkeypatch, offline_encoding, tmp_path):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return make_response("PRO: A\nCON: B")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                          content="Break down the topic.")
+
+    for _ in range(3):
+        agent = ChatAgent(sys_msg, temperature=0.0, response_cache=cache)
+        replies, _, _ = agent.step(msg)
+        assert replies[0].content == "PRO: A\nCON: B"
+
+    assert len(calls) == 1
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+
+
+def test_tool_result_cache_normalizes_queries():
+    cache = ToolResultCache()
+    calls = []
+
+    def search(query: str) -> str:
+        calls.append(query)
+        return f"results for {query}"
+
+    cached_search = cache.wrap("Search", search)
+    assert cached_search("Cost of living  Beijing") == cached_search(
+        " cost of living beijing")
+    assert cached_search("Cost of living Chengdu") != cached_search(
+        "Cost of living Beijing")
+    assert len(calls) == 2
+    assert cache.stats["hits"] == 2
+
+
+def test_tool_result_cache_ttl_and_lru(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(wada.cache.time, "time", lambda: now[0])
+    cache = ToolResultCache(ttl=60.0, max_entries=2)
+
+    cache.set("Search", "a", "A")
+    cache.set("Search", "b", "B")
+    assert cache.get("Search", "a") == "A"
+    cache.set("Search", "c", "C")
+    assert cache.get("Search", "b") is None
+    assert cache.get("Search", "a") == "A"
+
+    now[0] += 61.0
+    assert cache.get("Search", "a") is None
+
+
+def test_tool_result_cache_persistent_tier(tmp_path):
+    persistent = ResponseCache(str(tmp_path / "tools.sqlite"))
+    ToolResultCache(persistent=persistent).set("Arxiv", "llm debate", "paper")
+
+    cache = ToolResultCache(persistent=persistent)
+    assert cache.get("Arxiv", "LLM debate") == "paper"
+
+
+def test_tool_result_cache_single_flight():
+    cache = ToolResultCache()
+    calls = []
+    started = threading.Event()
+
+    def slow_search(query: str) -> str:
+        calls.append(query)
+        started.set()
+        time.sleep(0.2)
+        return "results"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        first = executor.submit(cache.run, "Search", "query", slow_search)
+        started.wait()
+        others = [
+            executor.submit(cache.run, "Search", "query", slow_search)
+            for _ in range(7)
+        ]
+        results = [first.result()] + [other.result() for other in others]
+
+    assert results == ["results"] * 8
+    assert len(calls) == 1
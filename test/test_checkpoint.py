@@ -0,0 +1,110 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from typing import Any, Dict
+
+import pytest
+
+from wada.backends import FakeBackend
+from wada.checkpoint import CheckpointFile
+from wada.debate import Debate
+from wada.messages import (
+    ChatMessage,
+    SystemMessage,
+    UserChatMessage,
+    message_from_dict,
+)
+from wada.rate_limit import rate_limiters
+from wada.topic import Topic
+from wada.typing import RoleType, TopicType
+
+
+@pytest.fixture(autouse=True)
+def limiters():
+    rate_limiters.reset()
+    yield
+    rate_limiters.reset()
+
+
+def get_debate_kwargs(backend: FakeBackend) -> Dict[str, Any]:
+    return dict(debater_a_agent_kwargs=dict(backend=backend),
+                debater_b_agent_kwargs=dict(backend=backend),
+                host_kwargs=dict(backend=backend))
+
+
+def test_message_from_dict():
+    messages = [
+        SystemMessage(role_name="Host", role_type=RoleType.HOST,
+                      content="Summary"),
+        UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                        meta_dict={"topic": "A or B?"}, content="Go"),
+        ChatMessage(role_name="A", role_type=RoleType.DEBATER, meta_dict=None,
+                    role="assistant", content="Argument"),
+    ]
+    for message in messages:
+        assert message_from_dict(message.to_dict()) == message
+
+
+def test_checkpoint_file(tmp_path):
+    checkpoint_file = CheckpointFile(str(tmp_path / "debate.json"))
+    assert checkpoint_file.load() is None
+    checkpoint_file.save({"round": 1})
+    checkpoint_file.save({"round": 2})
+    assert checkpoint_file.load() == {"version": 1, "round": 2}
+    # The file holds the latest state only.
+    assert os.listdir(tmp_path) == ["debate.json"]
+
+
+def test_debate_resume(offline_encoding, tmp_path):
+    checkpoint_path = str(tmp_path / "debate.json")
+    topic = Topic(content="A or B?", pro="A", con="B",
+                  catagory=TopicType.FINANCIAL_DECISIONS)
+    debate = Debate(topic, checkpoint_path=checkpoint_path,
+                    **get_debate_kwargs(FakeBackend.for_debate()))
+    debate.init_chat()
+    debate.step(debate.last_reply)
+
+    backend = FakeBackend.for_debate()
+    resumed = Debate.from_checkpoint(checkpoint_path,
+                                     **get_debate_kwargs(backend))
+    assert resumed.topic == topic
+    assert resumed.round == 2
+    assert resumed.last_reply.to_dict() == debate.last_reply.to_dict()
+    agents = [debate.debater_a_agent, debate.debater_b_agent]
+    resumed_agents = [resumed.debater_a_agent, resumed.debater_b_agent]
+    for agent, resumed_agent in zip(agents, resumed_agents):
+        assert resumed_agent.get_state() == agent.get_state()
+        assert resumed_agent.stored_num_tokens == agent.stored_num_tokens
+
+    resumed.step(resumed.last_reply)
+    # Only the requests of the new round are sent.
+    assert backend.num_requests == 2
+    assert CheckpointFile(checkpoint_path).load()["round"] == 3
+
+
+def test_debate_judge(offline_encoding, tmp_path):
+    checkpoint_path = str(tmp_path / "debate.json")
+    topic = Topic(content="A or B?", pro="A", con="B",
+                  catagory=TopicType.FINANCIAL_DECISIONS)
+    debate = Debate(topic, checkpoint_path=checkpoint_path,
+                    **get_debate_kwargs(FakeBackend.for_debate(num_rounds=1)))
+    debate.init_chat()
+    debate_continue, judgement = debate.judge("Proposition: A\n")
+
+    assert not debate_continue
+    # The final verdict is saved with the round it ends.
+    state = CheckpointFile(checkpoint_path).load()
+    assert state["round"] == 1
+    assert state["host"]["judgement"] == judgement
@@ -0,0 +1,244 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+from typing import Dict, List, Optional
+
+import pytest
+
+import wada.debate_simulator
+from wada.checkpoint import CheckpointFile
+from wada.debate_simulator import DebateSimulator
+from wada.events import (
+    DebaterReplied,
+    DebateTerminated,
+    HostVerdict,
+    RoundStarted,
+)
+from wada.topic import Topic
+
+
+class ScriptedDebater:
+
+    def __init__(self, sys_msg_dict: Dict[str, str], **kwargs) -> None:
+        self.name = sys_msg_dict["stance"]
+        self.inputs: List[str] = []
+        self.usage = {"total_tokens": 10}
+
+    def reset(self) -> None:
+        self.inputs = []
+
+    def step(self, input: str) -> str:
+        self.inputs.append(input)
+        return f"{self.name} argument {len(self.inputs)}"
+
+    async def astep(self, input: str) -> str:
+        await asyncio.sleep(0)
+        return self.step(input)
+
+    def checkpoint(self) -> int:
+        return len(self.inputs)
+
+    def rollback(self, checkpoint: int) -> None:
+        del self.inputs[checkpoint:]
+
+    def get_state(self, checkpoint: Optional[int] = None) -> Dict:
+        return {"inputs": self.inputs[:checkpoint]}
+
+    def set_state(self, state: Dict) -> None:
+        self.inputs = list(state["inputs"])
+
+
+class ScriptedHost:
+
+    def __init__(self, end_at: int) -> None:
+        self.end_at = end_at
+        self.calls = 0
+        self.judgement = ""
+        self.usage = {"total_tokens": 5}
+
+    def step(self, messages: str):
+        self.calls += 1
+        if self.calls >= self.end_at:
+            self.judgement = "B wins"
+            return (False, self.judgement)
+        return (True, "<<<CONTINUE>>>")
+
+    async def astep(self, messages: str):
+        await asyncio.sleep(0)
+        return self.step(messages)
+
+    def get_state(self) -> Dict:
+        return {"calls": self.calls, "judgement": self.judgement}
+
+    def set_state(self, state: Dict) -> None:
+        self.calls = state["calls"]
+        self.judgement = state["judgement"]
+
+
+@pytest.fixture
+def simulator(monkeypatch, offline_encoding) -> DebateSimulator:
+    monkeypatch.setattr(wada.debate_simulator, "DebaterAgent", ScriptedDebater)
+    topic = Topic(content="A or B?", pro="A", con="B")
+    debate = DebateSimulator(topic=topic, turn_limit=5)
+    debate.host = ScriptedHost(end_at=3)
+    return debate
+
+
+async def collect(debate: DebateSimulator) -> list:
+    return [event async for event in debate.arun()]
+
+
+def test_debate_simulator_arun_events(simulator: DebateSimulator):
+    events = asyncio.run(collect(simulator))
+
+    assert isinstance(events[0], RoundStarted)
+    assert isinstance(events[1], DebaterReplied)
+    assert events[1].role_name == simulator.debater_a_name
+    assert isinstance(events[2], DebaterReplied)
+    assert events[2].role_name == simulator.debater_b_name
+    assert isinstance(events[3], HostVerdict)
+    assert events[3].debate_continue
+
+    last = events[-1]
+    assert isinstance(last, DebateTerminated)
+    assert last.round == 3
+    assert last.reason == "host_end"
+    assert last.judgement == "B wins"
+    assert len(simulator.history) == 7
+    assert simulator.debater_a_agent.inputs[1] == "B argument 1"
+
+
+def test_debate_simulator_arun_turn_limit(simulator: DebateSimulator):
+    simulator.host = ScriptedHost(end_at=100)
+    events = asyncio.run(collect(simulator))
+
+    rounds = [event for event in events if isinstance(event, RoundStarted)]
+    assert len(rounds) == simulator.turn_limit
+    assert events[-1].reason == "turn_limit"
+    assert events[-1].round == simulator.turn_limit
+
+
+def test_debate_simulator_pipelined_step(simulator: DebateSimulator):
+    simulator.pipelined = True
+    simulator.reset()
+
+    replies = []
+    while not simulator.terminated:
+        replies.append(simulator.step())
+    # The worker exits once the speculative round is rolled back.
+    assert simulator.executor is None
+    simulator.stop_speculation()
+
+    assert len(replies) == 3
+    assert replies[1][:2] == ("A argument 2", "B argument 2")
+    assert replies[-1][2] == "B wins"
+    assert simulator.termination_reason == "host_end"
+    assert len(simulator.history) == 7
+    # The speculative fourth round is rolled back.
+    assert simulator.debater_a_agent.inputs == [
+        "Now give me your first argument and explanation", "B argument 1",
+        "B argument 2"
+    ]
+    assert len(simulator.debater_b_agent.inputs) == 3
+
+
+def test_debate_simulator_pipelined_host_error(simulator: DebateSimulator):
+    simulator.pipelined = True
+    simulator.reset()
+    started, release = threading.Event(), threading.Event()
+    debater_step = simulator.debater_b_agent.step
+
+    def step(input: str) -> str:
+        if len(simulator.debater_b_agent.inputs) == 1:
+            started.set()
+            release.wait()
+        return debater_step(input)
+
+    def host_step(messages: str):
+        started.wait()
+        raise TimeoutError("host")
+
+    simulator.debater_b_agent.step = step
+    simulator.host.step = host_step
+    with pytest.raises(TimeoutError):
+        simulator.step()
+    assert simulator.speculative_round is None
+
+    release.set()
+    simulator.stop_speculation()
+    # The round that was running when the host failed is rolled back.
+    assert len(simulator.debater_a_agent.inputs) == 1
+    assert len(simulator.debater_b_agent.inputs) == 1
+    simulator.reset()
+    assert simulator.executor is None
+
+
+def test_debate_simulator_pipelined_arun(simulator: DebateSimulator):
+    sequential = asyncio.run(collect(simulator))
+
+    log = []
+    debater_astep = ScriptedDebater.astep
+    host_astep = ScriptedHost.astep
+
+    async def logged_debater_astep(self, input: str) -> str:
+        log.append(f"{self.name} start")
+        return await debater_astep(self, input)
+
+    async def slow_host_astep(self, messages: str):
+        log.append("host start")
+        await asyncio.sleep(0.01)
+        log.append("host end")
+        return await host_astep(self, messages)
+
+    simulator.debater_a_agent.astep = logged_debater_astep.__get__(
+        simulator.debater_a_agent)
+    simulator.host = ScriptedHost(end_at=3)
+    simulator.host.astep = slow_host_astep.__get__(simulator.host)
+    simulator.pipelined = True
+    simulator.reset()
+    pipelined = asyncio.run(collect(simulator))
+
+    assert pipelined == sequential
+    # The second round starts while the host judges the first.
+    assert log.index("A start", 1) < log.index("host end")
+    assert len(simulator.debater_a_agent.inputs) == 3
+    assert len(simulator.debater_b_agent.inputs) == 3
+
+
+def test_debate_simulator_resume(simulator: DebateSimulator, tmp_path):
+    checkpoint_path = str(tmp_path / "debate.json")
+    simulator.checkpoint_file = CheckpointFile(checkpoint_path)
+    simulator.reset()
+    simulator.step()
+    simulator.step()
+    # A save cut short by a crash leaves the previous state.
+    with open(f"{checkpoint_path}.tmp", "w") as f:
+        f.write('{"version": 1, "round": 3')
+
+    resumed = DebateSimulator(topic=simulator.topic, turn_limit=5,
+                              checkpoint_path=checkpoint_path)
+    resumed.host = ScriptedHost(end_at=3)
+    assert resumed.resume()
+    assert resumed.round == 2
+    assert resumed.history == simulator.history
+    assert resumed.host.calls == 2
+    assert resumed.debater_b_agent.inputs == simulator.debater_b_agent.inputs
+
+    asyncio.run(collect(resumed))
+    assert resumed.round == 3
+    assert resumed.termination_reason == "host_end"
+    assert resumed.debater_a_agent.inputs[-1] == "B argument 2"
+    assert CheckpointFile(checkpoint_path).load()["round"] == 3
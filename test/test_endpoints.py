@@ -0,0 +1,188 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import random
+
+import openai
+import openai.error
+import pytest
+
+from wada.agents import ChatAgent
+from wada.endpoints import Endpoint, EndpointPool
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.rate_limit import rate_limiters
+from wada.retry import RetryPolicy, circuit_breakers
+from wada.typing import RoleType, RoutingStrategy
+
+
+@pytest.fixture(autouse=True)
+def registries():
+    rate_limiters.reset()
+    circuit_breakers.reset()
+    yield
+    rate_limiters.reset()
+    circuit_breakers.reset()
+
+
+@pytest.fixture
+def pool() -> EndpointPool:
+    return EndpointPool([
+        Endpoint("eastus", "https://east.example.com", "east-key", weight=2),
+        Endpoint("westus", "https://west.example.com", "west-key",
+                 deployments={"gpt-4": "gpt-4-west"}),
+    ])
+
+
+def make_response(content: str) -> dict:
+    message = dict(role="assistant", content=content)
+    usage = dict(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    return dict(id="chatcmpl-test", usage=usage,
+                choices=[dict(message=message, finish_reason="stop")])
+
+
+def test_endpoint_pool_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_VERSION", "2023-05-15")
+    monkeypatch.setenv("EAST_KEY", "east-key")
+    endpoint = dict(name="eastus", api_base="https://east.example.com",
+                    api_key_env="EAST_KEY")
+    config = dict(strategy="weighted", cooldown=5, endpoints=[endpoint])
+    path = tmp_path / "endpoints.json"
+    path.write_text(json.dumps(config))
+    monkeypatch.setenv("WADA_ENDPOINTS_FILE", str(path))
+
+    pool = EndpointPool.from_env()
+    assert pool.strategy == RoutingStrategy.WEIGHTED
+    assert pool.cooldown == 5
+    endpoint = pool.endpoints[0]
+    assert endpoint.get_params("gpt-4") == {
+        "engine": "gpt-4",
+        "api_type": "azure",
+        "api_version": "2023-05-15",
+        "api_key": "east-key",
+        "api_base": "https://east.example.com",
+    }
+    assert endpoint.get_key("gpt-4") == "eastus/gpt-4"
+
+    monkeypatch.delenv("WADA_ENDPOINTS_FILE")
+    assert EndpointPool.from_env() is None
+
+
+def test_endpoint_pool_routing(pool):
+    east, west = pool.endpoints
+    # Least outstanding requests for the weight of the endpoint.
+    assert pool.acquire() is east
+    assert pool.acquire() is west
+    assert pool.acquire() is east
+    for endpoint in (east, west, east):
+        pool.release(endpoint)
+
+    pool.strategy = RoutingStrategy.WEIGHTED
+    random.seed(0)
+    picks = [pool.select() for _ in range(300)]
+    assert 150 < picks.count(east) < 250
+
+
+def test_endpoint_pool_failover(pool):
+    east, west = pool.endpoints
+    pool.max_failures = 2
+    for _ in range(2):
+        with pytest.raises(openai.error.APIError):
+            with pool.use(exclude=[west]):
+                raise openai.error.APIError("oops", http_status=500)
+    assert not east.available
+    assert pool.select() is west
+    assert pool.select(exclude=[west]) is west
+
+    error = openai.error.RateLimitError("slow down", http_status=429,
+                                        headers={"Retry-After": "60"})
+    with pytest.raises(openai.error.RateLimitError):
+        with pool.use():
+            raise error
+    # Every endpoint is out of the rotation, the first one to return is used.
+    assert pool.select() is east
+
+    probed = []
+    results = pool.check_health(probe=probed.append)
+    assert probed == [east, west]
+    assert results == {east: True, west: True}
+    assert east.available and west.available
+
+
+def test_chat_agent_endpoint_pool(monkeypatch, offline_encoding, pool):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        if kwargs["api_base"] == "https://east.example.com":
+            raise openai.error.ServiceUnavailableError("down", http_status=503)
+        return make_response("Argument")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    chat_agent = ChatAgent(sys_msg, endpoint_pool=pool,
+                           retry_policy=RetryPolicy(min_wait=0, max_wait=0))
+    user_msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                               content="Give me your first argument.")
+
+    replies, _, _ = chat_agent.step(user_msg)
+    assert replies[0].content == "Argument"
+    # The retry failed over to the other endpoint and its deployment.
+    assert [request["api_key"] for request in requests] == [
+        "east-key",
+        "west-key",
+    ]
+    assert requests[-1]["engine"] == "gpt-4-west"
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [0, 0]
+    assert rate_limiters.get("westus/gpt-4-west") is not None
+
+
+def test_chat_agent_endpoint_breakers(monkeypatch, offline_encoding, pool):
+    errors = [
+        openai.error.ServiceUnavailableError("down", http_status=503),
+        openai.error.RateLimitError("slow down", http_status=429,
+                                    headers={"Retry-After": "60"}),
+    ]
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs["api_key"])
+        if kwargs["api_base"] == "https://east.example.com":
+            raise errors.pop(0)
+        return make_response("Argument")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    chat_agent = ChatAgent(sys_msg, endpoint_pool=pool,
+                           retry_policy=RetryPolicy(min_wait=0, max_wait=0))
+    for content in ("Give me your first argument.", "And the next one?"):
+        user_msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                                   content=content)
+        replies, _, _ = chat_agent.step(user_msg)
+        assert replies[0].content == "Argument"
+
+    # The failures of the east endpoint neither pause nor open the circuit
+    # of the deployment on the west endpoint.
+    assert requests == ["east-key", "west-key", "east-key", "west-key"]
+    assert circuit_breakers.get("eastus/gpt-4").num_failures == 1
+    assert circuit_breakers.get("westus/gpt-4-west").num_failures == 0
+    assert "gpt-4" not in circuit_breakers.breakers
+    assert rate_limiters.get("eastus/gpt-4").paused_until > 0
+    assert rate_limiters.get("westus/gpt-4-west").paused_until == 0
+    assert "gpt-4" not in rate_limiters.limiters
@@ -0,0 +1,143 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from wada.agents import ChatAgent, HostAgent
+from wada.endpoints import Endpoint, EndpointPool
+from wada.generators import SystemMessageGenerator
+from wada.hedging import HedgePolicy, LatencyWindow
+from wada.messages import UserChatMessage
+from wada.rate_limit import rate_limiters
+from wada.typing import RoleType
+
+
+@pytest.fixture(autouse=True)
+def limiters():
+    rate_limiters.reset()
+    yield
+    rate_limiters.reset()
+
+
+def make_response(content: str) -> dict:
+    message = dict(role="assistant", content=content)
+    usage = dict(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    return dict(id="chatcmpl-test", usage=usage,
+                choices=[dict(message=message, finish_reason="stop")])
+
+
+def test_hedge_policy_delay():
+    window = LatencyWindow(size=10)
+    for latency in range(20):
+        window.add(float(latency))
+    assert len(window) == 10
+    assert window.quantile(0.9) == 19.0
+    assert window.quantile(0.5) == 15.0
+
+    policy = HedgePolicy(initial_delay=3.0, min_delay=0.5, min_samples=5)
+    assert policy.get_delay("gpt-4") == 3.0
+    for latency in (1.0, 2.0, 3.0, 4.0, 5.0):
+        policy.record_latency("gpt-4", latency)
+    assert policy.get_delay("gpt-4") == 5.0
+    assert policy.get_delay("gpt-35-turbo") == 3.0
+
+
+def test_hedge_policy_call():
+    policy = HedgePolicy(max_hedge_rate=1.0, initial_delay=0.05)
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+
+    assert policy.call("gpt-4", func) == "fast"
+    assert policy.stats == {"requests": 1, "hedged": 1, "hedge_wins": 1}
+
+    # A request answering within the delay is not hedged.
+    assert policy.call("gpt-4", lambda: "quick") == "quick"
+    assert policy.stats["hedged"] == 1
+
+    # A request that cannot be hedged runs on the calling thread.
+    policy.max_hedge_rate = 0.0
+    assert policy.call("gpt-4", threading.get_ident) == threading.get_ident()
+
+
+def test_hedge_policy_rate_cap():
+    policy = HedgePolicy(max_hedge_rate=0.5, initial_delay=0.01)
+    calls = []
+
+    def func():
+        calls.append(None)
+        time.sleep(0.05)
+        return "ok"
+
+    for _ in range(4):
+        assert policy.call("gpt-4", func) == "ok"
+    # Only every other request may be hedged.
+    assert policy.num_hedged == 2
+    assert len(calls) == 6
+
+
+def test_chat_agent_hedged_astep(monkeypatch, offline_encoding):
+    cancelled = []
+
+    async def acreate(**kwargs):
+        try:
+            if kwargs["api_base"] == "https://east.example.com":
+                await asyncio.sleep(5)
+            return make_response(kwargs["api_base"])
+        except asyncio.CancelledError:
+            cancelled.append(kwargs["api_base"])
+            raise
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    pool = EndpointPool([
+        Endpoint("eastus", "https://east.example.com"),
+        Endpoint("westus", "https://west.example.com"),
+    ])
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    chat_agent = ChatAgent(
+        sys_msg, endpoint_pool=pool,
+        hedge_policy=HedgePolicy(max_hedge_rate=1.0, initial_delay=0.05))
+    user_msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                               content="Give me your first argument.")
+
+    start = time.monotonic()
+    replies, _, _ = asyncio.run(chat_agent.astep(user_msg))
+    assert time.monotonic() - start < 2
+    assert replies[0].content == "https://west.example.com"
+    assert cancelled == ["https://east.example.com"]
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [0, 0]
+
+
+def test_host_agent_hedge_policy(offline_encoding):
+    pool = EndpointPool([Endpoint("eastus", "https://east.example.com")])
+    policy = HedgePolicy()
+    host_sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", summary="", aspects=""),
+        role_tuple=("Host", RoleType.HOST))
+    host_agent = HostAgent(host_sys_msg, endpoint_pool=pool,
+                           hedge_policy=policy)
+    assert host_agent.endpoint_pool is pool
+    assert host_agent.hedge_policy is policy
@@ -0,0 +1,79 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import json
+import pkgutil
+import subprocess
+import sys
+
+STARTUP_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import wada
+from wada.agents import ChatAgent
+from wada.prompts import TextPrompt
+from wada.topic import Topic
+elapsed = time.perf_counter() - start
+
+print(json.dumps({
+    "elapsed": elapsed,
+    "modules": [name.split(".")[0] for name in sys.modules],
+}))
+"""
+
+
+def run_startup_script() -> dict:
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT],
+                            capture_output=True, check=True, text=True)
+    return json.loads(output.stdout)
+
+
+def test_import_wada_is_lazy():
+    result = run_startup_script()
+    assert "langchain" not in result["modules"]
+    assert "openai" not in result["modules"]
+    assert "duckduckgo_search" not in result["modules"]
+
+
+def test_import_wada_startup_time():
+    # Loading langchain and the search tools takes seconds, the core of the
+    # package should stay well below that.
+    elapsed = min(run_startup_script()["elapsed"] for _ in range(3))
+    assert elapsed < 0.5
+
+
+def test_lazy_attributes():
+    import wada
+    from wada.agents import DebaterAgent
+    from wada.agents.debater_agent import get_default_tools
+
+    assert wada.debate_simulator.DebaterAgent is DebaterAgent
+    assert [tool.name for tool in get_default_tools()
+            ] == ["Search", "Wikipedia", "Arxiv"]
+
+
+def test_submodules():
+    import wada
+
+    names = [module.name for module in pkgutil.iter_modules(wada.__path__)]
+    assert sorted(names) == sorted(wada._submodules)
+    for name in names:
+        assert getattr(wada, name).__name__ == f"wada.{name}"
+    # Every module of the package, in the subpackages too, can be imported.
+    for module in pkgutil.walk_packages(wada.__path__, "wada."):
+        importlib.import_module(module.name)
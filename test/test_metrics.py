@@ -0,0 +1,172 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import sys
+import urllib.error
+import urllib.request
+
+import pytest
+from test_debate_simulator import ScriptedDebater, ScriptedHost
+
+import wada.debate_simulator
+import wada.metrics
+from wada.debate_simulator import DebateSimulator
+from wada.metrics import (
+    DEBATE_PHASE_SECONDS,
+    DEBATES,
+    DEBATES_IN_FLIGHT,
+    LLM_REQUESTS,
+    LLM_RETRIES,
+    LLM_TOKENS,
+    TOOL_CALLS,
+    MetricsCallback,
+    MetricsRegistry,
+    get_resident_memory,
+    metrics_callback,
+    start_metrics_server,
+)
+from wada.topic import Topic
+from wada.tracing import Tracer, tracer
+from wada.typing import SpanKind
+
+
+def test_registry_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["status"])
+    requests.inc(status="ok")
+    requests.inc(2, status='say "hi"')
+    registry.gauge("in_flight", "In flight.").set_function(lambda: 3)
+    latency = registry.histogram("latency_seconds", "Latency.",
+                                 buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert registry.counter("requests_total", "Requests.",
+                            ["status"]) is requests
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Requests.", ["status"])
+    with pytest.raises(ValueError):
+        requests.inc(model="gpt-4")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{status="ok"} 1' in lines
+    assert 'requests_total{status="say \\"hi\\""} 2' in lines
+    assert "in_flight 3" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests.").inc()
+    server = start_metrics_server(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith(
+                "text/plain; version=0.0.4")
+            assert "requests_total 1" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+        tracer.remove_callback(metrics_callback)
+
+
+def test_resident_memory_fallback(monkeypatch):
+
+    def no_proc(*args, **kwargs):
+        raise OSError("no /proc")
+
+    monkeypatch.setattr(wada.metrics, "open", no_proc, raising=False)
+    resource = pytest.importorskip("resource")
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    monkeypatch.setattr(sys, "platform", "linux")
+    assert get_resident_memory() >= max_rss * 1024
+    monkeypatch.setattr(sys, "platform", "darwin")
+    assert max_rss <= get_resident_memory() < max_rss * 1024
+    # Windows has neither /proc nor resource.
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert get_resident_memory() == 0.0
+
+
+def test_span_metrics():
+    local_tracer = Tracer([MetricsCallback()])
+    ok = LLM_REQUESTS.get(model="gpt-4", status="ok")
+    tokens = LLM_TOKENS.get(model="gpt-4", type="prompt")
+    retries = LLM_RETRIES.get(deployment="gpt-4")
+    errors = TOOL_CALLS.get(tool="Search", status="error")
+
+    with local_tracer.span("llm.request", SpanKind.LLM_REQUEST,
+                           model="gpt-4") as span:
+        span.set_usage(dict(prompt_tokens=10, completion_tokens=5))
+        for attempt in (1, 2):
+            with local_tracer.span("retry.attempt", SpanKind.RETRY,
+                                   deployment="gpt-4", attempt=attempt):
+                pass
+    with pytest.raises(ValueError):
+        with local_tracer.span("tool", SpanKind.TOOL, tool="Search"):
+            raise ValueError("no results")
+
+    assert LLM_REQUESTS.get(model="gpt-4", status="ok") == ok + 1
+    assert LLM_TOKENS.get(model="gpt-4", type="prompt") == tokens + 10
+    assert LLM_RETRIES.get(deployment="gpt-4") == retries + 1
+    assert TOOL_CALLS.get(tool="Search", status="error") == errors + 1
+
+
+@pytest.fixture
+def simulator(monkeypatch, offline_encoding) -> DebateSimulator:
+    monkeypatch.setattr(wada.debate_simulator, "DebaterAgent", ScriptedDebater)
+    topic = Topic(content="A or B?", pro="A", con="B")
+    debate = DebateSimulator(topic=topic, turn_limit=5)
+    debate.host = ScriptedHost(end_at=2)
+    return debate
+
+
+def test_debate_simulator_metrics(simulator: DebateSimulator):
+    in_flight = DEBATES_IN_FLIGHT.get()
+    host_end = DEBATES.get(reason="host_end")
+    abandoned = DEBATES.get(reason="abandoned")
+    host_phases = DEBATE_PHASE_SECONDS.get_count(phase="host")
+
+    simulator.reset()
+    assert DEBATES_IN_FLIGHT.get() == in_flight + 1
+    simulator.step()
+    simulator.reset()
+    assert DEBATES.get(reason="abandoned") == abandoned + 1
+    assert DEBATES_IN_FLIGHT.get() == in_flight + 1
+
+    simulator.host = ScriptedHost(end_at=2)
+    while not simulator.terminated:
+        simulator.step()
+    assert DEBATES_IN_FLIGHT.get() == in_flight
+    assert DEBATES.get(reason="host_end") == host_end + 1
+    assert DEBATE_PHASE_SECONDS.get_count(phase="host") == host_phases + 3
+
+    simulator.host = ScriptedHost(end_at=2)
+
+    async def run():
+        return [event async for event in simulator.arun()]
+
+    simulator.reset()
+    asyncio.run(run())
+    assert DEBATES_IN_FLIGHT.get() == in_flight
+    assert DEBATES.get(reason="host_end") == host_end + 2
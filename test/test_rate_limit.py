@@ -0,0 +1,142 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import openai
+import openai.error
+import pytest
+
+from wada.agents import ChatAgent
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.rate_limit import AIMDLimit, RateLimiter, TokenBucket, rate_limiters
+from wada.typing import ModelType, RoleType
+
+
+class FakeClock:
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def limiters():
+    rate_limiters.reset()
+    yield rate_limiters
+    rate_limiters.reset()
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(600, clock=clock)
+    assert bucket.capacity == 100
+
+    assert bucket.reserve(100) == 0
+    # 10 tokens per second, so the next 20 tokens wait 2 seconds.
+    assert bucket.reserve(20) == pytest.approx(2.0)
+    # Callers queue behind the debt of earlier ones.
+    assert bucket.reserve(10) == pytest.approx(3.0)
+
+    clock.now = 10.0
+    assert bucket.reserve(50) == 0
+    bucket.adjust(1000)
+    assert bucket.level == bucket.capacity
+
+
+def test_aimd_limit():
+    limit = AIMDLimit(8)
+    for _ in range(8):
+        limit.acquire()
+    assert not limit.has_slot()
+
+    limit.release(throttled=True)
+    assert limit.limit == 4
+    limit.release(success=False)
+    assert limit.limit == 4
+    for _ in range(6):
+        limit.release()
+    assert 4 < limit.limit < 8
+    assert limit.in_flight == 0
+
+
+def test_aimd_limit_async_waiters():
+    limit = AIMDLimit(2)
+    order = []
+
+    async def request(i: int) -> None:
+        await limit.aacquire()
+        order.append(("start", i, limit.in_flight))
+        await asyncio.sleep(0.01)
+        limit.release()
+
+    async def run() -> None:
+        await asyncio.gather(*[request(i) for i in range(6)])
+
+    asyncio.run(run())
+    assert len(order) == 6
+    assert max(in_flight for _, _, in_flight in order) <= 2
+    assert limit.in_flight == 0
+
+
+def test_rate_limiter_throttle():
+    limiter = RateLimiter(max_concurrency=4)
+    with pytest.raises(openai.error.RateLimitError):
+        with limiter.limit(10):
+            raise openai.error.RateLimitError("slow down", http_status=429)
+    assert limiter.num_throttled == 1
+    assert limiter.concurrency.limit == 2
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_rate_limiter_registry(monkeypatch, limiters):
+    monkeypatch.setenv("WADA_TPM", "6000")
+    assert limiters.get("gpt-4").tokens.capacity == 1000
+    assert limiters.get("gpt-4") is limiters.get("gpt-4")
+
+    limiters.configure(rpm=60)
+    assert limiters.get("gpt-4").tokens is None
+    assert limiters.get("gpt-4").requests is not None
+    limiters.configure("gpt-4", max_concurrency=2)
+    assert limiters.get("gpt-4").requests is None
+    assert limiters.get("gpt-4").concurrency.max_limit == 2
+    assert limiters.get("gpt-35-turbo").requests is not None
+
+
+def test_chat_agent_rate_limited(monkeypatch, offline_encoding, limiters):
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    agent = ChatAgent(sys_msg)
+    limiters.configure(ModelType.GPT_4.value, tpm=60000, max_concurrency=2)
+    limiter = limiters.get(ModelType.GPT_4.value)
+
+    def create(**kwargs):
+        assert limiter.concurrency.in_flight == 1
+        choice = dict(message=dict(role="assistant", content="ok"),
+                      finish_reason="stop")
+        return dict(id="chatcmpl-test", usage=dict(total_tokens=300),
+                    choices=[choice])
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    agent.step(
+        UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                        content="Hello"))
+    # The reservation is corrected with the usage of the response.
+    assert limiter.tokens.level == pytest.approx(limiter.tokens.capacity - 300,
+                                                 abs=5)
+    assert limiter.concurrency.in_flight == 0
@@ -0,0 +1,197 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+
+import openai
+import openai.error
+import pytest
+from tenacity import RetryCallState, RetryError
+
+from wada.agents import ChatAgent
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.rate_limit import rate_limiters
+from wada.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    circuit_breakers,
+    classify_error,
+    get_retry_after,
+)
+from wada.typing import ErrorKind, RoleType
+
+
+@pytest.fixture(autouse=True)
+def registries():
+    rate_limiters.reset()
+    circuit_breakers.reset()
+    yield
+    rate_limiters.reset()
+    circuit_breakers.reset()
+
+
+def make_response(content: str) -> dict:
+    message = dict(role="assistant", content=content)
+    usage = dict(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    return dict(id="chatcmpl-test", usage=usage,
+                choices=[dict(message=message, finish_reason="stop")])
+
+
+def test_classify_error():
+    cases = [
+        (openai.error.RateLimitError("slow down",
+                                     http_status=429), ErrorKind.THROTTLED),
+        (openai.error.Timeout(), ErrorKind.TIMEOUT),
+        (asyncio.TimeoutError(), ErrorKind.TIMEOUT),
+        (openai.error.ServiceUnavailableError("down", http_status=503),
+         ErrorKind.SERVER_ERROR),
+        (openai.error.APIError("oops",
+                               http_status=500), ErrorKind.SERVER_ERROR),
+        (openai.error.InvalidRequestError("too long", "messages",
+                                          http_status=400),
+         ErrorKind.INVALID_REQUEST),
+        (openai.error.AuthenticationError("bad key", http_status=401),
+         ErrorKind.INVALID_REQUEST),
+        (ValueError(), ErrorKind.OTHER),
+    ]
+    for error, kind in cases:
+        assert classify_error(error) == kind
+
+
+def test_get_retry_after():
+    error = openai.error.RateLimitError("slow down", http_status=429,
+                                        headers={"Retry-After": "7"})
+    assert get_retry_after(error) == 7.0
+    error.headers = {"retry-after-ms": "1500", "retry-after": "2"}
+    assert get_retry_after(error) == 1.5
+    error.headers = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    assert get_retry_after(error) == 0.0
+    error.headers = {"Retry-After": "soon"}
+    assert get_retry_after(error) is None
+    error.headers = {}
+    assert get_retry_after(error) is None
+
+    # A malformed header falls back to the exponential backoff.
+    policy = RetryPolicy(min_wait=1, max_wait=60)
+    retry_state = RetryCallState(None, None, (), {})
+    retry_state.attempt_number = 3
+    retry_state.set_exception((openai.error.RateLimitError, error, None))
+    error.headers = {"Retry-After": "soon"}
+    assert 2.0 <= policy.wait(retry_state) <= 4.0
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure(ErrorKind.INVALID_REQUEST)
+    breaker.record_failure(ErrorKind.SERVER_ERROR)
+    assert breaker.state == "closed"
+    breaker.record_failure(ErrorKind.TIMEOUT)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    # Only one trial request is let through.
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure(ErrorKind.SERVER_ERROR)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_retry_policy():
+    policy = RetryPolicy(max_attempts=3, min_wait=0, max_wait=0)
+    errors = [
+        openai.error.RateLimitError("slow down", http_status=429,
+                                    headers={"Retry-After": "0"}),
+        openai.error.ServiceUnavailableError("down", http_status=503),
+    ]
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert policy.call("gpt-4", func) == "ok"
+    assert rate_limiters.get("gpt-4").num_throttled == 0
+
+    calls = []
+
+    def invalid():
+        calls.append(None)
+        raise openai.error.InvalidRequestError("too long", "messages",
+                                               http_status=400)
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        policy.call("gpt-4", invalid)
+    assert len(calls) == 1
+
+    async def failing():
+        calls.append(None)
+        raise openai.error.Timeout()
+
+    with pytest.raises(RetryError):
+        asyncio.run(policy.acall("gpt-4", failing))
+    assert len(calls) == 4
+
+
+def test_retry_policy_circuit_open(monkeypatch):
+    monkeypatch.setattr(circuit_breakers, "failure_threshold", 2)
+    policy = RetryPolicy(max_attempts=5, min_wait=0, max_wait=0)
+    calls = []
+
+    def failing():
+        calls.append(None)
+        raise openai.error.APIError("oops", http_status=500)
+
+    # The open circuit fails fast instead of being retried.
+    with pytest.raises(CircuitOpenError):
+        policy.call("gpt-4", failing)
+    assert len(calls) == 2
+
+
+def test_chat_agent_step_failure_keeps_history(monkeypatch, offline_encoding):
+    responses = [openai.error.InvalidRequestError("filtered", "messages")]
+
+    def create(**kwargs):
+        if responses:
+            raise responses.pop(0)
+        return make_response("Argument")
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    policy = RetryPolicy(min_wait=0, max_wait=0)
+    chat_agent = ChatAgent(sys_msg, retry_policy=policy)
+    user_msg = UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                               content="Give me your first argument.")
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        chat_agent.step(user_msg)
+    assert len(chat_agent.stored_messages) == 1
+
+    replies, _, _ = chat_agent.step(user_msg)
+    assert replies[0].content == "Argument"
+    contents = [message.content for message in chat_agent.stored_messages]
+    assert contents[1:] == ["Give me your first argument."]
@@ -0,0 +1,81 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+from wada.streaming import AsyncReplyStream, FinalAnswerFilter, ReplyStream
+
+
+def test_final_answer_filter():
+    answer_filter = FinalAnswerFilter()
+    tokens = [
+        "Thought", ": Do I need a tool? No\n", "Final", " Answer", ":", " ##",
+        "# Argument", " one #", "##", " and two"
+    ]
+    deltas = [answer_filter.feed(token) for token in tokens]
+    deltas.append(answer_filter.flush())
+    assert "".join(deltas[:4]) == ""
+    # Same as the reply of DebaterAgent.step.
+    text = "".join(tokens)
+    assert "".join(deltas) == text.split("Final Answer:")[-1].strip().replace(
+        "###", "")
+
+
+def test_final_answer_filter_no_answer():
+    answer_filter = FinalAnswerFilter()
+    assert answer_filter.feed("Thought: Do I need a tool? Yes\n") == ""
+    assert answer_filter.feed("Action: Search") == ""
+    assert answer_filter.flush() == ""
+
+
+def fake_run(push):
+    for token in ["Final Answer: ", "A ", "is ", "better"]:
+        push(token)
+    return "A is better"
+
+
+def test_reply_stream():
+    stream = ReplyStream(fake_run)
+    assert "".join(stream) == "Final Answer: A is better"
+    assert stream.result == "A is better"
+
+
+def test_reply_stream_error():
+
+    def failing_run(push):
+        push("partial")
+        raise RuntimeError("boom")
+
+    stream = ReplyStream(failing_run)
+    with pytest.raises(RuntimeError):
+        list(stream)
+
+
+def test_async_reply_stream():
+
+    async def run(push):
+        for token in ["A ", "is ", "better"]:
+            push(token)
+            await asyncio.sleep(0)
+        return "A is better"
+
+    async def consume():
+        stream = AsyncReplyStream(run)
+        return [delta async for delta in stream], stream.result
+
+    deltas, result = asyncio.run(consume())
+    assert deltas == ["A ", "is ", "better"]
+    assert result == "A is better"
@@ -0,0 +1,227 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import uuid
+from typing import List
+
+import openai.error
+import pytest
+
+from wada.agents import ChatAgent
+from wada.backends import FakeBackend, FakeRule
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.rate_limit import rate_limiters
+from wada.retry import RetryPolicy, circuit_breakers
+from wada.tracing import (
+    NULL_SPAN,
+    JSONLExporter,
+    OTLPJSONExporter,
+    Span,
+    TraceCallback,
+    Tracer,
+    tracer,
+)
+from wada.typing import RoleType, SpanKind
+
+
+class SpanCollector(TraceCallback):
+
+    def __init__(self) -> None:
+        self.started: List[Span] = []
+        self.spans: List[Span] = []
+
+    def on_span_start(self, span: Span) -> None:
+        self.started.append(span)
+
+    def on_span_end(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def get(self, name: str) -> List[Span]:
+        return [span for span in self.spans if span.name == name]
+
+
+@pytest.fixture(autouse=True)
+def registries():
+    rate_limiters.reset()
+    circuit_breakers.reset()
+    yield
+    rate_limiters.reset()
+    circuit_breakers.reset()
+
+
+@pytest.fixture
+def collector():
+    collector = SpanCollector()
+    tracer.add_callback(collector)
+    yield collector
+    tracer.remove_callback(collector)
+
+
+@pytest.fixture
+def chat_agent(offline_encoding) -> ChatAgent:
+    sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", position="A", background="", summary=""),
+        role_tuple=("Debater", RoleType.DEBATER))
+    return ChatAgent(sys_msg, backend=FakeBackend(default_reply="Argument"),
+                     retry_policy=RetryPolicy(min_wait=0, max_wait=0))
+
+
+def get_user_msg() -> UserChatMessage:
+    return UserChatMessage(role_name="Host", role_type=RoleType.HOST,
+                           content="Give me your first argument.")
+
+
+def test_tracer_disabled():
+    disabled = Tracer()
+    assert not disabled.enabled
+    with disabled.span("agent.step", SpanKind.AGENT_STEP) as span:
+        assert span is NULL_SPAN
+        assert disabled.current_span() is None
+
+
+def test_tracer_spans():
+    collector = SpanCollector()
+    local_tracer = Tracer([collector])
+    with local_tracer.span("outer", SpanKind.AGENT_STEP, a=1) as outer:
+        assert local_tracer.current_span() is outer
+        with pytest.raises(ValueError):
+            with local_tracer.span("inner", SpanKind.TOOL):
+                raise ValueError("oops")
+    assert local_tracer.current_span() is None
+
+    inner, outer = collector.spans
+    assert collector.started == [outer, inner]
+    assert inner.parent_id == outer.span_id
+    assert inner.trace_id == outer.trace_id
+    assert inner.error == "ValueError: oops"
+    assert outer.error is None and outer.parent_id is None
+    assert outer.attributes == {"a": 1}
+    assert outer.duration >= inner.duration >= 0
+
+
+def test_chat_agent_spans(chat_agent, collector):
+    replies, _, info = chat_agent.step(get_user_msg())
+    assert replies[0].content == "Argument"
+
+    step, = collector.get("agent.step")
+    request, = collector.get("llm.request")
+    attempt, = collector.get("retry.attempt")
+    assert request.parent_id == step.span_id
+    assert attempt.parent_id == request.span_id
+    assert step.attributes["role_name"] == "Debater"
+    assert step.attributes["model"] == chat_agent.model.value
+    for key, value in info["usage"].items():
+        assert step.attributes[key] == value
+        assert request.attributes[key] == value
+    assert attempt.attributes["deployment"] == chat_agent.model.value
+    assert attempt.attributes["attempt"] == 1
+
+
+def test_stream_spans(chat_agent, collector):
+    stream, _, _ = chat_agent.step(get_user_msg(), stream=True)
+    assert tracer.current_span() is None
+    assert collector.get("llm.request") == []
+    assert "".join(stream) == "Argument"
+    # The request span ends once the stream is read.
+    request, = collector.get("llm.request")
+    step, = collector.get("agent.step")
+    assert request.parent_id == step.span_id
+    assert request.end_time >= step.end_time
+
+
+def test_retry_spans(chat_agent, collector):
+    calls = []
+
+    def reply(messages):
+        calls.append(None)
+        if len(calls) == 1:
+            raise openai.error.ServiceUnavailableError("down", http_status=503)
+        return "Argument"
+
+    chat_agent.backend = FakeBackend([FakeRule(".", reply)])
+    asyncio.run(chat_agent.astep(get_user_msg()))
+
+    request, = collector.get("llm.request")
+    first, second = collector.get("retry.attempt")
+    assert first.error.startswith("ServiceUnavailableError")
+    assert first.attributes["error_kind"] == "server_error"
+    assert second.error is None and second.attributes["attempt"] == 2
+    assert first.parent_id == second.parent_id == request.span_id
+
+
+def test_exporters(tmp_path):
+    jsonl_path = tmp_path / "trace.jsonl"
+    otlp_path = tmp_path / "trace.otlp.jsonl"
+    local_tracer = Tracer(
+        [JSONLExporter(str(jsonl_path)),
+         OTLPJSONExporter(str(otlp_path))])
+    with local_tracer.span("llm.request", SpanKind.LLM_REQUEST) as span:
+        span.set_usage(dict(prompt_tokens=10, completion_tokens=5))
+        span.set_attributes(model="gpt-4", cached=False)
+    local_tracer.shutdown()
+
+    record, = [
+        json.loads(line) for line in jsonl_path.read_text().splitlines()
+    ]
+    assert record["name"] == "llm.request"
+    assert record["kind"] == "llm_request"
+    assert record["status"] == "ok"
+    assert record["attributes"]["prompt_tokens"] == 10
+
+    request = json.loads(otlp_path.read_text())
+    otlp_span, = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert otlp_span["traceId"] == record["trace_id"]
+    assert otlp_span["kind"] == 3
+    assert otlp_span["status"] == {"code": 1}
+    attributes = {
+        attribute["key"]: attribute["value"]
+        for attribute in otlp_span["attributes"]
+    }
+    assert attributes["prompt_tokens"] == {"intValue": "10"}
+    assert attributes["cached"] == {"boolValue": False}
+    assert attributes["model"] == {"stringValue": "gpt-4"}
+    assert int(otlp_span["endTimeUnixNano"]) >= int(
+        otlp_span["startTimeUnixNano"])
+
+
+def test_react_spans(collector):
+    from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+    from wada.agents.debater_agent import TracingCallbackHandler
+
+    with tracer.span("agent.step", SpanKind.AGENT_STEP) as step:
+        handler = TracingCallbackHandler(step)
+        usage = dict(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+        result = LLMResult(generations=[], llm_output={"token_usage": usage})
+        run_id = uuid.uuid4()
+        handler.on_chat_model_start({}, [])
+        handler.on_llm_end(result)
+        handler.on_agent_action(AgentAction("Search", "the topic", ""))
+        handler.on_tool_start({"name": "Search"}, "the topic", run_id=run_id)
+        handler.on_tool_end("Option A is cheaper.", run_id=run_id)
+        handler.on_chat_model_start({}, [])
+        handler.on_llm_end(result)
+        handler.on_agent_finish(AgentFinish({"output": "A"}, ""))
+
+    first, second = collector.get("react.iteration")
+    tool, = collector.get("tool")
+    assert first.parent_id == second.parent_id == step.span_id
+    assert tool.parent_id == first.span_id
+    assert first.attributes == {"iteration": 1, "action": "Search"}
+    assert tool.attributes["tool"] == "Search"
+    assert step.attributes["total_tokens"] == 30
+    assert step.attributes["iterations"] == 2
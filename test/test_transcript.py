@@ -0,0 +1,103 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test_debate_simulator import ScriptedDebater
+
+import wada.debate_simulator
+from wada.agents import HostAgent
+from wada.backends import FakeBackend
+from wada.debate_simulator import DebateSimulator
+from wada.generators import SystemMessageGenerator
+from wada.messages import UserChatMessage
+from wada.topic import Topic
+from wada.transcript import Transcript, TranscriptMessage, WindowMessage
+from wada.typing import RoleType
+
+
+def get_transcript() -> Transcript:
+    transcript = Transcript()
+    transcript.append("Host", RoleType.HOST, "Go")
+    transcript.append("Proposition", RoleType.DEBATER, "A is cheaper.")
+    transcript.append("Contradiction", RoleType.DEBATER, "B pays more.")
+    return transcript
+
+
+def test_transcript_window():
+    transcript = get_transcript()
+    round_window = transcript.window(1, 3)
+    following = transcript.window(-1)
+    assert round_window.render() == ("Proposition:\n\nA is cheaper.\n"
+                                     "Contradiction:\n\nB pays more.\n")
+
+    transcript.append("Proposition", RoleType.DEBATER, "A is closer.")
+    assert len(round_window) == 2
+    assert [message.content
+            for message in following] == ["B pays more.", "A is closer."]
+    # The window shares the messages of the transcript.
+    assert round_window[0] is transcript[1]
+
+    assert transcript[1].to_dict() == UserChatMessage(
+        role_name="Proposition", role_type=RoleType.DEBATER,
+        content="A is cheaper.").to_dict()
+    assert Transcript.from_dicts(transcript.to_dicts()) == transcript
+    assert transcript[0] == TranscriptMessage("Host", RoleType.HOST, "Go")
+
+
+def get_host(backend: FakeBackend) -> HostAgent:
+    host_sys_msg = SystemMessageGenerator().from_dict(
+        dict(topic="A or B?", summary="Cost matters.", aspects="1. Cost"),
+        role_tuple=("Host", RoleType.HOST),
+    )
+    return HostAgent(host_sys_msg, backend=backend, role_name="Host")
+
+
+def test_host_reads_window(offline_encoding):
+    backend = FakeBackend.for_debate()
+    host = get_host(backend)
+    transcript = get_transcript()
+    round_window = transcript.window(1, 3)
+
+    assert host.step(round_window) == (True, "<<<CONTINUE>>>")
+    message = host.stored_messages[1]
+    assert isinstance(message, WindowMessage)
+    assert backend.requests[0]["messages"][-1] == dict(
+        role="user", content=round_window.render())
+
+    state = host.get_state()
+    assert state["messages"][0]["content"] == round_window.render()
+    resumed = get_host(backend)
+    resumed.set_state(state)
+    assert resumed.get_state() == state
+    assert resumed.stored_num_tokens == host.stored_num_tokens
+
+
+def test_debate_simulator_transcript(monkeypatch, offline_encoding):
+    monkeypatch.setattr(wada.debate_simulator, "DebaterAgent", ScriptedDebater)
+    simulator = DebateSimulator(
+        topic=Topic(content="A or B?", pro="A", con="B"), turn_limit=5,
+        host_kwargs=dict(backend=FakeBackend.for_debate(num_rounds=2)))
+    simulator.reset()
+    while not simulator.terminated:
+        simulator.step()
+
+    assert simulator.termination_reason == "host_end"
+    assert len(simulator.history) == 5
+    # The host keeps windows on the transcript instead of copies of the
+    # rounds.
+    rounds = simulator.host.stored_messages[1::2]
+    assert len(rounds) == 2
+    assert all(message.window.transcript is simulator.history
+               for message in rounds)
+    assert rounds[1].window[1] is simulator.history[4]
+    assert simulator.debater_a_agent.inputs[1] is simulator.history[2].content
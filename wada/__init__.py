@@ -12,14 +12,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import wada.agents
-import wada.generators
-import wada.messages
-import wada.prompts
-import wada.typing
-import wada.utils
-import wada.debate_simulator
+import importlib
+from typing import Any
 
 __version__ = '0.1.0'
 
+# Submodules are imported on first access, so that `import wada` does not
+# pay for langchain and the search tools unless they are used.
+_submodules = [
+    'agents',
+    'archive',
+    'backends',
+    'cache',
+    'checkpoint',
+    'debate',
+    'debate_simulator',
+    'endpoints',
+    'events',
+    'generators',
+    'hedging',
+    'messages',
+    'metrics',
+    'prompts',
+    'rate_limit',
+    'retry',
+    'streaming',
+    'topic',
+    'tracing',
+    'transcript',
+    'typing',
+    'utils',
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __all__ = ['__version__', 'wada']
@@ -12,11 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Any
+
 from .chat_agent import ChatAgent
-from .debater_agent import DebaterAgent
 from .host_agent import HostAgent
 from .topic_agent import TopicAgent
 
+
+def __getattr__(name: str) -> Any:
+    # DebaterAgent pulls in langchain, so it is only imported when used.
+    if name == 'DebaterAgent':
+        from .debater_agent import DebaterAgent
+        return DebaterAgent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __all__ = [
     'ChatAgent',
     'HostAgent',
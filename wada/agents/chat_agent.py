@@ -16,24 +16,52 @@
 # Modifications:
 # - Modified openai api calls to use AzureIOpenAI
 
-import os
-from typing import Any, Dict, List, Optional, Tuple
+from bisect import bisect_left
+from contextlib import AsyncExitStack, ExitStack, contextmanager
+from functools import partial
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
-import openai
-from tenacity import retry, stop_after_attempt, wait_exponential
+from wada.backends import ChatBackend, get_default_backend
+from wada.cache import ResponseCache
+from wada.endpoints import Endpoint, EndpointPool, get_default_endpoint_pool
+from wada.generators import DebatePromptGenerator
+from wada.hedging import HedgePolicy
+from wada.messages import (
+    ChatMessage,
+    MessageType,
+    OpenAIMessage,
+    SystemMessage,
+    message_from_dict,
+)
+from wada.rate_limit import rate_limiters
+from wada.retry import RetryPolicy
+from wada.streaming import (
+    AsyncChatStream,
+    AsyncChunkStream,
+    ChatStream,
+    ChunkStream,
+)
+from wada.tracing import add_usage, tracer
+from wada.typing import ModelType, OverflowPolicy, SpanKind
+from wada.utils import (
+    get_model_encoding,
+    get_model_token_limit,
+    num_tokens_from_message,
+    num_tokens_from_messages,
+)
 
-from wada.messages import ChatMessage, MessageType, SystemMessage
-from wada.typing import ModelType
-from wada.utils import get_model_token_limit, num_tokens_from_messages
 
-openai.api_type = "azure"
-openai.api_version = os.getenv("OPENAI_API_VERSION")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-openai.api_base = os.getenv("OPENAI_API_BASE")
+def get_openai_config() -> Dict[str, Optional[str]]:
+    r"""Returns the Azure OpenAI settings passed with every request. They are
+    read from the environment when the request is made, instead of being
+    written into the global :obj:`openai` config on import."""
+    return Endpoint.from_env().get_config()
 
 
 class ChatAgent:
-    r"""A conversational agent that uses Azure OpenAI's chat API.
+    r"""A conversational agent that uses Azure OpenAI's chat API, or any
+    other :class:`wada.backends.ChatBackend`.
 
     Args:
         system_message (SystemMessage): The system message of chat.
@@ -44,6 +72,38 @@ class ChatAgent:
         message_window_size (Optional[int]): The maximum number of messages
             to use for the agent's message window. If :obj:`None`, then
             the message window size is unlimited. (default: :obj:`None`)
+        message_window_tokens (Optional[int]): The token budget of the
+            agent's message window. The window keeps the newest messages
+            that fit in the budget together with the system message. If
+            :obj:`None`, the window is not limited by tokens.
+            (default: :obj:`None`)
+        overflow_policy (OverflowPolicy): What to do when the message window
+            does not fit in the model's context. :obj:`TERMINATE` ends the
+            chat, :obj:`TRIM` drops the oldest messages from the window,
+            :obj:`SUMMARIZE` folds the older history into one summary
+            message and :obj:`ESCALATE` switches to a model with a larger
+            context. The last three fall back to trimming if the window
+            still does not fit. (default: :obj:`OverflowPolicy.TERMINATE`)
+        response_cache (Optional[ResponseCache]): A cache of responses keyed
+            by the deployment, the messages and the sampling parameters of
+            each request. If :obj:`None`, every request goes to the API.
+            (default: :obj:`None`)
+        retry_policy (Optional[RetryPolicy]): How failed requests are
+            retried. If :obj:`None`, the default :class:`RetryPolicy` is
+            used. (default: :obj:`None`)
+        endpoint_pool (Optional[EndpointPool]): The endpoints the requests
+            are spread over. If :obj:`None`, the pool configured in the
+            environment is used, see :meth:`EndpointPool.from_env`, or else
+            the single endpoint of the :obj:`OPENAI_API_*` variables.
+            (default: :obj:`None`)
+        hedge_policy (Optional[HedgePolicy]): When to send a duplicate of a
+            slow request to another endpoint. Streamed requests are not
+            hedged. If :obj:`None`, requests are not hedged.
+            (default: :obj:`None`)
+        backend (Optional[ChatBackend]): The chat completion API the
+            requests are sent to. If :obj:`None`, the backend selected in
+            the environment is used, see :func:`get_default_backend`.
+            (default: :obj:`None`)
     """
 
     def __init__(
@@ -52,6 +112,13 @@ class ChatAgent:
         model: ModelType = ModelType.GPT_4,
         temperature: float = 0.2,
         message_window_size: Optional[int] = None,
+        message_window_tokens: Optional[int] = None,
+        overflow_policy: OverflowPolicy = OverflowPolicy.TERMINATE,
+        response_cache: Optional[ResponseCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        backend: Optional[ChatBackend] = None,
     ) -> None:
 
         self.system_message = system_message
@@ -63,12 +130,22 @@ class ChatAgent:
         self.temperature = temperature
         self.model_token_limit = get_model_token_limit(self.model)
         self.message_window_size = message_window_size
+        self.message_window_tokens = message_window_tokens
+        self.overflow_policy = overflow_policy
+        self.response_cache = response_cache
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.endpoint_pool = endpoint_pool or get_default_endpoint_pool()
+        self.hedge_policy = hedge_policy
+        self.backend = backend or get_default_backend()
 
         self.terminated = False
+        # The token usage of the responses since the last reset.
+        self.usage: Dict[str, int] = {}
         self.init_messages()
 
     def reset(self) -> List[MessageType]:
         self.terminated = False
+        self.usage = {}
         self.init_messages()
         return self.stored_messages
 
@@ -88,55 +165,570 @@ class ChatAgent:
 
     def init_messages(self) -> None:
         self.stored_messages: List[MessageType] = [self.system_message]
+        # Running totals of the tokens of `stored_messages`, so that any
+        # suffix of the history can be measured in O(1). They are counted
+        # when the message window is first needed, so that building an
+        # agent does not load the tokenizer.
+        self.token_totals: Optional[List[int]] = None
+
+    @property
+    def stored_num_tokens(self) -> List[int]:
+        if self.token_totals is None:
+            self.token_totals = list(
+                accumulate(
+                    self.count_message_tokens(message)
+                    for message in self.stored_messages))
+        return self.token_totals
+
+    def get_state(self) -> Dict[str, Any]:
+        r"""Returns the state of the conversation as plain data, see
+        :meth:`set_state`. The system message is not part of it."""
+        messages = [message.to_dict() for message in self.stored_messages]
+        return dict(model=self.model.value, terminated=self.terminated,
+                    usage=dict(self.usage), messages=messages[1:])
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        r"""Restores the conversation returned by :meth:`get_state`, e.g. to
+        resume a debate without sending its earlier requests again."""
+        self.set_model(ModelType(state["model"]))
+        self.terminated = state["terminated"]
+        self.usage = dict(state["usage"])
+        self.init_messages()
+        for message in state["messages"]:
+            self.update_messages(message_from_dict(message))
+
+    def count_message_tokens(self, message: MessageType) -> int:
+        return num_tokens_from_message(message.to_openai_message(), self.model)
+
+    def pop_message(self) -> MessageType:
+        if self.token_totals is not None:
+            self.token_totals.pop()
+        return self.stored_messages.pop()
 
     def update_messages(self, message: ChatMessage) -> List[MessageType]:
         self.stored_messages.append(message)
+        if self.token_totals is not None:
+            self.token_totals.append(self.token_totals[-1] +
+                                     self.count_message_tokens(message))
         return self.stored_messages
 
-    @retry(wait=wait_exponential(min=5, max=60), stop=stop_after_attempt(5))
+    def get_num_tokens(self, num_messages: Optional[int] = None) -> int:
+        r"""Returns the number of tokens of a request made of the system
+        message and the newest stored messages, from the cached counts.
+
+        Args:
+            num_messages (Optional[int]): The number of newest non-system
+                messages to include. If :obj:`None`, all stored messages are
+                included. (default: :obj:`None`)
+
+        Returns:
+            int: The number of tokens of the request.
+        """
+        num_tokens = self.stored_num_tokens[-1]
+        if num_messages is not None and num_messages < len(
+                self.stored_messages) - 1:
+            num_tokens -= self.stored_num_tokens[-num_messages - 1]
+            num_tokens += self.stored_num_tokens[0]
+        return num_tokens + 2  # every reply is primed with <im_start>assistant
+
+    def get_window_start(self, num_tokens_budget: Optional[int] = None) -> int:
+        r"""Returns the index in :obj:`stored_messages` of the oldest message
+        of the message window. The system message is always kept in front of
+        the window, and the newest message is kept even if it alone does not
+        fit in the token budget.
+
+        Args:
+            num_tokens_budget (Optional[int]): A token budget applied on top
+                of :obj:`message_window_tokens`. (default: :obj:`None`)
+
+        Returns:
+            int: The index of the oldest non-system message of the window.
+        """
+        start = 1
+        if self.message_window_size is not None:
+            start = max(start,
+                        len(self.stored_messages) - self.message_window_size)
+        budgets = [
+            budget
+            for budget in (self.message_window_tokens, num_tokens_budget)
+            if budget is not None
+        ]
+        if len(budgets) > 0:
+            # Smallest start such that the system message, the messages
+            # from start onwards and the reply priming fit in the budget.
+            excess = (self.stored_num_tokens[-1] + self.stored_num_tokens[0] +
+                      2 - min(budgets))
+            start = max(start, bisect_left(self.stored_num_tokens, excess) + 1)
+        return min(start, max(len(self.stored_messages) - 1, 1))
+
+    def get_window_messages(
+        self,
+        num_tokens_budget: Optional[int] = None,
+    ) -> Tuple[List[OpenAIMessage], int]:
+        start = self.get_window_start(num_tokens_budget)
+        messages = [self.system_message] + self.stored_messages[start:]
+        openai_messages = [message.to_openai_message() for message in messages]
+        return openai_messages, self.get_num_tokens(len(messages) - 1)
+
+    def prepare_messages(
+        self,
+        input_message: ChatMessage,
+    ) -> Tuple[List[OpenAIMessage], int]:
+        self.update_messages(input_message)
+        return self.get_window_messages()
+
+    def set_model(self, model: ModelType) -> None:
+        recount = get_model_encoding(model) is not get_model_encoding(
+            self.model)
+        self.model = model
+        self.model_token_limit = get_model_token_limit(model)
+        if recount:
+            messages = self.stored_messages
+            self.init_messages()
+            for message in messages[1:]:
+                self.update_messages(message)
+
+    def escalate_model(self, num_tokens: int) -> bool:
+        r"""Switches to the smallest model whose context fits
+        :obj:`num_tokens`, or to the largest model if none does.
+
+        Args:
+            num_tokens (int): The number of tokens of the request.
+
+        Returns:
+            bool: Whether a model with a larger context was found.
+        """
+        larger_models = sorted(
+            (model for model in ModelType
+             if get_model_token_limit(model) > self.model_token_limit),
+            key=get_model_token_limit)
+        if len(larger_models) == 0:
+            return False
+        fitting_models = [
+            model for model in larger_models
+            if get_model_token_limit(model) > num_tokens
+        ]
+        self.set_model((fitting_models or larger_models[-1:])[0])
+        return True
+
+    def get_summary_request(
+        self,
+        num_tokens: int,
+    ) -> Optional[Tuple[int, List[OpenAIMessage]]]:
+        r"""Builds the request that summarizes the older history when the
+        window overflows under :obj:`OverflowPolicy.SUMMARIZE`. The newest
+        messages that fit in half of the model's context are kept as they
+        are, and the messages before them are folded.
+
+        Args:
+            num_tokens (int): The number of tokens of the current window.
+
+        Returns:
+            Optional[Tuple[int, List[OpenAIMessage]]]: The index of the
+                oldest kept message and the summary request, or :obj:`None`
+                if there is nothing to summarize.
+        """
+        if (self.overflow_policy != OverflowPolicy.SUMMARIZE
+                or num_tokens < self.model_token_limit):
+            return None
+        keep_start = self.get_window_start(self.model_token_limit // 2)
+        if keep_start <= 1:
+            return None
+
+        # The folded messages must fit in the summary request as well.
+        excess = (self.stored_num_tokens[keep_start - 1] -
+                  self.model_token_limit // 2)
+        fold_start = max(1, bisect_left(self.stored_num_tokens, excess) + 1)
+        history = "\n\n".join(
+            f"{message.role_name}: {message.content}"
+            for message in self.stored_messages[fold_start:keep_start])
+        prompt = DebatePromptGenerator().get_history_summarize_prompt(history)
+        return keep_start, [{"role": "user", "content": prompt}]
+
+    def fold_history(self, keep_start: int, summary: str) -> None:
+        summary_message = SystemMessage(
+            role_name=self.role_name, role_type=self.role_type,
+            content=f"Summary of the earlier conversation: {summary}")
+        kept_messages = self.stored_messages[keep_start:]
+        kept_num_tokens = self.stored_num_tokens[keep_start - 1:]
+
+        self.init_messages()
+        self.update_messages(summary_message)
+        offset = self.stored_num_tokens[-1] - kept_num_tokens[0]
+        self.stored_messages.extend(kept_messages)
+        self.stored_num_tokens.extend(num_tokens + offset
+                                      for num_tokens in kept_num_tokens[1:])
+
+    def fit_messages(
+        self,
+        openai_messages: List[OpenAIMessage],
+        num_tokens: int,
+    ) -> Tuple[List[OpenAIMessage], int]:
+        r"""Applies :obj:`overflow_policy` to a window that does not fit in
+        the model's context. Trimming keeps three quarters of the context
+        for the window, which leaves room for the reply.
+
+        Args:
+            openai_messages (List[OpenAIMessage]): The message window.
+            num_tokens (int): The number of tokens of the window.
+
+        Returns:
+            Tuple[List[OpenAIMessage], int]: The window to send and its
+                number of tokens.
+        """
+        if (num_tokens < self.model_token_limit
+                or self.overflow_policy == OverflowPolicy.TERMINATE):
+            return openai_messages, num_tokens
+        if self.overflow_policy == OverflowPolicy.ESCALATE:
+            if self.escalate_model(num_tokens):
+                openai_messages, num_tokens = self.get_window_messages()
+            if num_tokens < self.model_token_limit:
+                return openai_messages, num_tokens
+        return self.get_window_messages(self.model_token_limit * 3 // 4)
+
+    def handle_response(
+        self,
+        response: Dict[str, Any],
+        num_tokens: int,
+    ) -> Tuple[List[ChatMessage], Dict[str, Any]]:
+        output_messages = [
+            ChatMessage(role_name=self.role_name, role_type=self.role_type,
+                        meta_dict=dict(), **dict(choice["message"]))
+            for choice in response["choices"]
+        ]
+        info = self.get_info(
+            response["id"],
+            response["usage"],
+            [str(choice["finish_reason"]) for choice in response["choices"]],
+            num_tokens,
+        )
+        add_usage(self.usage, response["usage"])
+        return output_messages, info
+
+    def handle_stream(
+        self,
+        response: Dict[str, Any],
+        num_tokens: int,
+        info: Dict[str, Any],
+    ) -> List[ChatMessage]:
+        r"""Finishes a streamed response. The API does not report the usage
+        of streamed requests, so it is counted locally, and :obj:`info` is
+        updated in place.
+
+        Args:
+            response (Dict[str, Any]): The response assembled from the
+                chunks of the stream.
+            num_tokens (int): The number of tokens of the request.
+            info (Dict[str, Any]): The info returned with the stream.
+
+        Returns:
+            List[ChatMessage]: The output messages.
+        """
+        encoding = get_model_encoding(self.model)
+        completion_tokens = sum(
+            len(encoding.encode(choice["message"]["content"]))
+            for choice in response["choices"])
+        response["usage"] = {
+            "prompt_tokens": num_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": num_tokens + completion_tokens,
+        }
+        output_messages, stream_info = self.handle_response(
+            response, num_tokens)
+        info.update(stream_info)
+        return output_messages
+
+    def handle_overflow(self, num_tokens: int) -> Tuple[None, Dict[str, Any]]:
+        self.terminated = True
+        info = self.get_info(
+            None,
+            None,
+            ["max_tokens_exceeded"],
+            num_tokens,
+        )
+        return None, info
+
+    def trace_endpoint(self, endpoint: Endpoint) -> None:
+        r"""Records the endpoint and the deployment of a request attempt on
+        the current span."""
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attributes(
+                endpoint=endpoint.name or endpoint.api_base,
+                deployment=endpoint.get_deployment(self.model.value))
+
+    @contextmanager
+    def use_endpoint(self, tried: List[Endpoint]) -> Iterator[Endpoint]:
+        r"""Picks the endpoint of a request attempt, preferring the ones the
+        earlier attempts of the request were not sent to."""
+        if self.endpoint_pool is None:
+            yield Endpoint.from_env()
+            return
+        with self.endpoint_pool.use(exclude=tried) as endpoint:
+            yield endpoint
+
+    def request(
+        self,
+        openai_messages: List[OpenAIMessage],
+        num_tokens: Optional[int] = None,
+        stream: bool = False,
+    ) -> Any:
+        r"""Sends a request to the chat API, through the response cache, the
+        retry policy, the hedge policy, the endpoint pool and the rate
+        limiter of the deployment. Streamed responses are not cached, they
+        are consumed by the caller, and hold the endpoint, the rate limiter
+        lease and the span of the request until they are exhausted or
+        closed.
+
+        Args:
+            openai_messages (List[OpenAIMessage]): The messages to send.
+            num_tokens (Optional[int]): The number of tokens of the
+                messages. If :obj:`None`, they are counted.
+                (default: :obj:`None`)
+            stream (bool): Whether to stream the response.
+                (default: :obj:`False`)
+
+        Returns:
+            Any: The response, or the :class:`wada.streaming.ChunkStream`
+                of its chunks.
+        """
+        with ExitStack() as resources:
+            span = resources.enter_context(
+                tracer.open_span("llm.request", SpanKind.LLM_REQUEST,
+                                 model=self.model.value, stream=stream))
+            with tracer.activate(span):
+                key = None
+                if self.response_cache is not None and not stream:
+                    key = self.response_cache.make_key(
+                        self.model.value, openai_messages,
+                        temperature=self.temperature)
+                    response = self.response_cache.get(key)
+                    span.set_attributes(cached=response is not None)
+                    if response is not None:
+                        span.set_usage(response["usage"])
+                        return response
+
+                if num_tokens is None:
+                    num_tokens = num_tokens_from_messages(
+                        openai_messages, self.model)
+                span.set_attributes(num_tokens=num_tokens)
+                tried: List[Endpoint] = []
+
+                def attempt() -> Any:
+                    with ExitStack() as attempt_resources:
+                        endpoint = attempt_resources.enter_context(
+                            self.use_endpoint(tried))
+                        tried.append(endpoint)
+                        self.trace_endpoint(endpoint)
+                        deployment = endpoint.get_key(self.model.value)
+                        attempt_resources.enter_context(
+                            self.retry_policy.guard(deployment))
+                        lease = attempt_resources.enter_context(
+                            rate_limiters.get(deployment).limit(num_tokens))
+                        response = self.backend.create(
+                            messages=openai_messages,
+                            temperature=self.temperature, stream=stream,
+                            **endpoint.get_params(self.model.value))
+                        if stream:
+                            # The stream holds the endpoint, the circuit
+                            # breaker and the rate limiter lease until it is
+                            # read.
+                            return ChunkStream(response,
+                                               attempt_resources.pop_all())
+                        lease.record_usage(response["usage"])
+                        return response
+
+                if self.hedge_policy is not None and not stream:
+                    attempt = partial(self.hedge_policy.call, self.model.value,
+                                      attempt)
+                response = self.retry_policy.call(self.model.value, attempt,
+                                                  guarded=False)
+
+                if stream:
+                    return ChunkStream(response, resources.pop_all())
+                span.set_usage(response["usage"])
+                if key is not None:
+                    self.response_cache.set(key, response)
+                return response
+
+    async def arequest(
+        self,
+        openai_messages: List[OpenAIMessage],
+        num_tokens: Optional[int] = None,
+        stream: bool = False,
+    ) -> Any:
+        async with AsyncExitStack() as resources:
+            span = resources.enter_context(
+                tracer.open_span("llm.request", SpanKind.LLM_REQUEST,
+                                 model=self.model.value, stream=stream))
+            with tracer.activate(span):
+                key = None
+                if self.response_cache is not None and not stream:
+                    key = self.response_cache.make_key(
+                        self.model.value, openai_messages,
+                        temperature=self.temperature)
+                    response = await self.response_cache.aget(key)
+                    span.set_attributes(cached=response is not None)
+                    if response is not None:
+                        span.set_usage(response["usage"])
+                        return response
+
+                if num_tokens is None:
+                    num_tokens = num_tokens_from_messages(
+                        openai_messages, self.model)
+                span.set_attributes(num_tokens=num_tokens)
+                tried: List[Endpoint] = []
+
+                async def attempt() -> Any:
+                    async with AsyncExitStack() as attempt_resources:
+                        endpoint = attempt_resources.enter_context(
+                            self.use_endpoint(tried))
+                        tried.append(endpoint)
+                        self.trace_endpoint(endpoint)
+                        deployment = endpoint.get_key(self.model.value)
+                        attempt_resources.enter_context(
+                            self.retry_policy.guard(deployment))
+                        lease = await attempt_resources.enter_async_context(
+                            rate_limiters.get(deployment).alimit(num_tokens))
+                        response = await self.backend.acreate(
+                            messages=openai_messages,
+                            temperature=self.temperature, stream=stream,
+                            **endpoint.get_params(self.model.value))
+                        if stream:
+                            return AsyncChunkStream(
+                                response, attempt_resources.pop_all())
+                        lease.record_usage(response["usage"])
+                        return response
+
+                if self.hedge_policy is not None and not stream:
+                    attempt = partial(self.hedge_policy.acall,
+                                      self.model.value, attempt)
+                response = await self.retry_policy.acall(
+                    self.model.value, attempt, guarded=False)
+
+                if stream:
+                    return AsyncChunkStream(response, resources.pop_all())
+                span.set_usage(response["usage"])
+                if key is not None:
+                    await self.response_cache.aset(key, response)
+                return response
+
     def step(
         self,
         input_message: ChatMessage,
-    ) -> Tuple[Optional[List[ChatMessage]], bool, Dict[str, Any]]:
-        messages = self.update_messages(input_message)
-        if self.message_window_size is not None and len(
-                messages) > self.message_window_size:
-            messages = [self.system_message
-                        ] + messages[-self.message_window_size:]
-        openai_messages = [message.to_openai_message() for message in messages]
-        num_tokens = num_tokens_from_messages(openai_messages, self.model)
-
-        if num_tokens < self.model_token_limit:
-            response = openai.ChatCompletion.create(
-                engine=self.model.value, messages=openai_messages,
-                temperature=self.temperature)
-            output_messages = [
-                ChatMessage(role_name=self.role_name, role_type=self.role_type,
-                            meta_dict=dict(), **dict(choice["message"]))
-                for choice in response["choices"]
-            ]
-            info = self.get_info(
-                response["id"],
-                response["usage"],
-                [
-                    str(choice["finish_reason"])
-                    for choice in response["choices"]
-                ],
-                num_tokens,
-            )
-
-        else:
-            self.terminated = True
-            output_messages = None
-
-            info = self.get_info(
-                None,
-                None,
-                ["max_tokens_exceeded"],
-                num_tokens,
-            )
-
-        return output_messages, self.terminated, info
+        stream: bool = False,
+    ) -> Tuple[Optional[Union[List[ChatMessage], ChatStream]], bool, Dict[
+            str, Any]]:
+        r"""Sends the input message with the message window and returns the
+        reply.
+
+        Args:
+            input_message (ChatMessage): The input message.
+            stream (bool): Whether to stream the reply. If :obj:`True`, a
+                :class:`ChatStream` of content deltas is returned instead of
+                the output messages. Its :obj:`messages` and the returned
+                info are filled in once it is exhausted.
+                (default: :obj:`False`)
+
+        Returns:
+            Tuple[Optional[Union[List[ChatMessage], ChatStream]], bool,
+                Dict[str, Any]]: The output messages or the stream, whether
+                the chat is terminated, and the info of the request.
+        """
+        with tracer.span("agent.step", SpanKind.AGENT_STEP,
+                         role_name=self.role_name,
+                         role_type=self.role_type.value,
+                         model=self.model.value, stream=stream) as span:
+            openai_messages, num_tokens = self.prepare_messages(input_message)
+
+            try:
+                summary_request = self.get_summary_request(num_tokens)
+                if summary_request is not None:
+                    keep_start, summary_messages = summary_request
+                    response = self.request(summary_messages)
+                    self.fold_history(
+                        keep_start,
+                        response["choices"][0]["message"]["content"])
+                    openai_messages, num_tokens = self.get_window_messages()
+                openai_messages, num_tokens = self.fit_messages(
+                    openai_messages, num_tokens)
+
+                if num_tokens < self.model_token_limit and stream:
+                    info = self.get_info(None, None, [], num_tokens)
+                    chunks = self.request(openai_messages, num_tokens,
+                                          stream=True)
+                    output_messages = ChatStream(
+                        chunks, lambda response: self.handle_stream(
+                            response, num_tokens, info), self.pop_message)
+                elif num_tokens < self.model_token_limit:
+                    response = self.request(openai_messages, num_tokens)
+                    output_messages, info = self.handle_response(
+                        response, num_tokens)
+                else:
+                    output_messages, info = self.handle_overflow(num_tokens)
+            except BaseException:
+                # The input is only kept in the history once a request with
+                # it succeeds, so that retrying the step does not repeat it.
+                self.pop_message()
+                raise
+
+            span.set_attributes(terminated=self.terminated,
+                                num_tokens=num_tokens)
+            span.set_usage(info["usage"])
+            return output_messages, self.terminated, info
+
+    async def astep(
+        self,
+        input_message: ChatMessage,
+        stream: bool = False,
+    ) -> Tuple[Optional[Union[List[ChatMessage], AsyncChatStream]], bool, Dict[
+            str, Any]]:
+        r"""Asynchronous version of :meth:`step`. The request is sent with
+        the :meth:`acreate` of the backend and retries back off with
+        :obj:`asyncio.sleep`, so many agents can share one event loop. With
+        :obj:`stream=True`, an :class:`AsyncChatStream` is returned.
+        """
+        with tracer.span("agent.step", SpanKind.AGENT_STEP,
+                         role_name=self.role_name,
+                         role_type=self.role_type.value,
+                         model=self.model.value, stream=stream) as span:
+            openai_messages, num_tokens = self.prepare_messages(input_message)
+
+            try:
+                summary_request = self.get_summary_request(num_tokens)
+                if summary_request is not None:
+                    keep_start, summary_messages = summary_request
+                    response = await self.arequest(summary_messages)
+                    self.fold_history(
+                        keep_start,
+                        response["choices"][0]["message"]["content"])
+                    openai_messages, num_tokens = self.get_window_messages()
+                openai_messages, num_tokens = self.fit_messages(
+                    openai_messages, num_tokens)
+
+                if num_tokens < self.model_token_limit and stream:
+                    info = self.get_info(None, None, [], num_tokens)
+                    chunks = await self.arequest(openai_messages, num_tokens,
+                                                 stream=True)
+                    output_messages = AsyncChatStream(
+                        chunks, lambda response: self.handle_stream(
+                            response, num_tokens, info), self.pop_message)
+                elif num_tokens < self.model_token_limit:
+                    response = await self.arequest(openai_messages, num_tokens)
+                    output_messages, info = self.handle_response(
+                        response, num_tokens)
+                else:
+                    output_messages, info = self.handle_overflow(num_tokens)
+            except BaseException:
+                # The input is only kept in the history once a request with
+                # it succeeds, so that retrying the step does not repeat it.
+                self.pop_message()
+                raise
+
+            span.set_attributes(terminated=self.terminated,
+                                num_tokens=num_tokens)
+            span.set_usage(info["usage"])
+            return output_messages, self.terminated, info
 
     def __repr__(self) -> str:
         return f"ChatAgent({self.role_name}, {self.role_type}, {self.model})"
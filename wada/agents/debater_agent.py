@@ -14,7 +14,10 @@
 
 import os
 import re
-from typing import Union
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from uuid import UUID
 
 from colorama import Fore
 from langchain.agents import (
@@ -23,21 +26,48 @@ from langchain.agents import (
     ConversationalAgent,
     Tool,
 )
-from langchain.chains import ConversationChain
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chains import ConversationChain, LLMChain
 from langchain.chat_models import AzureChatOpenAI
+from langchain.chat_models.openai import acompletion_with_retry
 from langchain.memory import ConversationBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
 )
-from langchain.schema import AgentAction, AgentFinish, AIMessage, HumanMessage
+from langchain.schema import (
+    AgentAction,
+    AgentFinish,
+    AIMessage,
+    BaseMessage,
+    ChatResult,
+    HumanMessage,
+    LLMResult,
+    get_buffer_string,
+    messages_from_dict,
+    messages_to_dict,
+)
 from langchain.tools import DuckDuckGoSearchRun
 from langchain.utilities import ArxivAPIWrapper, WikipediaAPIWrapper
 
+from wada.backends import AzureOpenAIBackend, ChatBackend, get_default_backend
+from wada.cache import ResponseCache, ToolResultCache
+from wada.endpoints import Endpoint, EndpointPool, get_default_endpoint_pool
 from wada.generators import DebatePromptTemplateGenerator
-from wada.typing import ModelType
+from wada.rate_limit import rate_limiters
+from wada.retry import RetryPolicy
+from wada.streaming import AsyncReplyStream, FinalAnswerFilter, ReplyStream
+from wada.tracing import USAGE_KEYS, Span, add_usage, tracer
+from wada.typing import ModelType, RoleType, SpanKind
+from wada.utils import num_tokens_from_messages
 
 
 class CustomOutputParser(AgentOutputParser):
@@ -61,42 +91,496 @@ class CustomOutputParser(AgentOutputParser):
                            log=llm_output)
 
 
-messages = [
-    SystemMessagePromptTemplate.from_template(
-        DebatePromptTemplateGenerator().get_sys_msg_prompt_template()),
-    MessagesPlaceholder(variable_name="chat_history"),
-    HumanMessagePromptTemplate.from_template(
-        DebatePromptTemplateGenerator().get_hmn_msg_prompt_template()),
-]
+class ConversationSummaryWindowMemory(BaseChatMemory, SummarizerMixin):
+    r"""A memory that keeps the exchanges of the last :obj:`k` rounds word
+    for word and folds the older ones into a summary, which is updated
+    incrementally as rounds leave the window. The prompt of every turn then
+    stays about the same size however long the conversation goes.
+
+    An exchange is saved for every step of the ReAct loop of a round, and
+    the exchanges of a round share its input. The window is only pruned by
+    :meth:`prune` or :meth:`aprune`, once the round is over.
+
+    Args:
+        k (int): The number of rounds kept word for word.
+            (default: :obj:`2`)
+        memory_key (str): The prompt variable of the memory.
+            (default: :obj:`"history"`)
+    """
+    k: int = 2
+    moving_summary_buffer: str = ""
+    memory_key: str = "history"
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        return self.chat_memory.messages
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        buffer = self.buffer
+        if self.moving_summary_buffer != "":
+            buffer = [
+                self.summary_message_cls(content=self.moving_summary_buffer)
+            ] + buffer
+        if self.return_messages:
+            return {self.memory_key: buffer}
+        return {
+            self.memory_key:
+            get_buffer_string(buffer, human_prefix=self.human_prefix,
+                              ai_prefix=self.ai_prefix)
+        }
+
+    def get_num_pruned(self) -> int:
+        r"""Returns the number of messages before the last :obj:`k`
+        rounds."""
+        inputs = [message.content for message in self.buffer[::2]]
+        num_rounds = 0
+        for i in reversed(range(len(inputs))):
+            if i == len(inputs) - 1 or inputs[i] != inputs[i + 1]:
+                num_rounds += 1
+                if num_rounds > self.k:
+                    return 2 * (i + 1)
+        return 0
+
+    async def apredict_new_summary(self, messages: List[BaseMessage],
+                                   existing_summary: str) -> str:
+        new_lines = get_buffer_string(messages, human_prefix=self.human_prefix,
+                                      ai_prefix=self.ai_prefix)
+        chain = LLMChain(llm=self.llm, prompt=self.prompt)
+        return await chain.apredict(summary=existing_summary,
+                                    new_lines=new_lines)
+
+    def prune(self) -> None:
+        r"""Folds the rounds that left the window into the summary."""
+        num_pruned = self.get_num_pruned()
+        if num_pruned == 0:
+            return
+        self.moving_summary_buffer = self.predict_new_summary(
+            self.buffer[:num_pruned], self.moving_summary_buffer)
+        del self.buffer[:num_pruned]
+
+    async def aprune(self) -> None:
+        r"""Asynchronous version of :meth:`prune`."""
+        num_pruned = self.get_num_pruned()
+        if num_pruned == 0:
+            return
+        self.moving_summary_buffer = await self.apredict_new_summary(
+            self.buffer[:num_pruned], self.moving_summary_buffer)
+        del self.buffer[:num_pruned]
+
+    def clear(self) -> None:
+        super().clear()
+        self.moving_summary_buffer = ""
+
+
+class DebaterChatModel(AzureChatOpenAI):
+    r"""The Azure OpenAI chat model behind :class:`DebaterAgent`, which can
+    serve repeated requests from a :class:`wada.cache.ResponseCache` and
+    sends requests through the rate limiter of its deployment, see
+    :mod:`wada.rate_limit`. Failed requests are retried by the retry policy
+    of the model rather than by langchain, so :obj:`max_retries` should be
+    left at :obj:`1`. With an endpoint pool, every attempt is sent to an
+    endpoint of the pool instead of the one the model is configured with.
+
+    Args:
+        response_cache (Optional[ResponseCache]): A cache of responses keyed
+            by the deployment, the messages and the sampling parameters of
+            each request. If :obj:`None`, every request goes to the API.
+            (default: :obj:`None`)
+        retry_policy (Optional[RetryPolicy]): How failed requests are
+            retried. If :obj:`None`, the default :class:`RetryPolicy` is
+            used. (default: :obj:`None`)
+        endpoint_pool (Optional[EndpointPool]): The endpoints the requests
+            are spread over. (default: :obj:`None`)
+        backend (Optional[ChatBackend]): The chat completion API the
+            requests are sent to, in place of :obj:`openai.ChatCompletion`.
+            (default: :obj:`None`)
+    """
+    response_cache: Optional[ResponseCache] = None
+    retry_policy: Optional[RetryPolicy] = None
+    endpoint_pool: Optional[EndpointPool] = None
+    backend: Optional[ChatBackend] = None
+    max_retries: int = 1
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # langchain sends every request through `client`, which its
+        # validator always sets to `openai.ChatCompletion`.
+        if self.backend is not None:
+            self.client = self.backend
+
+    def count_tokens(self, message_dicts: List[Dict[str, Any]]) -> int:
+        try:
+            model = ModelType(self.deployment_name)
+        except ValueError:
+            model = ModelType.GPT_4
+        return num_tokens_from_messages(message_dicts, model)
+
+    def get_retry_policy(self) -> RetryPolicy:
+        return self.retry_policy or RetryPolicy()
+
+    def trace_endpoint(self, endpoint: Endpoint) -> None:
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attributes(
+                endpoint=endpoint.name or endpoint.api_base,
+                deployment=endpoint.get_deployment(self.deployment_name))
+
+    @contextmanager
+    def use_endpoint(self, tried: List[Endpoint]) -> Iterator[Endpoint]:
+        if self.endpoint_pool is None:
+            yield Endpoint(api_base=self.openai_api_base,
+                           api_key=self.openai_api_key,
+                           api_version=self.openai_api_version)
+            return
+        with self.endpoint_pool.use(exclude=tried) as endpoint:
+            yield endpoint
+
+    def get_cache_key(
+        self,
+        message_dicts: List[Dict[str, Any]],
+        params: Dict[str, Any],
+    ) -> Optional[str]:
+        if self.response_cache is None or params.get("stream", self.streaming):
+            return None
+        return self.response_cache.make_key(self.deployment_name,
+                                            message_dicts, **params)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        with tracer.span("llm.request", SpanKind.LLM_REQUEST,
+                         model=self.deployment_name,
+                         stream=self.streaming) as span:
+            message_dicts, params = self._create_message_dicts(messages, stop)
+            params = {**params, **kwargs}
+            key = self.get_cache_key(message_dicts, params)
+            if key is not None:
+                response = self.response_cache.get(key)
+                span.set_attributes(cached=response is not None)
+                if response is not None:
+                    span.set_usage(response.get("usage"))
+                    return self._create_chat_result(response)
+
+            num_tokens = self.count_tokens(message_dicts)
+            generate = super()._generate
+            tried: List[Endpoint] = []
+            retry_policy = self.get_retry_policy()
+
+            def attempt() -> ChatResult:
+                with self.use_endpoint(tried) as endpoint:
+                    tried.append(endpoint)
+                    self.trace_endpoint(endpoint)
+                    endpoint_params = endpoint.get_params(self.deployment_name)
+                    request_kwargs = {**kwargs, **endpoint_params}
+                    request_params = {**params, **endpoint_params}
+                    deployment = endpoint.get_key(self.deployment_name)
+                    limiter = rate_limiters.get(deployment)
+                    with retry_policy.guard(deployment), limiter.limit(
+                            num_tokens) as lease:
+                        if key is None:
+                            result = generate(messages, stop=stop,
+                                              run_manager=run_manager,
+                                              **request_kwargs)
+                            lease.record_usage((result.llm_output
+                                                or {}).get("token_usage"))
+                            return result
+                        response = self.completion_with_retry(
+                            messages=message_dicts, run_manager=run_manager,
+                            **request_params)
+                        lease.record_usage(response.get("usage"))
+
+                self.response_cache.set(key, response)
+                return self._create_chat_result(response)
+
+            result = retry_policy.call(self.deployment_name, attempt,
+                                       guarded=False)
+            span.set_usage((result.llm_output or {}).get("token_usage"))
+            return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        with tracer.span("llm.request", SpanKind.LLM_REQUEST,
+                         model=self.deployment_name,
+                         stream=self.streaming) as span:
+            message_dicts, params = self._create_message_dicts(messages, stop)
+            params = {**params, **kwargs}
+            key = self.get_cache_key(message_dicts, params)
+            if key is not None:
+                response = await self.response_cache.aget(key)
+                span.set_attributes(cached=response is not None)
+                if response is not None:
+                    span.set_usage(response.get("usage"))
+                    return self._create_chat_result(response)
+
+            num_tokens = self.count_tokens(message_dicts)
+            agenerate = super()._agenerate
+            tried: List[Endpoint] = []
+            retry_policy = self.get_retry_policy()
+
+            async def attempt() -> ChatResult:
+                with self.use_endpoint(tried) as endpoint:
+                    tried.append(endpoint)
+                    self.trace_endpoint(endpoint)
+                    endpoint_params = endpoint.get_params(self.deployment_name)
+                    request_kwargs = {**kwargs, **endpoint_params}
+                    request_params = {**params, **endpoint_params}
+                    deployment = endpoint.get_key(self.deployment_name)
+                    limiter = rate_limiters.get(deployment)
+                    with retry_policy.guard(deployment):
+                        async with limiter.alimit(num_tokens) as lease:
+                            if key is None:
+                                result = await agenerate(
+                                    messages, stop=stop,
+                                    run_manager=run_manager, **request_kwargs)
+                                lease.record_usage((result.llm_output
+                                                    or {}).get("token_usage"))
+                                return result
+                            response = await acompletion_with_retry(
+                                self, messages=message_dicts,
+                                run_manager=run_manager, **request_params)
+                            lease.record_usage(response.get("usage"))
+
+                await self.response_cache.aset(key, response)
+                return self._create_chat_result(response)
+
+            result = await retry_policy.acall(self.deployment_name, attempt,
+                                              guarded=False)
+            span.set_usage((result.llm_output or {}).get("token_usage"))
+            return result
+
+
+class FinalAnswerCallbackHandler(BaseCallbackHandler):
+    r"""Pushes the tokens of the final answer of a ReAct loop as they are
+    generated. The thoughts and actions before it are not pushed.
+
+    Args:
+        push (Callable[[str], None]): Called with every new piece of the
+            final answer.
+    """
+
+    def __init__(self, push: Callable[[str], None]) -> None:
+        self.push = push
+        self.filter = FinalAnswerFilter()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                     **kwargs: Any) -> None:
+        self.filter.reset()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any],
+                            messages: List[List[BaseMessage]],
+                            **kwargs: Any) -> None:
+        self.filter.reset()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.push(self.filter.feed(token))
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.push(self.filter.flush())
+
+
+class AsyncFinalAnswerCallbackHandler(AsyncCallbackHandler):
+    r"""Asynchronous version of :class:`FinalAnswerCallbackHandler`."""
+
+    def __init__(self, push: Callable[[str], None]) -> None:
+        self.push = push
+        self.filter = FinalAnswerFilter()
+
+    async def on_llm_start(self, serialized: Dict[str, Any],
+                           prompts: List[str], **kwargs: Any) -> None:
+        self.filter.reset()
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any],
+                                  messages: List[List[BaseMessage]],
+                                  **kwargs: Any) -> None:
+        self.filter.reset()
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.push(self.filter.feed(token))
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.push(self.filter.flush())
+
 
-prompt = ChatPromptTemplate.from_messages(messages)
+class UsageCallbackHandler(BaseCallbackHandler):
+    r"""Adds up the token usage of the requests of a run.
 
-# tools = load_tools(["arxiv", "ddg-search", "wikipedia"])
+    Args:
+        usage (Dict[str, int]): The running total to add to.
+    """
+
+    run_inline = True
+
+    def __init__(self, usage: Dict[str, int]) -> None:
+        self.usage = usage
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        add_usage(self.usage, (response.llm_output or {}).get("token_usage"))
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    r"""Traces the ReAct loop of a :class:`DebaterAgent` run. Every
+    iteration gets a span, from the request of the model to the end of the
+    tool it asked for, or to the final answer, and every tool call gets a
+    child span of its iteration. The token usage of the run is added up on
+    the span of the run.
+
+    langchain may call the handler from another task than the run, so the
+    spans are parented explicitly instead of being made current. The
+    request spans of :class:`DebaterChatModel` are children of the span of
+    the run.
+
+    Args:
+        span (Span): The span of the run.
+    """
+
+    # Called in the event loop rather than in an executor by async runs.
+    run_inline = True
+
+    def __init__(self, span: Span) -> None:
+        self.span = span
+        self.iteration: Optional[Span] = None
+        self.num_iterations = 0
+        self.tools: Dict[UUID, Span] = {}
+
+    def start_iteration(self) -> None:
+        if self.iteration is not None:
+            return
+        self.num_iterations += 1
+        self.iteration = tracer.start_span("react.iteration",
+                                           SpanKind.REACT_ITERATION,
+                                           parent=self.span,
+                                           iteration=self.num_iterations)
+
+    def end_iteration(self, error: Optional[BaseException] = None) -> None:
+        if self.iteration is not None:
+            tracer.end_span(self.iteration, error)
+            self.iteration = None
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                     **kwargs: Any) -> None:
+        self.start_iteration()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any],
+                            messages: List[List[BaseMessage]],
+                            **kwargs: Any) -> None:
+        self.start_iteration()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for key in USAGE_KEYS:
+            if key in usage:
+                total = self.span.attributes.get(key, 0) + usage[key]
+                self.span.set_attributes(**{key: total})
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.end_iteration(error)
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        if self.iteration is not None:
+            self.iteration.set_attributes(action=action.tool)
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        self.end_iteration()
+        self.span.set_attributes(iterations=self.num_iterations)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, **kwargs: Any) -> None:
+        self.tools[run_id] = tracer.start_span(
+            "tool", SpanKind.TOOL, parent=self.iteration or self.span,
+            tool=serialized.get("name"), input=input_str)
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self.tools.pop(run_id, None)
+        if span is not None:
+            span.set_attributes(output_chars=len(str(output)))
+            tracer.end_span(span)
+        self.end_iteration()
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID,
+                      **kwargs: Any) -> None:
+        span = self.tools.pop(run_id, None)
+        if span is not None:
+            tracer.end_span(span, error)
+        self.end_iteration(error)
+
+
+tool_cache = ToolResultCache()
+
+
+@lru_cache(maxsize=None)
+def get_default_prompt() -> ChatPromptTemplate:
+    r"""Builds the default prompt template of :class:`DebaterAgent` on first
+    use."""
+    messages = [
+        SystemMessagePromptTemplate.from_template(
+            DebatePromptTemplateGenerator().get_sys_msg_prompt_template()),
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template(
+            DebatePromptTemplateGenerator().get_hmn_msg_prompt_template()),
+    ]
+    return ChatPromptTemplate.from_messages(messages)
 
-tools = [
-    Tool(
-        name="Search", func=DuckDuckGoSearchRun().run, description=
-        "A search engine. Useful for when you need to answer questions about current events. "
-        "Input should be a search query"),
-    Tool(
-        name="Wikipedia", func=WikipediaAPIWrapper().run, description=
-        "An online encyclopedia providing information on various topics. Useful for research "
-        "and general knowledge. Input should be a search query"),
-    Tool(
-        name="Arxiv", func=ArxivAPIWrapper().run, description=
-        "An online repository of scientific papers. Useful for accessing research papers in "
-        "various fields. Input should be a search query")
-]
+
+@lru_cache(maxsize=None)
+def get_default_tools() -> Tuple[Tool, ...]:
+    r"""Builds the default search tools of :class:`DebaterAgent` on first
+    use. The tools are shared by every debater in the process, and their
+    results go through :obj:`tool_cache`."""
+    # tools = load_tools(["arxiv", "ddg-search", "wikipedia"])
+    return (
+        Tool(
+            name="Search", func=tool_cache.wrap("Search",
+                                                DuckDuckGoSearchRun().run),
+            description=
+            "A search engine. Useful for when you need to answer questions about current events. "
+            "Input should be a search query"),
+        Tool(
+            name="Wikipedia", func=tool_cache.wrap("Wikipedia",
+                                                   WikipediaAPIWrapper().run),
+            description=
+            "An online encyclopedia providing information on various topics. Useful for research "
+            "and general knowledge. Input should be a search query"),
+        Tool(
+            name="Arxiv", func=tool_cache.wrap("Arxiv",
+                                               ArxivAPIWrapper().run),
+            description=
+            "An online repository of scientific papers. Useful for accessing research papers in "
+            "various fields. Input should be a search query"),
+    )
+
+
+def __getattr__(name: str) -> Any:
+    # Kept for code that imported the module-level `prompt` and `tools`.
+    if name == "prompt":
+        return get_default_prompt()
+    if name == "tools":
+        return list(get_default_tools())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class DebaterAgent:
     r"""A langchain conversational agent that can debate.
 
     Args:
-        tools (list[Tool]): The tools to use for the agent.
-            (default: :obj:`List[Tool]` loaded from :obj:`tools`)
-        prompt (ChatPromptTemplate): The prompt template to use for the agent.
-            (default: :obj:`ChatPromptTemplate` loaded from :obj:`prompt`)
+        tools (Optional[list[Tool]]): The tools to use for the agent. If
+            :obj:`None`, the tools of :func:`get_default_tools` are used.
+            (default: :obj:`None`)
+        prompt (Optional[ChatPromptTemplate]): The prompt template to use for
+            the agent. If :obj:`None`, the template of
+            :func:`get_default_prompt` is used. (default: :obj:`None`)
         temperature (float): The temperature to use for the agent.
             (default: :obj:`0.0`)
         model (ModelType): The model type to use for the agent.
@@ -105,17 +589,45 @@ class DebaterAgent:
             for the agent. (default: :obj:`{}`)
         verbose (bool): Whether or not to print the agent's output.
             (default: :obj:`False`)
+        response_cache (Optional[ResponseCache]): A cache of responses of
+            the agent's chat model, see :class:`DebaterChatModel`.
+            (default: :obj:`None`)
+        memory_window (Optional[int]): The number of rounds the agent
+            remembers word for word. Older rounds are folded into a summary
+            at the end of each step, see
+            :class:`ConversationSummaryWindowMemory`. If :obj:`None`, the
+            agent remembers every round word for word.
+            (default: :obj:`None`)
+        retry_policy (Optional[RetryPolicy]): How failed requests of the
+            agent's chat model are retried. (default: :obj:`None`)
+        endpoint_pool (Optional[EndpointPool]): The endpoints the requests
+            of the agent's chat model are spread over. If :obj:`None`, the
+            pool configured in the environment is used, if any.
+            (default: :obj:`None`)
+        backend (Optional[ChatBackend]): The chat completion API the
+            requests of the agent's chat model are sent to. If :obj:`None`,
+            the backend selected in the environment is used, see
+            :func:`wada.backends.get_default_backend`. (default: :obj:`None`)
     """
 
     def __init__(
         self,
-        tools: list[Tool] = tools,
-        prompt: ChatPromptTemplate = prompt,
+        tools: Optional[list[Tool]] = None,
+        prompt: Optional[ChatPromptTemplate] = None,
         temperature: float = 0.0,
         model: ModelType = ModelType.GPT_4,
         sys_msg_dict: dict[str, str] = {},
         verbose: bool = False,
+        response_cache: Optional[ResponseCache] = None,
+        memory_window: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        backend: Optional[ChatBackend] = None,
     ) -> None:
+        if tools is None:
+            tools = list(get_default_tools())
+        if prompt is None:
+            prompt = get_default_prompt()
         self.tools = tools
         self.tool_names = [tool.name for tool in self.tools]
         self.prompt = prompt
@@ -123,18 +635,38 @@ class DebaterAgent:
         self.sys_msg_dict = sys_msg_dict
         self.model = model
 
-        self.chat = AzureChatOpenAI(
-            temperature=temperature,
+        backend = backend or get_default_backend()
+        azure_config = dict(
             openai_api_base=os.getenv("OPENAI_API_BASE"),
             openai_api_version=os.getenv("OPENAI_API_VERSION"),
-            deployment_name=self.model.value,
             openai_api_key=os.getenv("OPENAI_API_KEY"),
+        )
+        if not isinstance(backend, AzureOpenAIBackend):
+            # langchain requires the Azure settings even if they are unused.
+            azure_config = {
+                key: value or "unused"
+                for key, value in azure_config.items()
+            }
+        self.chat = DebaterChatModel(
+            temperature=temperature,
+            deployment_name=self.model.value,
             openai_api_type="azure",
+            response_cache=response_cache,
+            retry_policy=retry_policy,
+            endpoint_pool=endpoint_pool or get_default_endpoint_pool(),
+            backend=backend,
+            **azure_config,
         )
 
-        self.memory = ConversationBufferMemory(return_messages=True,
-                                               memory_key="chat_history",
-                                               input_key="input", verbose=True)
+        if memory_window is None:
+            self.memory = ConversationBufferMemory(return_messages=True,
+                                                   memory_key="chat_history",
+                                                   input_key="input",
+                                                   verbose=True)
+        else:
+            self.memory = ConversationSummaryWindowMemory(
+                llm=self.chat, k=memory_window, return_messages=True,
+                memory_key="chat_history", input_key="input")
 
         self.conversation = ConversationChain(memory=self.memory,
                                               prompt=prompt, llm=self.chat,
@@ -148,14 +680,142 @@ class DebaterAgent:
 
         self.agent_executor = AgentExecutor.from_agent_and_tools(
             agent=self.agent, tools=self.tools, verbose=verbose)
+        # The token usage of the runs since the last reset.
+        self.usage: Dict[str, int] = {}
+
+    def step(self, input: str,
+             stream: bool = False) -> Union[str, ReplyStream]:
+        r"""Runs the agent on the input and returns its final answer.
+
+        Args:
+            input (str): The input of the agent.
+            stream (bool): Whether to stream the final answer. If
+                :obj:`True`, a :class:`ReplyStream` of deltas is returned,
+                and the agent runs in a background thread while it is
+                iterated. (default: :obj:`False`)
+
+        Returns:
+            Union[str, ReplyStream]: The final answer or its stream.
+        """
+        if stream:
+            return ReplyStream(lambda push: self.run_streaming(input, push))
+        return self.run(input)
+
+    async def astep(self, input: str,
+                    stream: bool = False) -> Union[str, AsyncReplyStream]:
+        if stream:
+            return AsyncReplyStream(
+                lambda push: self.arun_streaming(input, push))
+        return await self.arun(input)
+
+    def trace_step(self, stream: bool) -> Any:
+        return tracer.span("agent.step", SpanKind.AGENT_STEP,
+                           role_name=self.sys_msg_dict.get("stance"),
+                           role_type=RoleType.DEBATER.value,
+                           model=self.model.value, stream=stream)
+
+    def run(
+        self,
+        input: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ) -> str:
+        r"""Runs the ReAct loop of the agent on the input in an agent step
+        span, and returns its final answer.
+
+        Args:
+            input (str): The input of the agent.
+            callbacks (Optional[List[BaseCallbackHandler]]): The langchain
+                callbacks of the run. (default: :obj:`None`)
 
-    def step(self, input: str) -> str:
-        res = self.agent_executor.run(input=input, tool_names=self.tool_names,
-                                      **self.sys_msg_dict)
+        Returns:
+            str: The final answer.
+        """
+        callbacks = list(callbacks or []) + [UsageCallbackHandler(self.usage)]
+        with self.trace_step(self.chat.streaming) as span:
+            if tracer.enabled:
+                callbacks.append(TracingCallbackHandler(span))
+            res = self.agent_executor.run(input=input,
+                                          tool_names=self.tool_names,
+                                          callbacks=callbacks,
+                                          **self.sys_msg_dict)
+            if isinstance(self.memory, ConversationSummaryWindowMemory):
+                self.memory.prune()
         return res.replace("###", "")
 
+    async def arun(
+        self,
+        input: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ) -> str:
+        r"""Asynchronous version of :meth:`run`."""
+        callbacks = list(callbacks or []) + [UsageCallbackHandler(self.usage)]
+        with self.trace_step(self.chat.streaming) as span:
+            if tracer.enabled:
+                callbacks.append(TracingCallbackHandler(span))
+            res = await self.agent_executor.arun(input=input,
+                                                 tool_names=self.tool_names,
+                                                 callbacks=callbacks,
+                                                 **self.sys_msg_dict)
+            if isinstance(self.memory, ConversationSummaryWindowMemory):
+                await self.memory.aprune()
+        return res.replace("###", "")
+
+    def run_streaming(self, input: str, push: Callable[[str], None]) -> str:
+        self.chat.streaming = True
+        try:
+            return self.run(input, [FinalAnswerCallbackHandler(push)])
+        finally:
+            self.chat.streaming = False
+
+    async def arun_streaming(
+        self,
+        input: str,
+        push: Callable[[str], None],
+    ) -> str:
+        self.chat.streaming = True
+        try:
+            return await self.arun(input,
+                                   [AsyncFinalAnswerCallbackHandler(push)])
+        finally:
+            self.chat.streaming = False
+
     def reset(self) -> None:
         self.memory.clear()
+        self.usage = {}
+
+    def checkpoint(self) -> Tuple[List[BaseMessage], Optional[str]]:
+        r"""Returns a checkpoint of the agent's memory to roll back to."""
+        return (list(self.memory.chat_memory.messages),
+                getattr(self.memory, "moving_summary_buffer", None))
+
+    def rollback(self, checkpoint: Tuple[List[BaseMessage],
+                                         Optional[str]]) -> None:
+        r"""Forgets the exchanges saved after :obj:`checkpoint`."""
+        messages, summary = checkpoint
+        self.memory.chat_memory.messages[:] = messages
+        if summary is not None:
+            self.memory.moving_summary_buffer = summary
+
+    def get_state(
+        self,
+        checkpoint: Optional[Tuple[List[BaseMessage], Optional[str]]] = None,
+    ) -> Dict[str, Any]:
+        r"""Returns the agent's memory as plain data, see :meth:`set_state`.
+
+        Args:
+            checkpoint (Optional[Tuple[List[BaseMessage], Optional[str]]]):
+                A checkpoint of the memory to serialize instead of the
+                current one. (default: :obj:`None`)
+        """
+        messages, summary = checkpoint or self.checkpoint()
+        return dict(messages=messages_to_dict(messages), summary=summary,
+                    usage=dict(self.usage))
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        r"""Restores the memory returned by :meth:`get_state`."""
+        self.usage = dict(state["usage"])
+        self.rollback(
+            (messages_from_dict(state["messages"]), state["summary"]))
 
     def print_memory(self):
         for i in range(len(self.memory.buffer)):
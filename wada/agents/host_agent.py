@@ -12,13 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from colorama import Fore
 
 from wada.agents import ChatAgent
-from wada.messages import SystemMessage, UserChatMessage
-from wada.typing import ModelType, RoleType
+from wada.backends import ChatBackend
+from wada.cache import ResponseCache
+from wada.endpoints import EndpointPool
+from wada.hedging import HedgePolicy
+from wada.messages import ChatMessage, SystemMessage, UserChatMessage
+from wada.metrics import HOST_VERDICTS
+from wada.retry import RetryPolicy
+from wada.transcript import TranscriptWindow, WindowMessage
+from wada.typing import ModelType, OverflowPolicy, RoleType
 
 
 class HostAgent(ChatAgent):
@@ -31,6 +38,23 @@ class HostAgent(ChatAgent):
         message_window_size (Optional[int]): The maximum number of messages
             to use for the agent's message window. If :obj:`None`, then
             the message window size is unlimited. (default: :obj:`6`)
+        message_window_tokens (Optional[int]): The token budget of the
+            agent's message window, see :class:`ChatAgent`. If :obj:`None`,
+            the window is not limited by tokens. (default: :obj:`None`)
+        overflow_policy (OverflowPolicy): What to do when the message window
+            does not fit in the model's context, see :class:`ChatAgent`.
+            (default: :obj:`OverflowPolicy.TRIM`)
+        response_cache (Optional[ResponseCache]): A cache of responses, see
+            :class:`ChatAgent`. (default: :obj:`None`)
+        retry_policy (Optional[RetryPolicy]): How failed requests are
+            retried, see :class:`ChatAgent`. (default: :obj:`None`)
+        endpoint_pool (Optional[EndpointPool]): The endpoints the requests
+            are spread over, see :class:`ChatAgent`. (default: :obj:`None`)
+        hedge_policy (Optional[HedgePolicy]): When to send a duplicate of a
+            slow request, see :class:`ChatAgent`. (default: :obj:`None`)
+        backend (Optional[ChatBackend]): The chat completion API the
+            requests are sent to, see :class:`ChatAgent`.
+            (default: :obj:`None`)
         menu_color (Any): The output color in console.
             (default: :obj:`Fore.MAGENTA`)
         role_name (str): The role name of the agent.
@@ -42,19 +66,68 @@ class HostAgent(ChatAgent):
         system_message: SystemMessage,
         model: ModelType = ModelType.GPT_4,
         message_window_size: int = 6,
+        message_window_tokens: Optional[int] = None,
+        overflow_policy: OverflowPolicy = OverflowPolicy.TRIM,
+        response_cache: Optional[ResponseCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        backend: Optional[ChatBackend] = None,
         menu_color: Any = Fore.MAGENTA,
         role_name: str = "Host",
     ) -> None:
         super().__init__(system_message, model=model,
-                         message_window_size=message_window_size)
+                         message_window_size=message_window_size,
+                         message_window_tokens=message_window_tokens,
+                         overflow_policy=overflow_policy,
+                         response_cache=response_cache,
+                         retry_policy=retry_policy,
+                         endpoint_pool=endpoint_pool,
+                         hedge_policy=hedge_policy, backend=backend)
         self.menu_color = menu_color
         self.role_name = role_name
         self.judgement = ""
 
-    def step(self, messages: str) -> Tuple[bool, Optional[str]]:
-        chat_msg = UserChatMessage(role_name=self.role_name,
-                                   role_type=RoleType.HOST, content=messages)
-        replies, terminated, info = super().step(chat_msg)
+    def get_state(self) -> Dict[str, Any]:
+        return {**super().get_state(), "judgement": self.judgement}
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        super().set_state(state)
+        self.judgement = state["judgement"]
+
+    def get_message(
+        self,
+        messages: Union[str, TranscriptWindow],
+    ) -> Union[UserChatMessage, WindowMessage]:
+        r"""Returns the message asking to judge a round. A window of the
+        transcript is kept as it is, and rendered whenever it is sent, so
+        the host does not hold a copy of the round."""
+        if isinstance(messages, TranscriptWindow):
+            return WindowMessage(self.role_name, RoleType.HOST, messages)
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.HOST, content=messages)
+
+    def step(
+        self,
+        messages: Union[str, TranscriptWindow],
+    ) -> Tuple[bool, Optional[str]]:
+        replies, terminated, info = super().step(self.get_message(messages))
+        return self.process_replies(replies, terminated, info)
+
+    async def astep(
+        self,
+        messages: Union[str, TranscriptWindow],
+    ) -> Tuple[bool, Optional[str]]:
+        replies, terminated, info = await super().astep(
+            self.get_message(messages))
+        return self.process_replies(replies, terminated, info)
+
+    def process_replies(
+        self,
+        replies: Optional[List[ChatMessage]],
+        terminated: bool,
+        info: Dict[str, Any],
+    ) -> Tuple[bool, Optional[str]]:
         if terminated or replies is None:
             raise ValueError(f"Ready to judge failed due to {info}")
 
@@ -63,9 +136,12 @@ class HostAgent(ChatAgent):
         print(self.menu_color, reply.content)
 
         if "CONTINUE" in reply.content:
+            HOST_VERDICTS.inc(verdict="continue")
             return (True, reply.content)
         elif "END" in reply.content:
+            HOST_VERDICTS.inc(verdict="end")
             self.judgement = reply.content.replace("<<<END>>>", "").strip()
             return (False, self.judgement)
         else:
+            HOST_VERDICTS.inc(verdict="invalid")
             raise ValueError(f"Invalid reply during judging: {reply}")
@@ -12,16 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import re
-from typing import Any, Tuple
+from typing import Any, List, Optional, Tuple
 
 from colorama import Fore
 
 from wada.agents import ChatAgent
+from wada.backends import ChatBackend
+from wada.cache import ResponseCache
 from wada.generators import DebatePromptGenerator, SystemMessageGenerator
-from wada.messages import UserChatMessage
+from wada.messages import ChatMessage, UserChatMessage
+from wada.metrics import TOPIC_PHASE_SECONDS, TOPIC_QUESTIONS, TOPICS_ELICITED
+from wada.retry import RetryPolicy
 from wada.topic import Topic
-from wada.typing import ModelType, RoleType
+from wada.typing import ModelType, OverflowPolicy, RoleType
 
 
 class TopicAgent(ChatAgent):
@@ -37,6 +42,16 @@ class TopicAgent(ChatAgent):
             (default: :obj:`"Host"`)
         question_limit (int): The maximum number of questions to ask.
             (default: :obj:`10`)
+        overflow_policy (OverflowPolicy): What to do when the history does
+            not fit in the model's context, see :class:`ChatAgent`.
+            (default: :obj:`OverflowPolicy.SUMMARIZE`)
+        response_cache (Optional[ResponseCache]): A cache of responses, see
+            :class:`ChatAgent`. (default: :obj:`None`)
+        retry_policy (Optional[RetryPolicy]): How failed requests are
+            retried, see :class:`ChatAgent`. (default: :obj:`None`)
+        backend (Optional[ChatBackend]): The chat completion API the
+            requests are sent to, see :class:`ChatAgent`.
+            (default: :obj:`None`)
     """
 
     def __init__(
@@ -46,34 +61,36 @@ class TopicAgent(ChatAgent):
         menu_color: Any = Fore.CYAN,
         role_name: str = "Topic Specifier",
         question_limit: int = 10,
+        overflow_policy: OverflowPolicy = OverflowPolicy.SUMMARIZE,
+        response_cache: Optional[ResponseCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        backend: Optional[ChatBackend] = None,
     ) -> None:
 
         system_message = SystemMessageGenerator().from_dict(
             meta_dict=None, role_tuple=(role_name, RoleType.TOPIC))
 
-        super().__init__(system_message, model, temperature=1.0)
+        super().__init__(system_message, model, temperature=1.0,
+                         overflow_policy=overflow_policy,
+                         response_cache=response_cache,
+                         retry_policy=retry_policy, backend=backend)
 
         self.topic = topic
         self.menu_color = menu_color
         self.role_name = role_name
         self.question_limit = question_limit
 
-    def break_down_topic(self) -> Tuple[str, str]:
+    def get_break_down_message(self) -> UserChatMessage:
         prompt = DebatePromptGenerator().get_topic_break_down_prompt(
             self.topic.content)
-        chat_msg = UserChatMessage(role_name=self.role_name,
-                                   role_type=RoleType.TOPIC, content=prompt)
-        print(self.topic)
-
-        replies, terminated, info = self.step(chat_msg)
-        if terminated or replies is None:
-            raise ValueError(f"Breaking down topic failed due to {info}")
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.TOPIC, content=prompt)
 
+    def set_break_down(self, reply: ChatMessage) -> Tuple[str, str]:
         pro_regex = r"PRO:\s(.+)"
         con_regex = r"CON:\s(.+)"
 
-        self.update_messages(replies[0])
-        content = replies[0].content
+        content = reply.content
 
         pro_match = re.search(pro_regex, content)
         if pro_match:
@@ -90,27 +107,47 @@ class TopicAgent(ChatAgent):
 
         return (pro_content, con_content)
 
-    def specify_topic(self) -> str:
-        prompt = DebatePromptGenerator().get_topic_specify_prompt(
-            topic=self.topic)
+    @TOPIC_PHASE_SECONDS.time(phase="break_down")
+    def break_down_topic(self) -> Tuple[str, str]:
+        chat_msg = self.get_break_down_message()
+        print(self.topic)
 
-        chat_msg = UserChatMessage(role_name=self.role_name,
-                                   role_type=RoleType.TOPIC, content=prompt)
         replies, terminated, info = self.step(chat_msg)
         if terminated or replies is None:
-            raise ValueError(f"Specifying topic failed due to {info}")
+            raise ValueError(f"Breaking down topic failed due to {info}")
 
         self.update_messages(replies[0])
-        self.topic.specified_aspects = replies[0].content
+        return self.set_break_down(replies[0])
+
+    def get_specify_message(self, topic: Any = None) -> UserChatMessage:
+        prompt = DebatePromptGenerator().get_topic_specify_prompt(
+            topic=self.topic if topic is None else topic)
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.TOPIC, content=prompt)
+
+    def set_specified_aspects(self, reply: ChatMessage) -> str:
+        self.topic.specified_aspects = reply.content
         print(self.menu_color + self.topic.specified_aspects)
         return self.topic.specified_aspects
 
-    def abbreviate_topic(self) -> str:
+    @TOPIC_PHASE_SECONDS.time(phase="specify")
+    def specify_topic(self) -> str:
+        chat_msg = self.get_specify_message()
+        replies, terminated, info = self.step(chat_msg)
+        if terminated or replies is None:
+            raise ValueError(f"Specifying topic failed due to {info}")
+
+        self.update_messages(replies[0])
+        return self.set_specified_aspects(replies[0])
+
+    def get_abbreviate_message(self) -> UserChatMessage:
         prompt = DebatePromptGenerator().get_topic_abbreviate_prompt(
             topic=self.topic)
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.TOPIC, content=prompt)
 
-        chat_msg = UserChatMessage(role_name=self.role_name,
-                                   role_type=RoleType.TOPIC, content=prompt)
+    def abbreviate_topic(self) -> str:
+        chat_msg = self.get_abbreviate_message()
         replies, terminated, info = self.step(chat_msg)
         if terminated or replies is None:
             raise ValueError(f"Abbreviating topic failed due to {info}")
@@ -120,30 +157,52 @@ class TopicAgent(ChatAgent):
         print(self.menu_color + self.topic.abbr)
         return self.topic.abbr
 
-    def collect_bg(self) -> str:
+    def get_collect_bg_message(self) -> UserChatMessage:
         prompt = DebatePromptGenerator().get_collect_bg_prompt()
-        chat_msg = UserChatMessage(role_name=self.role_name,
-                                   role_type=RoleType.TOPIC, content=prompt)
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.TOPIC, content=prompt)
+
+    def set_background(self, reply: ChatMessage) -> str:
+        self.topic.background = reply.content
+        print(self.menu_color + self.topic.background)
+        return self.topic.background
+
+    @TOPIC_PHASE_SECONDS.time(phase="collect_bg")
+    def collect_bg(self) -> str:
+        chat_msg = self.get_collect_bg_message()
 
         replies, terminated, info = self.step(chat_msg)
         if terminated or replies is None:
             raise ValueError(f"Collecting background failed due to {info}")
 
         self.update_messages(replies[0])
-        self.topic.background = replies[0].content
-        print(self.menu_color + self.topic.background)
-        return self.topic.background
+        return self.set_background(replies[0])
 
-    def collect_pref(self, answer: str = None) -> Tuple[bool, str]:
+    def get_collect_pref_message(self, answer: str = None) -> UserChatMessage:
         if answer is None:
             prompt = DebatePromptGenerator().get_collect_info_prompt()
-            chat_msg = UserChatMessage(role_name=self.role_name,
-                                       role_type=RoleType.TOPIC,
-                                       content=prompt)
+            return UserChatMessage(role_name=self.role_name,
+                                   role_type=RoleType.TOPIC, content=prompt)
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=RoleType.TOPIC, content=answer)
+
+    def is_question(self, reply: ChatMessage) -> bool:
+        if "<QUESTION>" in reply.content or "QUESTION:" in reply.content:
+            return True
+        elif "<SUMMARY>" in reply.content or "SUMMARY:" in reply.content:
+            return False
         else:
-            chat_msg = UserChatMessage(role_name=self.role_name,
-                                       role_type=RoleType.TOPIC,
-                                       content=answer)
+            raise ValueError(
+                f"Invalid reply, missing <QUESTION> or <SUMMARY>: {reply}")
+
+    def get_rephrase_sum_message(self) -> UserChatMessage:
+        return UserChatMessage(
+            role_name=self.role_name, role_type=RoleType.TOPIC,
+            content=DebatePromptGenerator().get_rephrase_sum_prompt())
+
+    @TOPIC_PHASE_SECONDS.time(phase="collect_pref")
+    def collect_pref(self, answer: str = None) -> Tuple[bool, str]:
+        chat_msg = self.get_collect_pref_message(answer)
 
         replies, terminated, info = self.step(chat_msg)
 
@@ -155,37 +214,122 @@ class TopicAgent(ChatAgent):
 
         print(self.menu_color + reply.content + "\n")
 
-        if "<QUESTION>" in reply.content or "QUESTION:" in reply.content:
+        if self.is_question(reply):
+            TOPIC_QUESTIONS.inc()
             return (False, reply.content)
 
-        elif "<SUMMARY>" in reply.content or "SUMMARY:" in reply.content:
-            chat_msg = UserChatMessage(
-                role_name=self.role_name, role_type=RoleType.TOPIC,
-                content=DebatePromptGenerator().get_rephrase_sum_prompt())
+        replies, terminated, info = self.step(self.get_rephrase_sum_message())
+        if terminated or replies is None:
+            raise ValueError(f"Rephrasing failed due to {info}")
 
-            replies, terminated, info = self.step(chat_msg)
-            if terminated or replies is None:
-                raise ValueError(f"Rephrasing failed due to {info}")
+        self.update_messages(replies[0])
+        self.topic.preference = replies[0].content
+        TOPICS_ELICITED.inc()
+        return (True, self.topic.preference)
+
+    def fork(self, context: List[ChatMessage]) -> ChatAgent:
+        r"""Returns a chat agent with the same settings whose history is only
+        the system message and :obj:`context`."""
+        agent = ChatAgent(self.system_message, self.model,
+                          temperature=self.temperature,
+                          overflow_policy=self.overflow_policy,
+                          response_cache=self.response_cache,
+                          retry_policy=self.retry_policy,
+                          endpoint_pool=self.endpoint_pool,
+                          hedge_policy=self.hedge_policy, backend=self.backend)
+        for message in context:
+            agent.update_messages(message)
+        return agent
+
+    async def arun_forked(
+        self,
+        context: List[ChatMessage],
+        chat_msg: UserChatMessage,
+        action: str,
+    ) -> ChatMessage:
+        replies, terminated, info = await self.fork(context).astep(chat_msg)
+        if terminated or replies is None:
+            raise ValueError(f"{action} failed due to {info}")
+        return replies[0]
+
+    async def aprepare(self) -> Tuple[bool, str]:
+        r"""Runs the setup of the topic and asks the first preference
+        question, issuing the independent prompts concurrently. The
+        breakdown and the aspects only need the topic text, while the
+        background and the first question only need the aspects, so the
+        setup takes two sequential requests instead of four. The prompts
+        and replies are then stored in the same order as in :meth:`start`.
+
+        Returns:
+            Tuple[bool, str]: The result of the first
+                :meth:`collect_pref`.
+        """
+        break_down_msg = self.get_break_down_message()
+        specify_msg = self.get_specify_message(self.topic.content)
+        collect_bg_msg = self.get_collect_bg_message()
+        collect_pref_msg = self.get_collect_pref_message()
+
+        async def specify_and_collect() -> Tuple[ChatMessage, ...]:
+            specify_reply = await self.arun_forked([], specify_msg,
+                                                   "Specifying topic")
+            context = [specify_msg, specify_reply]
+            bg_reply, pref_reply = await asyncio.gather(
+                self.arun_forked(context, collect_bg_msg,
+                                 "Collecting background"),
+                self.arun_forked(context, collect_pref_msg,
+                                 "Collecting information"))
+            return specify_reply, bg_reply, pref_reply
+
+        with TOPIC_PHASE_SECONDS.time(phase="prepare"):
+            break_down_reply, replies = await asyncio.gather(
+                self.arun_forked([], break_down_msg, "Breaking down topic"),
+                specify_and_collect())
+        specify_reply, bg_reply, pref_reply = replies
+
+        for message in (break_down_msg, break_down_reply, specify_msg,
+                        specify_reply, collect_bg_msg, bg_reply,
+                        collect_pref_msg, pref_reply):
+            self.update_messages(message)
+        self.set_break_down(break_down_reply)
+        self.set_specified_aspects(specify_reply)
+        self.set_background(bg_reply)
+
+        print(self.menu_color + pref_reply.content + "\n")
+        if self.is_question(pref_reply):
+            TOPIC_QUESTIONS.inc()
+            return (False, pref_reply.content)
+
+        replies, terminated, info = await self.astep(
+            self.get_rephrase_sum_message())
+        if terminated or replies is None:
+            raise ValueError(f"Rephrasing failed due to {info}")
 
-            self.update_messages(replies[0])
-            self.topic.preference = replies[0].content
-            return (True, self.topic.preference)
-        else:
-            raise ValueError(
-                f"Invalid reply, missing <QUESTION> or <SUMMARY>: {reply}")
+        self.update_messages(replies[0])
+        self.topic.preference = replies[0].content
+        TOPICS_ELICITED.inc()
+        return (True, self.topic.preference)
+
+    def start(self, concurrent_setup: bool = False) -> None:
+        r"""Specifies the topic and asks about the preferences in the console.
 
-    def start(self) -> None:
+        Args:
+            concurrent_setup (bool): Whether to run the setup with
+                :meth:`aprepare`. (default: :obj:`False`)
+        """
 
         self.reset()
-        self.break_down_topic()
-        self.specify_topic()
-        self.collect_bg()
+        if not concurrent_setup:
+            self.break_down_topic()
+            self.specify_topic()
+            self.collect_bg()
 
         my_input = ""
         n = 0
         while n < self.question_limit:
             n += 1
-            if n == 1:
+            if n == 1 and concurrent_setup:
+                (is_summary, content) = asyncio.run(self.aprepare())
+            elif n == 1:
                 (is_summary, content) = self.collect_pref()
             else:
                 (is_summary, content) = self.collect_pref(my_input)
@@ -0,0 +1,305 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from wada.messages import MessageType, message_from_dict
+from wada.topic import Topic
+from wada.typing import TopicType
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS debates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    model TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    pro TEXT NOT NULL,
+    con TEXT NOT NULL,
+    background TEXT NOT NULL,
+    preference TEXT NOT NULL,
+    specified_aspects TEXT NOT NULL,
+    abbr TEXT NOT NULL,
+    judgement TEXT NOT NULL,
+    num_messages INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    timings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    debate_id INTEGER NOT NULL REFERENCES debates (id),
+    position INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (debate_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS debates_category ON debates (category, date);
+CREATE INDEX IF NOT EXISTS debates_model ON debates (model, date);
+CREATE INDEX IF NOT EXISTS debates_date ON debates (date);
+"""
+
+TOPIC_COLUMNS = ("pro", "con", "background", "preference", "specified_aspects",
+                 "abbr")
+USAGE_COLUMNS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+@dataclass
+class ArchivedDebate:
+    r"""The transcript of a finished debate, as kept in a
+    :class:`TranscriptArchive`.
+
+    Args:
+        topic (Topic): The topic of the debate, with its category.
+        model (str): The model of the debate.
+        messages (List[MessageType]): The history of the debate.
+        judgement (str): The judgement of the host. (default: :obj:`""`)
+        usage (Dict[str, int]): The token usage of the debate.
+            (default: :obj:`{}`)
+        timings (Dict[str, float]): The seconds spent in each phase of the
+            debate. (default: :obj:`{}`)
+        created_at (float): When the debate was archived, as a Unix time.
+            (default: the current time)
+        id (Optional[int]): The id of the debate in the archive, set when it
+            is added. (default: :obj:`None`)
+    """
+    topic: Topic
+    model: str
+    messages: List[MessageType]
+    judgement: str = ""
+    usage: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    id: Optional[int] = None
+
+    @classmethod
+    def from_simulator(cls, simulator: Any) -> "ArchivedDebate":
+        r"""Returns the transcript of a
+        :class:`wada.debate_simulator.DebateSimulator`."""
+        host = simulator.host
+        return cls(topic=simulator.topic, model=simulator.model_type.value,
+                   messages=list(simulator.history),
+                   judgement=host.judgement if host is not None else "",
+                   usage=simulator.get_usage(),
+                   timings=dict(simulator.timings))
+
+    @property
+    def date(self) -> str:
+        return datetime.fromtimestamp(self.created_at,
+                                      timezone.utc).strftime("%Y-%m-%d")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(id=self.id, created_at=self.created_at, date=self.date,
+                    model=self.model, topic=self.topic.to_dict(),
+                    messages=[message.to_dict() for message in self.messages],
+                    judgement=self.judgement, usage=self.usage,
+                    timings=self.timings)
+
+    def to_template_data(self) -> Dict[str, Any]:
+        r"""Returns the fields of :obj:`app/template.md`. The contents of the
+        messages are quoted for markdown in copies, so the transcript is
+        left as it is."""
+        debate_history = [
+            dict(role_name=message.role_name,
+                 content=message.content.replace("\n", "\n\n> "))
+            for message in self.messages
+        ]
+        return dict(model=self.model, topic=self.topic.content,
+                    topic_pro=self.topic.pro, topic_con=self.topic.con,
+                    topic_abbr=self.topic.abbr or self.topic.content,
+                    catagory=self.topic.catagory.value,
+                    specified_aspects=self.topic.specified_aspects,
+                    background=self.topic.background,
+                    preference=self.topic.preference,
+                    debate_history=debate_history, judgement=self.judgement)
+
+
+class TranscriptArchive:
+    r"""An append-only archive of debate transcripts in a SQLite database,
+    indexed by category, model and date, so that transcripts can be
+    selected and exported in bulk without parsing a file per debate. The
+    connection is shared by the threads of the process.
+
+    Args:
+        path (str): The path of the database, created if needed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            # Readers are not blocked by a writer in WAL mode.
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def add(self, debate: ArchivedDebate) -> int:
+        r"""Appends a debate to the archive.
+
+        Args:
+            debate (ArchivedDebate): The debate, whose :obj:`id` is set.
+
+        Returns:
+            int: The id of the debate.
+        """
+        topic = debate.topic
+        values = dict(created_at=debate.created_at, date=debate.date,
+                      category=topic.catagory.value, model=debate.model,
+                      topic=topic.content, judgement=debate.judgement,
+                      num_messages=len(debate.messages),
+                      timings=json.dumps(debate.timings))
+        values.update(
+            (column, getattr(topic, column)) for column in TOPIC_COLUMNS)
+        values.update(
+            (column, debate.usage.get(column, 0)) for column in USAGE_COLUMNS)
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"INSERT INTO debates ({', '.join(values)}) "
+                f"VALUES ({', '.join('?' * len(values))})",
+                list(values.values()))
+            debate.id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?)",
+                [(debate.id, position, json.dumps(message.to_dict()))
+                 for position, message in enumerate(debate.messages)])
+        return debate.id
+
+    def get_filter(
+        self,
+        category: Optional[TopicType] = None,
+        model: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> Tuple[str, List[Any]]:
+        filters = [
+            ("category = ?", category.value if category else None),
+            ("model = ?", model),
+            ("date >= ?", since),
+            ("date <= ?", until),
+        ]
+        conditions = [condition for condition, value in filters if value]
+        params = [value for _, value in filters if value]
+        if len(conditions) == 0:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+    def load(self, row: sqlite3.Row) -> ArchivedDebate:
+        with self.lock:
+            messages = self.connection.execute(
+                "SELECT message FROM messages WHERE debate_id = ? "
+                "ORDER BY position", (row["id"], )).fetchall()
+        topic = Topic(content=row["topic"],
+                      catagory=TopicType(row["category"]),
+                      **{column: row[column]
+                         for column in TOPIC_COLUMNS})
+        return ArchivedDebate(
+            topic=topic, model=row["model"], messages=[
+                message_from_dict(json.loads(message["message"]))
+                for message in messages
+            ], judgement=row["judgement"],
+            usage={column: row[column]
+                   for column in USAGE_COLUMNS},
+            timings=json.loads(row["timings"]), created_at=row["created_at"],
+            id=row["id"])
+
+    def get(self, debate_id: int) -> ArchivedDebate:
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM debates WHERE id = ?",
+                                          (debate_id, )).fetchone()
+        if row is None:
+            raise KeyError(f"No debate {debate_id} in {self.path}")
+        return self.load(row)
+
+    def find(
+        self,
+        category: Optional[TopicType] = None,
+        model: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> Iterator[ArchivedDebate]:
+        r"""Yields the debates matching all the given filters, oldest
+        first.
+
+        Args:
+            category (Optional[TopicType]): The category of the topic.
+                (default: :obj:`None`)
+            model (Optional[str]): The model. (default: :obj:`None`)
+            since (Optional[str]): The first date, as :obj:`"YYYY-MM-DD"`
+                in UTC. (default: :obj:`None`)
+            until (Optional[str]): The last date, included.
+                (default: :obj:`None`)
+
+        Yields:
+            ArchivedDebate: The debates.
+        """
+        where, params = self.get_filter(category, model, since, until)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT * FROM debates{where} ORDER BY id",
+                params).fetchall()
+        for row in rows:
+            yield self.load(row)
+
+    def count(self, **filters: Any) -> int:
+        r"""Returns the number of debates matching the filters of
+        :meth:`find`."""
+        where, params = self.get_filter(**filters)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT COUNT(*) FROM debates{where}", params).fetchone()[0]
+
+    def export_jsonl(self, path: str, **filters: Any) -> int:
+        r"""Writes the debates matching the filters of :meth:`find` to a
+        JSON lines file, one debate per line, compressed with gzip if the
+        path ends with :obj:`".gz"`.
+
+        Args:
+            path (str): The path of the file.
+            **filters (Any): The filters of :meth:`find`.
+
+        Returns:
+            int: The number of debates written.
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        num_debates = 0
+        f: IO[str]
+        with opener(path, "wt", encoding="utf-8") as f:
+            for debate in self.find(**filters):
+                f.write(json.dumps(debate.to_dict()) + "\n")
+                num_debates += 1
+        return num_debates
+
+    def render_markdown(self, debate_id: int, template: Any) -> str:
+        r"""Renders a debate with the markdown template of the app.
+
+        Args:
+            debate_id (int): The id of the debate.
+            template (Any): The compiled :obj:`jinja2.Template`.
+
+        Returns:
+            str: The markdown.
+        """
+        return template.render(**self.get(debate_id).to_template_data())
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,369 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from wada.messages import OpenAIMessage
+
+AZURE_PARAMS = ("engine", "deployment_id", "api_type", "api_version",
+                "api_base", "api_key", "organization")
+
+
+class ChatBackend(ABC):
+    r"""The chat completion API the agents send their requests to. Backends
+    have the interface of :obj:`openai.ChatCompletion`: they take the
+    messages and the parameters of a request as keyword arguments and
+    return a response in the shape of the OpenAI API, or an iterator over
+    its chunks when :obj:`stream` is set. Both :class:`wada.agents.ChatAgent`
+    and the langchain model of :class:`wada.agents.DebaterAgent` go through
+    a backend.
+    """
+
+    @abstractmethod
+    def create(self, **kwargs: Any) -> Any:
+        pass
+
+    @abstractmethod
+    async def acreate(self, **kwargs: Any) -> Any:
+        pass
+
+
+class AzureOpenAIBackend(ChatBackend):
+    r"""Sends the requests to Azure OpenAI with the :obj:`openai` package.
+    The deployment and the endpoint are given with every request."""
+
+    def create(self, **kwargs: Any) -> Any:
+        # openai is imported on first request, it pulls in aiohttp and numpy.
+        import openai
+        return openai.ChatCompletion.create(**kwargs)
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        import openai
+        return await openai.ChatCompletion.acreate(**kwargs)
+
+
+class OpenAICompatibleBackend(ChatBackend):
+    r"""Sends the requests to a server implementing the OpenAI chat
+    completion API, e.g. a model served locally by vLLM or llama.cpp. The
+    Azure settings of the requests are replaced by the ones of the server.
+
+    Args:
+        api_base (str): The base URL of the API, e.g.
+            :obj:`"http://localhost:8000/v1"`.
+        api_key (str): The API key, which local servers usually ignore.
+            (default: :obj:`"EMPTY"`)
+        model (Optional[str]): The model served. If :obj:`None`, the
+            deployment of the request is used as the model name.
+            (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        api_base: str,
+        api_key: str = "EMPTY",
+        model: Optional[str] = None,
+    ) -> None:
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+
+    def get_params(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.model or kwargs.get("engine") or kwargs.get("model")
+        params = {
+            key: value
+            for key, value in kwargs.items() if key not in AZURE_PARAMS
+        }
+        params.update(model=model, api_base=self.api_base,
+                      api_key=self.api_key, api_type="open_ai")
+        return params
+
+    def create(self, **kwargs: Any) -> Any:
+        import openai
+        return openai.ChatCompletion.create(**self.get_params(kwargs))
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        import openai
+        return await openai.ChatCompletion.acreate(**self.get_params(kwargs))
+
+
+Reply = Union[str, Sequence[str], Callable[[List[OpenAIMessage]], str]]
+
+
+class FakeRule:
+    r"""A reply of a :class:`FakeBackend` to the requests matching patterns.
+
+    Args:
+        pattern (str): A regular expression searched in the content of the
+            last message of the request.
+        reply (Reply): The reply. A sequence of replies is given out in
+            order, repeating the last one, e.g. a few :obj:`"<<<CONTINUE>>>"`
+            followed by :obj:`"<<<END>>>"`. A callable is called with the
+            messages of the request.
+        system (Optional[str]): A regular expression that must also be found
+            in the system message. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        reply: Reply,
+        system: Optional[str] = None,
+    ) -> None:
+        self.pattern = re.compile(pattern, re.DOTALL)
+        self.system = None if system is None else re.compile(system)
+        self.reply = reply
+        self.num_matches = 0
+
+    def matches(self, messages: List[OpenAIMessage]) -> bool:
+        if self.system is not None:
+            if (messages[0]["role"] != "system"
+                    or not self.system.search(messages[0]["content"])):
+                return False
+        return bool(self.pattern.search(messages[-1]["content"]))
+
+    def get_reply(self, messages: List[OpenAIMessage]) -> str:
+        if callable(self.reply):
+            return self.reply(messages)
+        if isinstance(self.reply, str):
+            return self.reply
+        index = min(self.num_matches, len(self.reply) - 1)
+        self.num_matches += 1
+        return self.reply[index]
+
+
+class FakeBackend(ChatBackend):
+    r"""An in-process backend with scripted replies, latencies and token
+    counts, to run the agents offline in tests and benchmarks.
+
+    Tokens are counted as whitespace separated words, which is close enough
+    to the BPE counts for load tests and does not need tiktoken.
+
+    Args:
+        rules (Sequence[FakeRule]): The scripted replies. The first rule
+            matching a request is used. (default: :obj:`()`)
+        default_reply (str): The reply to requests no rule matches.
+            (default: :obj:`"OK"`)
+        latency (Union[float, Callable[[int, int], float]]): The latency in
+            seconds of a request, or a function of its prompt and completion
+            tokens returning it, e.g. to draw it from a distribution.
+            Streamed responses start after the latency.
+            (default: :obj:`0.0`)
+        completion_tokens (Optional[int]): The completion tokens reported in
+            the usage. If :obj:`None`, the words of the reply are counted.
+            (default: :obj:`None`)
+        record_requests (bool): Whether to keep the messages of every
+            request in :obj:`requests`. (default: :obj:`True`)
+    """
+
+    def __init__(
+        self,
+        rules: Sequence[FakeRule] = (),
+        default_reply: str = "OK",
+        latency: Union[float, Callable[[int, int], float]] = 0.0,
+        completion_tokens: Optional[int] = None,
+        record_requests: bool = True,
+    ) -> None:
+        self.rules = list(rules)
+        self.default_reply = default_reply
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.record_requests = record_requests
+
+        self.requests: List[Dict[str, Any]] = []
+        self.num_requests = 0
+        self.prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_debate(
+        cls,
+        num_rounds: int = 3,
+        use_tools: bool = False,
+        tool_name: str = "Wikipedia",
+        **kwargs: Any,
+    ) -> "FakeBackend":
+        r"""Returns a fake scripted for the prompts of WADA, so that topic
+        elicitation and whole debates run end to end.
+
+        Args:
+            num_rounds (int): The number of rounds after which the host ends
+                the debate. (default: :obj:`3`)
+            use_tools (bool): Whether the langchain debaters look something
+                up before every answer. (default: :obj:`False`)
+            tool_name (str): The tool the debaters use.
+                (default: :obj:`"Wikipedia"`)
+            **kwargs (Any): The other arguments of :class:`FakeBackend`.
+        """
+        argument = ("###Argument: This option fits the person better.\n"
+                    "###Explanation: It matches every preference the person "
+                    "stated, as the evidence shows.")
+        final_answer = ("Thought: Do I need to use a tool? No\n"
+                        f"Final Answer: {argument}")
+        background = "The first option costs less. The second pays more."
+        host_replies = ["<<<CONTINUE>>>"] * (num_rounds - 1)
+        host_replies.append("<<<END>>> The first option fits the person.")
+        action = ("Thought: Do I need to use a tool? Yes\n"
+                  f"Action: {tool_name}\nAction Input: the topic")
+        rules = [
+            FakeRule("break down the following topic",
+                     "PRO: The first option\nCON: The second option"),
+            FakeRule("abbreviate the topic", "First or second option?"),
+            FakeRule("aspects of information are needed",
+                     "1. Cost\n2. Time\n3. Growth\n4. Health\n5. Family"),
+            FakeRule("objective statistics", background),
+            FakeRule("subjective questions",
+                     "<QUESTION> What matters most to you?"),
+            FakeRule("Rephrase your last reply",
+                     "The person cares most about cost."),
+            FakeRule("Summarize the conversation|Progressively summarize",
+                     "They debated."),
+            FakeRule("reasoning for your judgement|help me make a decision",
+                     "The first option fits the person's preferences.",
+                     system="judge"),
+            FakeRule(".", host_replies, system="judge"),
+            FakeRule("Observation:", final_answer, system="access to the"),
+            FakeRule(".", action if use_tools else final_answer,
+                     system="access to the"),
+            FakeRule(".", argument, system="professional debater"),
+            FakeRule(".", "<SUMMARY> The person cares most about cost.",
+                     system="helpful assistant"),
+        ]
+        return cls(rules, **kwargs)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.num_requests = 0
+            self.prompt_tokens = 0
+            self.total_completion_tokens = 0
+            for rule in self.rules:
+                rule.num_matches = 0
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return len(text.split())
+
+    def get_reply(self, messages: List[OpenAIMessage]) -> str:
+        for rule in self.rules:
+            if rule.matches(messages):
+                return rule.get_reply(messages)
+        return self.default_reply
+
+    def respond(self, kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        r"""Scripts the response to a request and returns it with its
+        latency."""
+        messages = kwargs["messages"]
+        prompt_tokens = sum(
+            self.count_tokens(message["content"]) + 4 for message in messages)
+        with self.lock:
+            content = self.get_reply(messages)
+            completion_tokens = self.completion_tokens
+            if completion_tokens is None:
+                completion_tokens = self.count_tokens(content)
+            self.num_requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+            if self.record_requests:
+                self.requests.append(kwargs)
+        latency = self.latency
+        if callable(latency):
+            latency = latency(prompt_tokens, completion_tokens)
+        message = dict(role="assistant", content=content)
+        usage = dict(prompt_tokens=prompt_tokens,
+                     completion_tokens=completion_tokens,
+                     total_tokens=prompt_tokens + completion_tokens)
+        choice = dict(index=0, message=message, finish_reason="stop")
+        response = dict(id=f"chatcmpl-fake-{self.num_requests}",
+                        model=kwargs.get("engine", kwargs.get("model")),
+                        usage=usage, choices=[choice])
+        return response, latency
+
+    @staticmethod
+    def get_chunks(response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        content = response["choices"][0]["message"]["content"]
+
+        def make_chunk(delta: Dict[str, str],
+                       finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            choice = dict(index=0, delta=delta, finish_reason=finish_reason)
+            return dict(id=response["id"], choices=[choice])
+
+        yield make_chunk({"role": "assistant"})
+        for token in re.findall(r"\S+\s*|\s+", content):
+            yield make_chunk({"content": token})
+        yield make_chunk({}, "stop")
+
+    def create(self, **kwargs: Any) -> Any:
+        response, latency = self.respond(kwargs)
+        time.sleep(latency)
+        if kwargs.get("stream"):
+            return self.get_chunks(response)
+        return response
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        response, latency = self.respond(kwargs)
+        await asyncio.sleep(latency)
+        if kwargs.get("stream"):
+            return self.aget_chunks(response)
+        return response
+
+    async def aget_chunks(
+            self, response: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        for chunk in self.get_chunks(response):
+            yield chunk
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.num_requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.total_completion_tokens,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_default_backend() -> ChatBackend:
+    r"""Returns the backend selected by the :obj:`WADA_BACKEND` environment
+    variable: :obj:`"azure"` (the default) for Azure OpenAI, :obj:`"fake"`
+    for :meth:`FakeBackend.for_debate`, or the base URL of an OpenAI
+    compatible server, whose model can be set with
+    :obj:`WADA_BACKEND_MODEL`."""
+    backend = os.getenv("WADA_BACKEND", "azure")
+    if backend == "azure":
+        return AzureOpenAIBackend()
+    if backend == "fake":
+        return FakeBackend.for_debate(record_requests=False)
+    if backend.startswith(("http://", "https://")):
+        return OpenAICompatibleBackend(
+            backend, api_key=os.getenv("WADA_BACKEND_API_KEY", "EMPTY"),
+            model=os.getenv("WADA_BACKEND_MODEL"))
+    raise ValueError(f"Unknown backend: {backend}")
@@ -0,0 +1,331 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from wada.messages import OpenAIMessage
+
+SAMPLING_PARAMS = (
+    "temperature",
+    "top_p",
+    "n",
+    "stop",
+    "max_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+    "functions",
+    "function_call",
+)
+
+
+class ResponseCache:
+    r"""A disk-backed cache of chat completion responses.
+
+    Responses are stored compressed in a SQLite database and keyed by the
+    deployment, the messages and the sampling parameters of the request.
+    When the stored responses grow over :obj:`max_size`, the least recently
+    used ones are evicted. SQLite runs in WAL mode with a busy timeout, so
+    several processes can share the same file.
+
+    Args:
+        path (str): The path of the SQLite database.
+            (default: :obj:`".wada_cache/responses.sqlite"`)
+        max_size (int): The maximum total size in bytes of the stored
+            responses. (default: :obj:`256 * 1024 * 1024`)
+        timeout (float): How long in seconds to wait for another process
+            holding the database lock. (default: :obj:`30.0`)
+    """
+
+    def __init__(
+        self,
+        path: str = ".wada_cache/responses.sqlite",
+        max_size: int = 256 * 1024 * 1024,
+        timeout: float = 30.0,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # Guards the counters, which the threads of the agents share.
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                         "size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed "
+                         "ON responses (accessed)")
+
+    def connect(self) -> sqlite3.Connection:
+        r"""Returns the connection of the calling thread and process, so that
+        connections are never shared across threads or forked processes."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(deployment: str, messages: List[OpenAIMessage],
+                 **params: Any) -> str:
+        r"""Builds the cache key of a request. Only the sampling parameters
+        in :obj:`SAMPLING_PARAMS` are part of the key, so credentials and
+        endpoints never end up in the cache.
+
+        Args:
+            deployment (str): The deployment or model the request is sent to.
+            messages (List[OpenAIMessage]): The messages of the request.
+            **params (Any): The parameters of the request.
+
+        Returns:
+            str: The key of the request.
+        """
+        request = {
+            "deployment": deployment,
+            "messages": messages,
+            **{
+                key: value
+                for key, value in params.items() if key in SAMPLING_PARAMS
+            },
+        }
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        row = conn.execute("SELECT value FROM responses WHERE key = ?",
+                           (key, )).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?",
+                     (time.time(), key))
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        value = zlib.compress(json.dumps(response).encode("utf-8"))
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()))
+            total_size = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size:
+                # Keep the most recently used responses that fit.
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER "
+                    "(ORDER BY accessed DESC, key) AS total FROM responses) "
+                    "WHERE total > ?)", (self.max_size, ))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        r"""Runs :meth:`get` in the default executor, so that the event loop
+        does not wait on the database."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, key)
+
+    async def aset(self, key: str, response: Dict[str, Any]) -> None:
+        r"""Runs :meth:`set` in the default executor, so that the event loop
+        does not wait on the database."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.set, key, response)
+
+    def clear(self) -> None:
+        self.connect().execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        return self.connect().execute(
+            "SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        size = self.connect().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": len(self),
+            "size": size,
+        }
+
+
+class ToolResultCache:
+    r"""A cache of tool results keyed by the tool name and the normalized
+    query, so that debaters searching for the same thing share one fetch.
+
+    Results live in a bounded in-memory LRU tier and, optionally, in a
+    persistent :class:`ResponseCache` tier shared with other processes.
+    Both tiers expire results after :obj:`ttl` seconds. Concurrent calls
+    with the same key while a fetch is in flight wait for that fetch
+    instead of issuing their own.
+
+    Args:
+        ttl (float): How long in seconds a result stays valid.
+            (default: :obj:`86400.0`)
+        max_entries (int): The maximum number of results kept in memory.
+            (default: :obj:`1024`)
+        persistent (Optional[ResponseCache]): The persistent tier. If
+            :obj:`None`, results are only kept in memory.
+            (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        ttl: float = 86400.0,
+        max_entries: int = 1024,
+        persistent: Optional[ResponseCache] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+        self.in_flight: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(tool_name: str, query: str) -> str:
+        return f"{tool_name}:{' '.join(query.lower().split())}"
+
+    def get(self, tool_name: str, query: str) -> Optional[str]:
+        key = self.make_key(tool_name, query)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.entries.pop(key, None)
+
+        if self.persistent is not None:
+            stored = self.persistent.get(key)
+            if stored is not None and stored["expires"] > now:
+                with self.lock:
+                    self.hits += 1
+                    self.remember(key, stored["result"], stored["expires"])
+                return stored["result"]
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, tool_name: str, query: str, result: str) -> None:
+        key = self.make_key(tool_name, query)
+        expires = time.time() + self.ttl
+        with self.lock:
+            self.remember(key, result, expires)
+        if self.persistent is not None:
+            self.persistent.set(key, {"result": result, "expires": expires})
+
+    def remember(self, key: str, result: str, expires: float) -> None:
+        self.entries[key] = (result, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def run(
+        self,
+        tool_name: str,
+        query: str,
+        func: Callable[[str], str],
+    ) -> str:
+        r"""Returns the cached result of a query, or runs the tool to fetch
+        it. Only one fetch per key is in flight at any time.
+
+        Args:
+            tool_name (str): The name of the tool.
+            query (str): The query to run the tool with.
+            func (Callable[[str], str]): The tool function.
+
+        Returns:
+            str: The result of the tool.
+        """
+        result = self.get(tool_name, query)
+        if result is not None:
+            return result
+
+        key = self.make_key(tool_name, query)
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            result = func(query)
+            self.set(tool_name, query, result)
+            future.set_result(result)
+            return result
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def wrap(self, tool_name: str,
+             func: Callable[[str], str]) -> Callable[[str], str]:
+        r"""Wraps a tool function so that its calls go through the cache. The
+        wrapper deliberately does not copy the signature of :obj:`func`, so
+        langchain calls it with the query only."""
+
+        def cached_func(query: str) -> str:
+            return self.run(tool_name, query, func)
+
+        return cached_func
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "in_flight": len(self.in_flight),
+        }
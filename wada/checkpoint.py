@@ -0,0 +1,59 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointFile:
+    r"""The latest state of a debate, saved to a file after every round as
+    one JSON object. The state is written to a temporary file, synced to
+    disk and renamed over the previous one, so a crash leaves either the
+    previous state or the new one, and each round writes the debate once
+    rather than growing the file.
+
+    Args:
+        path (str): The path of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def save(self, state: Dict[str, Any]) -> None:
+        data = json.dumps({"version": CHECKPOINT_VERSION, **state})
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        r"""Returns the state in the file, or :obj:`None` if there is
+        none."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version in "
+                             f"{self.path}: {state.get('version')}")
+        return state
@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from wada.agents import ChatAgent
+from wada.checkpoint import CheckpointFile
 from wada.generators import SystemMessageGenerator
-from wada.messages import ChatMessage, UserChatMessage
+from wada.messages import ChatMessage, UserChatMessage, message_from_dict
 from wada.topic import Topic
 from wada.typing import ModelType, RoleType
 
@@ -46,6 +47,10 @@ class Debate:
             to the debater B agent. (default: :obj:`None`)
         host_kwargs (Dict, optional): Additional arguments to pass to the
             host. (default: :obj:`None`)
+        checkpoint_path (Optional[str]): The file the state of the debate
+            is saved to after every round, so that it can be resumed
+            with :meth:`resume`. If :obj:`None`, no checkpoints are
+            written. (default: :obj:`None`)
     """
 
     def __init__(
@@ -59,6 +64,7 @@ class Debate:
         debater_a_agent_kwargs: Optional[Dict] = None,
         debater_b_agent_kwargs: Optional[Dict] = None,
         host_kwargs: Optional[Dict] = None,
+        checkpoint_path: Optional[str] = None,
     ) -> None:
 
         self.debater_a_name = debater_a_name
@@ -69,6 +75,12 @@ class Debate:
         self.model_type = model_type
 
         self.topic = topic
+        self.round = 0
+        # The reply of debater B the next round answers.
+        self.last_reply: Optional[ChatMessage] = None
+        self.checkpoint_file: Optional[CheckpointFile] = None
+        if checkpoint_path is not None:
+            self.checkpoint_file = CheckpointFile(checkpoint_path)
 
         self.debater_a_agent_kwargs = debater_a_agent_kwargs
         self.debater_b_agent_kwargs = debater_b_agent_kwargs
@@ -123,6 +135,8 @@ class Debate:
                Tuple[Optional[ChatMessage], Optional[bool], Optional[Dict]]]:
         self.debater_a_agent.reset()
         self.debater_b_agent.reset()
+        self.round = 0
+        self.last_reply = None
 
         debater_a_msg = UserChatMessage(
             role_name=self.debater_a_sys_msg.role_name,
@@ -168,6 +182,107 @@ class Debate:
                                       debater_b_info)
         debater_b_reply = self.process_messages(debater_b_replies)
         self.debater_b_agent.update_messages(debater_b_reply)
+        self.round += 1
+        self.last_reply = debater_b_reply
+        self.save_checkpoint()
 
         return ((debater_a_reply, debater_a_terminated, debater_a_info),
                 (debater_b_reply, debater_b_terminated, debater_b_info))
+
+    def get_state(self) -> Dict[str, Any]:
+        r"""Returns the state of the debate as plain data: the round, the
+        last reply, the histories of the debaters and of the host and the
+        topic, see :meth:`load_state`."""
+        last_reply = self.last_reply
+        host = self.host
+        return dict(
+            round=self.round,
+            topic=self.topic.to_dict(),
+            last_reply=last_reply.to_dict() if last_reply else None,
+            debater_a=self.debater_a_agent.get_state(),
+            debater_b=self.debater_b_agent.get_state(),
+            host=host.get_state() if host is not None else None,
+        )
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        r"""Restores the state returned by :meth:`get_state`. The debate
+        goes on with :obj:`step(last_reply)`."""
+        self.round = state["round"]
+        self.last_reply = None
+        if state["last_reply"] is not None:
+            self.last_reply = message_from_dict(state["last_reply"])
+        self.debater_a_agent.set_state(state["debater_a"])
+        self.debater_b_agent.set_state(state["debater_b"])
+        if self.host is not None and state["host"] is not None:
+            self.host.set_state(state["host"])
+
+    def save_checkpoint(self) -> None:
+        r"""Saves the state of the debate to the checkpoint file, if
+        any. It is saved once the debaters reply, and again once the host
+        judges the round with :meth:`judge`."""
+        if self.checkpoint_file is not None:
+            self.checkpoint_file.save(self.get_state())
+
+    def judge(self, messages: str) -> Tuple[bool, Optional[str]]:
+        r"""Asks the host to judge the round and saves its verdict with the
+        checkpoint of the round.
+
+        Args:
+            messages (str): The replies of the round.
+
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the debate goes on, and the
+                reply of the host, or its judgement if it ends the debate.
+        """
+        if self.host is None:
+            raise ValueError("The debate has no host in the loop.")
+        verdict = self.host.step(messages)
+        self.save_checkpoint()
+        return verdict
+
+    def resume(self, checkpoint_path: Optional[str] = None) -> bool:
+        r"""Restores the debate from the round saved in a checkpoint file,
+        so that it goes on without sending the requests of the earlier
+        rounds again.
+
+        Args:
+            checkpoint_path (Optional[str]): The checkpoint file. If
+                :obj:`None`, the one the debate writes to.
+                (default: :obj:`None`)
+
+        Returns:
+            bool: Whether a checkpoint was found.
+        """
+        if checkpoint_path is not None:
+            checkpoint_file = CheckpointFile(checkpoint_path)
+        elif self.checkpoint_file is not None:
+            checkpoint_file = self.checkpoint_file
+        else:
+            raise ValueError("No checkpoint file to resume from")
+        state = checkpoint_file.load()
+        if state is None:
+            return False
+        self.load_state(state)
+        return True
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint_path: str, **kwargs: Any) -> "Debate":
+        r"""Returns the debate saved in a checkpoint file, which it goes on
+        writing to.
+
+        Args:
+            checkpoint_path (str): The checkpoint file.
+            **kwargs (Any): The other arguments of the debate, e.g. the
+                agent arguments, which are not part of the checkpoint.
+
+        Returns:
+            Debate: The debate, ready to go on with
+                :obj:`step(last_reply)`.
+        """
+        state = CheckpointFile(checkpoint_path).load()
+        if state is None:
+            raise ValueError(f"No checkpoint in {checkpoint_path}")
+        debate = cls(Topic.from_dict(state["topic"]),
+                     checkpoint_path=checkpoint_path, **kwargs)
+        debate.load_state(state)
+        return debate
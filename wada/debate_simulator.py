@@ -12,14 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, Optional, Tuple
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
 
 from colorama import Fore
 
 from wada.agents.debater_agent import DebaterAgent
+from wada.checkpoint import CheckpointFile
+from wada.events import (
+    DebateEvent,
+    DebaterReplied,
+    DebateTerminated,
+    HostVerdict,
+    RoundStarted,
+)
 from wada.generators import SystemMessageGenerator
-from wada.messages import UserChatMessage
+from wada.metrics import (
+    DEBATE_PHASE_SECONDS,
+    DEBATE_ROUNDS,
+    DEBATES,
+    DEBATES_IN_FLIGHT,
+)
 from wada.topic import Topic
+from wada.tracing import add_usage
+from wada.transcript import Transcript, TranscriptWindow
 from wada.typing import ModelType, RoleType
 
 from .agents.host_agent import HostAgent
@@ -50,6 +69,14 @@ class DebateSimulator:
             host. (default: :obj:`None`)
         verbose (bool, optional): Whether to print the debate to the console.
             (default: :obj:`False`)
+        pipelined (bool, optional): Whether the debaters start the next round
+            while the host judges the current one. The speculative round is
+            discarded, and the debaters' memories are rolled back, if the
+            host ends the debate. (default: :obj:`False`)
+        checkpoint_path (Optional[str]): The file the state of the debate
+            is saved to after every round, so that it can be resumed
+            with :meth:`resume`. If :obj:`None`, no checkpoints are
+            written. (default: :obj:`None`)
     """
 
     def __init__(
@@ -65,6 +92,8 @@ class DebateSimulator:
         debater_b_agent_kwargs: Optional[Dict] = None,
         host_kwargs: Optional[Dict] = None,
         verbose: bool = False,
+        pipelined: bool = False,
+        checkpoint_path: Optional[str] = None,
     ) -> None:
         self.topic = topic
 
@@ -78,8 +107,26 @@ class DebateSimulator:
         self.turn_limit = turn_limit
         self.round = 0
         self.terminated = False
+        self.termination_reason: Optional[str] = None
+        # The seconds spent waiting on the debaters and on the host.
+        self.timings: Dict[str, float] = {}
+        self.in_flight = False
 
-        self.history = []
+        # The messages of the debate, which the host and the UI read
+        # through windows.
+        self.history = Transcript()
+
+        self.pipelined = pipelined
+        # The worker of the speculative rounds, started by the first one
+        # and shut down once the debate is over.
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.speculative_round: Optional[Future] = None
+        # The rollback of a discarded round that was already running.
+        self.discarded_round: Optional[Future] = None
+        self.checkpoints: Tuple[Any, Any] = (None, None)
+        self.checkpoint_file: Optional[CheckpointFile] = None
+        if checkpoint_path is not None:
+            self.checkpoint_file = CheckpointFile(checkpoint_path)
 
         if with_host_in_the_loop:
             host_sys_msg = SystemMessageGenerator().from_dict(
@@ -114,54 +161,366 @@ class DebateSimulator:
             }, verbose=verbose, **(debater_b_agent_kwargs or {}))
 
     def reset(self) -> None:
+        self.stop_speculation()
+        self.shutdown_executor()
         self.debater_a_agent.reset()
         self.debater_b_agent.reset()
+        # A debate reset before it is over counts as abandoned.
+        self.record_end()
         self.round = 0
         self.terminated = False
-        self.history = [
-            UserChatMessage(
-                role_name=self.host_name,
-                role_type=RoleType.HOST,
-                content="Now give me your first argument and explanation")
-        ]
+        self.termination_reason = None
+        self.timings = {}
+        # A new transcript, since the host may still read the old one.
+        self.history = Transcript()
+        self.history.append(self.host_name, RoleType.HOST,
+                            "Now give me your first argument and explanation")
+        self.in_flight = True
+        DEBATES_IN_FLIGHT.inc()
 
-    def step(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    def record_phase(self, phase: str, seconds: float) -> None:
+        DEBATE_PHASE_SECONDS.observe(seconds, phase=phase)
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def time_phase(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, time.perf_counter() - start)
+
+    def get_usage(self) -> Dict[str, int]:
+        r"""Returns the token usage of the debaters and the host since the
+        debate started."""
+        usage: Dict[str, int] = {}
+        for agent in (self.debater_a_agent, self.debater_b_agent, self.host):
+            if agent is not None:
+                add_usage(usage, agent.usage)
+        return usage
+
+    def record_end(self) -> None:
+        r"""Counts the debate as over in the metrics, once."""
+        if not self.in_flight:
+            return
+        self.in_flight = False
+        DEBATES_IN_FLIGHT.dec()
+        DEBATES.inc(reason=self.termination_reason or "abandoned")
+        DEBATE_ROUNDS.observe(min(self.round, self.turn_limit))
+
+    def start_round(self) -> bool:
         if self.terminated:
-            return (None, None, None)
+            return False
 
         self.round += 1
 
         if self.round > self.turn_limit:
             self.terminated = True
-            return (None, None, None)
-
-        debater_a_msg = self.history[-1].content
-        debater_a_reply = self.debater_a_agent.step(input=debater_a_msg)
-        debater_b_reply = self.debater_b_agent.step(input=debater_a_reply)
+            self.termination_reason = "turn_limit"
+            return False
+        return True
 
-        self.history.append(
-            UserChatMessage(role_name=self.debater_a_name,
-                            role_type=RoleType.DEBATER,
-                            content=debater_a_reply))
-        self.history.append(
-            UserChatMessage(role_name=self.debater_b_name,
-                            role_type=RoleType.DEBATER,
-                            content=debater_b_reply))
+    def record_replies(self, debater_a_reply: str,
+                       debater_b_reply: str) -> TranscriptWindow:
+        r"""Appends the replies of the round to the transcript, and returns
+        the window of the round that the host judges."""
+        start = len(self.history)
+        self.history.append(self.debater_a_name, RoleType.DEBATER,
+                            debater_a_reply)
+        self.history.append(self.debater_b_name, RoleType.DEBATER,
+                            debater_b_reply)
 
         print(Fore.YELLOW + f"Round {self.round}\n")
-        debater_a_reply_str = f"{self.debater_a_name}:\n\n{debater_a_reply}\n"
-        debater_b_reply_str = f"{self.debater_b_name}:\n\n{debater_b_reply}\n"
-        print(Fore.GREEN + debater_a_reply_str)
-        print(Fore.BLUE + debater_b_reply_str)
+        print(Fore.GREEN + f"{self.debater_a_name}:\n\n{debater_a_reply}\n")
+        print(Fore.BLUE + f"{self.debater_b_name}:\n\n{debater_b_reply}\n")
 
         if "DEBATE_TOPIC_DONE" in debater_a_reply or "DEBATE_TOPIC_DONE" in debater_b_reply:
             self.terminated = True
+            self.termination_reason = "debater_done"
+
+        return self.history.window(start, len(self.history))
+
+    def record_verdict(self, debate_continue: bool) -> None:
+        if not debate_continue:
+            self.terminated = True
+            self.termination_reason = "host_end"
+
+    def can_speculate(self) -> bool:
+        return (self.pipelined and self.with_host_in_the_loop
+                and not self.terminated and self.round < self.turn_limit)
+
+    def save_checkpoints(self) -> None:
+        self.checkpoints = (self.debater_a_agent.checkpoint(),
+                            self.debater_b_agent.checkpoint())
+
+    def rollback(self, checkpoints: Tuple[Any, Any]) -> None:
+        self.debater_a_agent.rollback(checkpoints[0])
+        self.debater_b_agent.rollback(checkpoints[1])
+
+    def run_round(self, debater_a_msg: str) -> Tuple[str, str]:
+        debater_a_reply = self.debater_a_agent.step(input=debater_a_msg)
+        debater_b_reply = self.debater_b_agent.step(input=debater_a_reply)
+        return debater_a_reply, debater_b_reply
+
+    def speculate(self, debater_a_msg: str) -> None:
+        r"""Starts the next round of the debaters in the background, while
+        the host judges the current one."""
+        self.save_checkpoints()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.speculative_round = self.executor.submit(self.run_round,
+                                                      debater_a_msg)
+
+    def discard_speculation(self) -> None:
+        r"""Drops the speculative round, if any. A round that is already
+        running cannot be interrupted, so the debaters' memories are rolled
+        back by the executor once it is done."""
+        speculative_round = self.speculative_round
+        if speculative_round is None:
+            return
+        self.speculative_round = None
+        if not speculative_round.cancel():
+            self.discarded_round = self.executor.submit(
+                self.rollback, self.checkpoints)
+
+    def stop_speculation(self) -> None:
+        r"""Drops the speculative round, if any, and waits until the
+        debaters' memories are rolled back."""
+        self.discard_speculation()
+        if self.discarded_round is not None:
+            wait([self.discarded_round])
+            self.discarded_round = None
+
+    def shutdown_executor(self) -> None:
+        r"""Lets the worker of the speculative rounds exit once the rollback
+        of a discarded round, if any, is done."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def get_state(
+        self,
+        checkpoints: Optional[Tuple[Any, Any]] = None,
+    ) -> Dict[str, Any]:
+        r"""Returns the state of the debate as plain data: the round, the
+        history, the memories of the debaters, the messages of the host and
+        the topic.
+
+        Args:
+            checkpoints (Optional[Tuple[Any, Any]]): Checkpoints of the
+                debaters' memories to serialize instead of the current
+                ones, e.g. while a speculative round changes them.
+                (default: :obj:`None`)
+
+        Returns:
+            Dict[str, Any]: The state, see :meth:`load_state`.
+        """
+        checkpoints = checkpoints or (None, None)
+        return {
+            "round": self.round,
+            "timings": dict(self.timings),
+            "terminated": self.terminated,
+            "termination_reason": self.termination_reason,
+            "topic": self.topic.to_dict(),
+            "history": self.history.to_dicts(),
+            "debater_a": self.debater_a_agent.get_state(checkpoints[0]),
+            "debater_b": self.debater_b_agent.get_state(checkpoints[1]),
+            "host": self.host.get_state() if self.host is not None else None,
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        r"""Restores the state returned by :meth:`get_state`. The next
+        :meth:`step` or :meth:`arun` goes on with the following round."""
+        self.stop_speculation()
+        self.round = state["round"]
+        self.timings = dict(state["timings"])
+        self.terminated = state["terminated"]
+        self.termination_reason = state["termination_reason"]
+        self.history = Transcript.from_dicts(state["history"])
+        self.debater_a_agent.set_state(state["debater_a"])
+        self.debater_b_agent.set_state(state["debater_b"])
+        if self.host is not None and state["host"] is not None:
+            self.host.set_state(state["host"])
+        in_flight = not self.terminated
+        DEBATES_IN_FLIGHT.inc(int(in_flight) - int(self.in_flight))
+        self.in_flight = in_flight
+
+    def save_checkpoint(self, speculating: bool = False) -> None:
+        r"""Saves the state of the debate to the checkpoint file, if
+        any, see :meth:`get_state`.
+
+        Args:
+            speculating (bool): Whether a speculative round is running, in
+                which case the debaters' memories are taken from the
+                checkpoints saved before it started. (default: :obj:`False`)
+        """
+        if self.checkpoint_file is None:
+            return
+        checkpoints = self.checkpoints if speculating else None
+        self.checkpoint_file.save(self.get_state(checkpoints))
+
+    def resume(self, checkpoint_path: Optional[str] = None) -> bool:
+        r"""Restores the debate from the round saved in a checkpoint file,
+        so that it goes on without sending the requests of the earlier
+        rounds again.
+
+        Args:
+            checkpoint_path (Optional[str]): The checkpoint file. If
+                :obj:`None`, the one the debate writes to.
+                (default: :obj:`None`)
+
+        Returns:
+            bool: Whether a checkpoint was found.
+        """
+        if checkpoint_path is not None:
+            checkpoint_file = CheckpointFile(checkpoint_path)
+        elif self.checkpoint_file is not None:
+            checkpoint_file = self.checkpoint_file
+        else:
+            raise ValueError("No checkpoint file to resume from")
+        state = checkpoint_file.load()
+        if state is None:
+            return False
+        self.load_state(state)
+        return True
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint_path: str,
+                        **kwargs: Any) -> "DebateSimulator":
+        r"""Returns the debate saved in a checkpoint file, which it goes
+        on writing to.
+
+        Args:
+            checkpoint_path (str): The checkpoint file.
+            **kwargs (Any): The other arguments of the simulator, e.g. the
+                agent arguments, which are not part of the checkpoint.
+
+        Returns:
+            DebateSimulator: The debate, ready to go on with the round
+                after the last saved one.
+        """
+        state = CheckpointFile(checkpoint_path).load()
+        if state is None:
+            raise ValueError(f"No checkpoint in {checkpoint_path}")
+        simulator = cls(Topic.from_dict(state["topic"]),
+                        checkpoint_path=checkpoint_path, **kwargs)
+        simulator.load_state(state)
+        return simulator
+
+    def step(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        if not self.start_round():
+            self.shutdown_executor()
+            self.record_end()
+            return (None, None, None)
+
+        with self.time_phase("debaters"):
+            if self.speculative_round is not None:
+                debater_a_reply, debater_b_reply = (
+                    self.speculative_round.result())
+                self.speculative_round = None
+            else:
+                debater_a_reply, debater_b_reply = self.run_round(
+                    self.history[-1].content)
+
+        round_window = self.record_replies(debater_a_reply, debater_b_reply)
 
         if self.with_host_in_the_loop:
-            debate_continue, judge_result = self.host.step(
-                debater_a_reply_str + debater_b_reply_str)
-            if not debate_continue:
-                self.terminated = True
+            if self.can_speculate():
+                self.speculate(debater_b_reply)
+            speculating = self.speculative_round is not None
+            debate_continue = False
+            try:
+                with self.time_phase("host"):
+                    debate_continue, judge_result = self.host.step(
+                        round_window)
+                self.record_verdict(debate_continue)
+            finally:
+                if not debate_continue:
+                    self.discard_speculation()
+            self.save_checkpoint(speculating=speculating)
         else:
             judge_result = None
+            self.save_checkpoint()
+        if self.terminated:
+            self.shutdown_executor()
+            self.record_end()
         return (debater_a_reply, debater_b_reply, judge_result)
+
+    async def arun_round(self, debater_a_msg: str) -> Tuple[str, str]:
+        debater_a_reply = await self.debater_a_agent.astep(input=debater_a_msg)
+        debater_b_reply = await self.debater_b_agent.astep(
+            input=debater_a_reply)
+        return debater_a_reply, debater_b_reply
+
+    async def arun(self) -> AsyncIterator[DebateEvent]:
+        r"""Runs the debate until it terminates, yielding a
+        :class:`wada.events.DebateEvent` as soon as each round starts, each
+        debater replies and the host gives its verdict. The debaters and the
+        host are awaited, so many debates can share one event loop. In
+        :obj:`pipelined` mode, the next round runs as a task while the host
+        judges the current one, and its events are yielded once the host
+        lets the debate go on.
+
+        Yields:
+            DebateEvent: The progress of the debate, ending with a
+                :class:`wada.events.DebateTerminated` event.
+        """
+        if len(self.history) == 0:
+            self.reset()
+
+        speculative_round: Optional[asyncio.Task] = None
+        try:
+            while self.start_round():
+                yield RoundStarted(self.round)
+
+                # The time the consumer takes with the events is not part
+                # of the phase.
+                start = time.perf_counter()
+                if speculative_round is not None:
+                    debater_a_reply, debater_b_reply = await speculative_round
+                    speculative_round = None
+                    waited = time.perf_counter() - start
+                    yield DebaterReplied(self.round, self.debater_a_name,
+                                         debater_a_reply)
+                else:
+                    debater_a_reply = await self.debater_a_agent.astep(
+                        input=self.history[-1].content)
+                    waited = time.perf_counter() - start
+                    yield DebaterReplied(self.round, self.debater_a_name,
+                                         debater_a_reply)
+                    start = time.perf_counter()
+                    debater_b_reply = await self.debater_b_agent.astep(
+                        input=debater_a_reply)
+                    waited += time.perf_counter() - start
+                self.record_phase("debaters", waited)
+                yield DebaterReplied(self.round, self.debater_b_name,
+                                     debater_b_reply)
+
+                round_window = self.record_replies(debater_a_reply,
+                                                   debater_b_reply)
+
+                if self.with_host_in_the_loop:
+                    if self.can_speculate():
+                        self.save_checkpoints()
+                        speculative_round = asyncio.ensure_future(
+                            self.arun_round(debater_b_reply))
+                    with self.time_phase("host"):
+                        debate_continue, judge_result = await self.host.astep(
+                            round_window)
+                    self.record_verdict(debate_continue)
+                    self.save_checkpoint(
+                        speculating=speculative_round is not None)
+                    yield HostVerdict(self.round, debate_continue,
+                                      judge_result)
+                else:
+                    self.save_checkpoint()
+        finally:
+            if speculative_round is not None:
+                speculative_round.cancel()
+                await asyncio.gather(speculative_round, return_exceptions=True)
+                self.rollback(self.checkpoints)
+
+        self.record_end()
+        judgement = self.host.judgement if self.host is not None else None
+        yield DebateTerminated(min(self.round, self.turn_limit),
+                               self.termination_reason, judgement or None)
@@ -0,0 +1,375 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from wada.retry import classify_error, get_retry_after
+from wada.typing import ErrorKind, ModelType, RoutingStrategy
+
+
+class Endpoint:
+    r"""An Azure OpenAI resource the chat requests can be sent to.
+
+    Args:
+        name (Optional[str]): The name of the endpoint, e.g. its region. The
+            rate limiters of its deployments are keyed by
+            :obj:`"<name>/<deployment>"`. If :obj:`None`, they are keyed by
+            the deployment only. (default: :obj:`None`)
+        api_base (Optional[str]): The base URL of the resource.
+            (default: :obj:`None`)
+        api_key (Optional[str]): The API key of the resource.
+            (default: :obj:`None`)
+        api_version (Optional[str]): The API version.
+            (default: :obj:`None`)
+        deployments (Optional[Dict[str, str]]): The names of the deployments
+            of the resource by model, for resources where they differ from
+            the model names. (default: :obj:`None`)
+        weight (float): The share of the requests sent to the endpoint with
+            weighted routing. (default: :obj:`1.0`)
+    """
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        api_base: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_version: Optional[str] = None,
+        deployments: Optional[Dict[str, str]] = None,
+        weight: float = 1.0,
+    ) -> None:
+        self.name = name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.api_version = api_version
+        self.deployments = deployments or {}
+        self.weight = weight
+
+        self.outstanding = 0
+        self.num_failures = 0
+        self.unavailable_until = 0.0
+
+    @classmethod
+    def from_env(cls) -> "Endpoint":
+        r"""Returns the endpoint set by the :obj:`OPENAI_API_BASE`,
+        :obj:`OPENAI_API_KEY` and :obj:`OPENAI_API_VERSION` environment
+        variables."""
+        return cls(api_base=os.getenv("OPENAI_API_BASE"),
+                   api_key=os.getenv("OPENAI_API_KEY"),
+                   api_version=os.getenv("OPENAI_API_VERSION"))
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "Endpoint":
+        r"""Builds an endpoint from its configuration. The API key can be
+        given as the name of an environment variable with
+        :obj:`"api_key_env"`, so that it does not have to be written into
+        the configuration file."""
+        config = dict(config)
+        api_key_env = config.pop("api_key_env", None)
+        if api_key_env is not None and config.get("api_key") is None:
+            config["api_key"] = os.getenv(api_key_env)
+        return cls(**config)
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+    def get_deployment(self, model: str) -> str:
+        return self.deployments.get(model, model)
+
+    def get_key(self, model: str) -> str:
+        deployment = self.get_deployment(model)
+        return deployment if self.name is None else f"{self.name}/{deployment}"
+
+    def get_config(self) -> Dict[str, Optional[str]]:
+        r"""Returns the settings passed with every request to the endpoint,
+        in the keyword arguments of :obj:`openai.ChatCompletion.create`."""
+        return {
+            "api_type": "azure",
+            "api_version": self.api_version,
+            "api_key": self.api_key,
+            "api_base": self.api_base,
+        }
+
+    def get_params(self, model: str) -> Dict[str, Optional[str]]:
+        return {"engine": self.get_deployment(model), **self.get_config()}
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name!r}, {self.api_base!r})"
+
+
+class EndpointPool:
+    r"""Spreads the chat requests over several endpoints, e.g. the same
+    models deployed in several regions, so that their quotas add up.
+
+    An endpoint that fails :obj:`max_failures` times in a row with server
+    errors or timeouts is taken out of the rotation for :obj:`cooldown`
+    seconds, and a throttled one for its :obj:`Retry-After`. Requests that
+    are retried fail over to the endpoints they have not tried yet. The
+    health checks started by :meth:`start_health_checks` bring endpoints
+    back as soon as they answer again. If every endpoint is out of the
+    rotation, the one that comes back first is used.
+
+    Args:
+        endpoints (Sequence[Endpoint]): The endpoints.
+        strategy (RoutingStrategy): How an endpoint is picked for a request.
+            :obj:`LEAST_OUTSTANDING` picks the one with the fewest requests
+            in flight for its weight and :obj:`WEIGHTED` picks one at random
+            by weight. (default: :obj:`RoutingStrategy.LEAST_OUTSTANDING`)
+        max_failures (int): The number of failures in a row that takes an
+            endpoint out of the rotation. (default: :obj:`3`)
+        cooldown (float): How long in seconds a failing endpoint stays out
+            of the rotation. (default: :obj:`30.0`)
+    """
+
+    def __init__(
+        self,
+        endpoints: Sequence[Endpoint],
+        strategy: RoutingStrategy = RoutingStrategy.LEAST_OUTSTANDING,
+        max_failures: int = 3,
+        cooldown: float = 30.0,
+    ) -> None:
+        if len(endpoints) == 0:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.health_check_stop: Optional[threading.Event] = None
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "EndpointPool":
+        r"""Builds a pool from its configuration, e.g.::
+
+            {"strategy": "weighted",
+             "endpoints": [
+                 {"name": "eastus", "api_base": "https://...",
+                  "api_key_env": "EASTUS_API_KEY", "weight": 2},
+                 {"name": "westus", "api_base": "https://...",
+                  "api_key_env": "WESTUS_API_KEY",
+                  "deployments": {"gpt-4": "gpt-4-west"}}]}
+
+        Settings missing from an endpoint are taken from the
+        :obj:`OPENAI_API_*` environment variables.
+        """
+        default = Endpoint.from_env()
+        endpoints = []
+        for endpoint_config in config["endpoints"]:
+            endpoint = Endpoint.from_dict(endpoint_config)
+            endpoint.api_base = endpoint.api_base or default.api_base
+            endpoint.api_key = endpoint.api_key or default.api_key
+            endpoint.api_version = endpoint.api_version or default.api_version
+            endpoints.append(endpoint)
+        options = {
+            key: config[key]
+            for key in ("max_failures", "cooldown") if key in config
+        }
+        strategy = RoutingStrategy(
+            config.get("strategy", RoutingStrategy.LEAST_OUTSTANDING.value))
+        return cls(endpoints, strategy=strategy, **options)
+
+    @classmethod
+    def from_file(cls, path: str) -> "EndpointPool":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_env(cls) -> Optional["EndpointPool"]:
+        r"""Returns the pool configured by the :obj:`WADA_ENDPOINTS_FILE`
+        environment variable, the path of a JSON file, or by
+        :obj:`WADA_ENDPOINTS`, the JSON itself. Returns :obj:`None` if
+        neither is set."""
+        path = os.getenv("WADA_ENDPOINTS_FILE")
+        if path:
+            return cls.from_file(path)
+        config = os.getenv("WADA_ENDPOINTS")
+        if config:
+            return cls.from_dict(json.loads(config))
+        return None
+
+    def select(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        r"""Picks the endpoint of the next request.
+
+        Args:
+            exclude (Sequence[Endpoint]): Endpoints not to pick unless no
+                other endpoint is in the rotation, e.g. the ones a retried
+                request already failed on. (default: :obj:`()`)
+
+        Returns:
+            Endpoint: The endpoint.
+        """
+        candidates = [
+            endpoint for endpoint in self.endpoints
+            if endpoint.available and endpoint not in exclude
+        ]
+        if len(candidates) == 0:
+            candidates = [
+                endpoint for endpoint in self.endpoints if endpoint.available
+            ]
+        if len(candidates) == 0:
+            return min(self.endpoints,
+                       key=lambda endpoint: endpoint.unavailable_until)
+        if self.strategy == RoutingStrategy.WEIGHTED:
+            weights = [endpoint.weight for endpoint in candidates]
+            return random.choices(candidates, weights=weights)[0]
+        return min(candidates,
+                   key=lambda endpoint: endpoint.outstanding / endpoint.weight)
+
+    def acquire(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        with self.lock:
+            endpoint = self.select(exclude)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(
+        self,
+        endpoint: Endpoint,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        r"""Records the outcome of a request to an endpoint.
+
+        Args:
+            endpoint (Endpoint): The endpoint the request was sent to.
+            error (Optional[BaseException]): The error the request failed
+                with, or :obj:`None` if it succeeded. (default: :obj:`None`)
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                self.mark_healthy(endpoint)
+                return
+            kind = classify_error(error)
+            if kind == ErrorKind.THROTTLED:
+                retry_after = get_retry_after(error)
+                self.mark_unavailable(
+                    endpoint,
+                    self.cooldown if retry_after is None else retry_after)
+            elif kind in (ErrorKind.SERVER_ERROR, ErrorKind.TIMEOUT):
+                endpoint.num_failures += 1
+                if endpoint.num_failures >= self.max_failures:
+                    self.mark_unavailable(endpoint, self.cooldown)
+
+    @contextmanager
+    def use(self, exclude: Sequence[Endpoint] = ()) -> Iterator[Endpoint]:
+        r"""Picks an endpoint and records the outcome of the request sent to
+        it in the block."""
+        endpoint = self.acquire(exclude)
+        try:
+            yield endpoint
+        except BaseException as ex:
+            self.release(endpoint, ex)
+            raise
+        self.release(endpoint)
+
+    @staticmethod
+    def mark_healthy(endpoint: Endpoint) -> None:
+        endpoint.num_failures = 0
+        endpoint.unavailable_until = 0.0
+
+    @staticmethod
+    def mark_unavailable(endpoint: Endpoint, seconds: float) -> None:
+        endpoint.unavailable_until = max(endpoint.unavailable_until,
+                                         time.monotonic() + seconds)
+
+    @staticmethod
+    def probe(endpoint: Endpoint) -> None:
+        r"""Sends the smallest possible chat request to the first deployment
+        of an endpoint, or to :obj:`ModelType.GPT_4`."""
+        import openai
+
+        model = next(iter(endpoint.deployments), ModelType.GPT_4.value)
+        message = dict(role="user", content="ping")
+        openai.ChatCompletion.create(messages=[message], max_tokens=1,
+                                     request_timeout=10,
+                                     **endpoint.get_params(model))
+
+    def check_health(
+        self,
+        probe: Optional[Callable[[Endpoint], None]] = None,
+    ) -> Dict[Endpoint, bool]:
+        r"""Probes the endpoints out of the rotation and brings back the ones
+        that answer.
+
+        Args:
+            probe (Optional[Callable[[Endpoint], None]]): Sends a request to
+                an endpoint, raising if it fails. If :obj:`None`,
+                :meth:`probe` is used. (default: :obj:`None`)
+
+        Returns:
+            Dict[Endpoint, bool]: Whether each probed endpoint answered.
+        """
+        probe = probe or self.probe
+        results = {}
+        for endpoint in self.endpoints:
+            if endpoint.available:
+                continue
+            try:
+                probe(endpoint)
+            except Exception:
+                results[endpoint] = False
+                continue
+            with self.lock:
+                self.mark_healthy(endpoint)
+            results[endpoint] = True
+        return results
+
+    def start_health_checks(
+        self,
+        interval: float = 10.0,
+        probe: Optional[Callable[[Endpoint], None]] = None,
+    ) -> None:
+        r"""Runs :meth:`check_health` every :obj:`interval` seconds in a
+        daemon thread until :meth:`stop_health_checks` is called."""
+        if self.health_check_stop is not None:
+            return
+        stop = threading.Event()
+        self.health_check_stop = stop
+
+        def run() -> None:
+            while not stop.wait(interval):
+                self.check_health(probe)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop_health_checks(self) -> None:
+        if self.health_check_stop is not None:
+            self.health_check_stop.set()
+            self.health_check_stop = None
+
+    @property
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{
+            "name": endpoint.name,
+            "outstanding": endpoint.outstanding,
+            "failures": endpoint.num_failures,
+            "available": endpoint.available,
+        } for endpoint in self.endpoints]
+
+
+@lru_cache(maxsize=None)
+def get_default_endpoint_pool() -> Optional[EndpointPool]:
+    r"""Returns the pool configured in the environment, see
+    :meth:`EndpointPool.from_env`, created once per process with its health
+    checks running."""
+    pool = EndpointPool.from_env()
+    if pool is not None:
+        pool.start_health_checks()
+    return pool
@@ -0,0 +1,71 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class DebateEvent:
+    r"""Base class for the events yielded by
+    :meth:`wada.debate_simulator.DebateSimulator.arun`.
+
+    Args:
+        round (int): The round the event belongs to.
+    """
+    round: int
+
+
+@dataclass
+class RoundStarted(DebateEvent):
+    r"""A new round of the debate has started."""
+
+
+@dataclass
+class DebaterReplied(DebateEvent):
+    r"""A debater has replied in the current round.
+
+    Args:
+        role_name (str): The name of the debater.
+        content (str): The reply of the debater.
+    """
+    role_name: str
+    content: str
+
+
+@dataclass
+class HostVerdict(DebateEvent):
+    r"""The host has judged the current round.
+
+    Args:
+        debate_continue (bool): Whether the host wants the debate to go on.
+        content (str): The reply of the host, or the final judgement if
+            :obj:`debate_continue` is :obj:`False`.
+    """
+    debate_continue: bool
+    content: str
+
+
+@dataclass
+class DebateTerminated(DebateEvent):
+    r"""The debate is over.
+
+    Args:
+        reason (str): Why the debate ended, one of :obj:`"turn_limit"`,
+            :obj:`"debater_done"` or :obj:`"host_end"`.
+        judgement (Optional[str]): The final judgement of the host, if any.
+            (default: :obj:`None`)
+    """
+    reason: str
+    judgement: Optional[str] = None
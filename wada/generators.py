@@ -87,6 +87,10 @@ class DebatePromptGenerator:
     def get_judge_prompt(self, aspects: str) -> str:
         return self.prompt_dict['host_judge'].format(**dict(aspect=aspects))
 
+    def get_history_summarize_prompt(self, history: str) -> str:
+        return self.prompt_dict['history_summarize'].format(
+            **dict(history=history))
+
 
 class DebatePromptTemplateGenerator:
     r"""Debate prompt template generator for agents."""
@@ -0,0 +1,249 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future
+from concurrent.futures import wait as wait_futures
+from functools import partial
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    r"""The latencies of the most recent requests to a deployment.
+
+    Args:
+        size (int): The number of latencies kept. (default: :obj:`200`)
+    """
+
+    def __init__(self, size: int = 200) -> None:
+        self.latencies: Deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.latencies)
+
+    def add(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def quantile(self, q: float) -> float:
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(q * len(latencies)))
+        return latencies[index]
+
+
+class HedgePolicy:
+    r"""Sends a duplicate of a request that takes longer than most, and
+    takes whichever answers first. The duplicate goes through the endpoint
+    pool of the agent, which routes it to another endpoint than the
+    original, so a slow deployment does not hold up the debate.
+
+    The delay before the duplicate is sent is the :obj:`quantile` of the
+    latencies observed for the deployment, so that only the slowest
+    requests are hedged. At most :obj:`max_hedge_rate` of the requests are
+    hedged, which bounds the extra cost.
+
+    Args:
+        quantile (float): The latency quantile after which a request is
+            hedged. (default: :obj:`0.9`)
+        max_hedge_rate (float): The maximum share of requests hedged.
+            (default: :obj:`0.1`)
+        initial_delay (float): The delay in seconds used until
+            :obj:`min_samples` latencies have been observed.
+            (default: :obj:`10.0`)
+        min_delay (float): The minimum delay in seconds.
+            (default: :obj:`0.5`)
+        min_samples (int): The number of latencies needed to use their
+            quantile. (default: :obj:`20`)
+        window (int): The number of latencies the quantile is taken over.
+            (default: :obj:`200`)
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.9,
+        max_hedge_rate: float = 0.1,
+        initial_delay: float = 10.0,
+        min_delay: float = 0.5,
+        min_samples: int = 20,
+        window: int = 200,
+    ) -> None:
+        self.quantile = quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.num_requests = 0
+        self.num_hedged = 0
+        self.num_hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def get_delay(self, deployment: str) -> float:
+        r"""Returns how long in seconds to wait for a request to a deployment
+        before hedging it."""
+        with self.lock:
+            latencies = self.latencies.get(deployment)
+            if latencies is None or len(latencies) < self.min_samples:
+                return self.initial_delay
+            return max(self.min_delay, latencies.quantile(self.quantile))
+
+    def record_latency(self, deployment: str, latency: float) -> None:
+        with self.lock:
+            latencies = self.latencies.get(deployment)
+            if latencies is None:
+                latencies = LatencyWindow(self.window)
+                self.latencies[deployment] = latencies
+            latencies.add(latency)
+
+    def start_request(self) -> None:
+        with self.lock:
+            self.num_requests += 1
+
+    def can_hedge(self) -> bool:
+        with self.lock:
+            return (self.num_hedged + 1 <=
+                    self.max_hedge_rate * self.num_requests)
+
+    def try_hedge(self) -> bool:
+        r"""Counts a hedge if the hedge rate allows one."""
+        with self.lock:
+            if self.num_hedged + 1 > self.max_hedge_rate * self.num_requests:
+                return False
+            self.num_hedged += 1
+            return True
+
+    def timed(self, deployment: str, func: Callable[[], T]) -> Callable[[], T]:
+
+        def timed_func() -> T:
+            start = time.monotonic()
+            result = func()
+            self.record_latency(deployment, time.monotonic() - start)
+            return result
+
+        # The request runs in the context of the caller, e.g. its trace span.
+        return partial(contextvars.copy_context().run, timed_func)
+
+    @staticmethod
+    def start_thread(func: Callable[[], T]) -> "Future[T]":
+        r"""Runs :obj:`func` on a thread of its own, so that a request is
+        neither capped by nor queued behind the others."""
+        future: "Future[T]" = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func())
+            except BaseException as ex:
+                future.set_exception(ex)
+
+        threading.Thread(target=run, name="wada-hedge", daemon=True).start()
+        return future
+
+    def call(self, deployment: str, func: Callable[[], T]) -> T:
+        r"""Calls :obj:`func`, and calls it again in parallel if it does not
+        return within the delay of the deployment.
+
+        A request that cannot be hedged under :obj:`max_hedge_rate` runs on
+        the calling thread. Otherwise the request and its duplicate each run
+        on a thread of their own. The blocking openai client cannot abort a
+        request, so the request that loses is left to finish in the
+        background and its response is dropped.
+
+        Args:
+            deployment (str): The deployment the request is sent to.
+            func (Callable[[], T]): The request.
+
+        Returns:
+            T: The result of the request that answers first.
+        """
+        self.start_request()
+        if not self.can_hedge():
+            return self.timed(deployment, func)()
+        futures = {self.start_thread(self.timed(deployment, func))}
+        hedge: Optional[Future] = None
+        done, _ = wait_futures(futures, timeout=self.get_delay(deployment))
+        if not done and self.try_hedge():
+            hedge = self.start_thread(self.timed(deployment, func))
+            futures.add(hedge)
+
+        error: Optional[BaseException] = None
+        while futures:
+            done, futures = wait_futures(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in futures:
+                        loser.cancel()
+                    self.record_winner(future is hedge)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def acall(
+        self,
+        deployment: str,
+        func: Callable[[], Awaitable[T]],
+    ) -> T:
+        r"""Asynchronous version of :meth:`call`. The request that loses is
+        cancelled."""
+
+        async def timed_func() -> T:
+            start = time.monotonic()
+            result = await func()
+            self.record_latency(deployment, time.monotonic() - start)
+            return result
+
+        self.start_request()
+        tasks = {asyncio.ensure_future(timed_func())}
+        hedge: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait(tasks,
+                                         timeout=self.get_delay(deployment))
+            if not done and self.try_hedge():
+                hedge = asyncio.ensure_future(timed_func())
+                tasks.add(hedge)
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.record_winner(task is hedge)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def record_winner(self, hedge_won: bool) -> None:
+        if hedge_won:
+            with self.lock:
+                self.num_hedge_wins += 1
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.num_requests,
+            "hedged": self.num_hedged,
+            "hedge_wins": self.num_hedge_wins,
+        }
@@ -92,3 +92,31 @@ class UserChatMessage(ChatMessage):
 
 
 MessageType = Union[BaseMessage, SystemMessage, ChatMessage, UserChatMessage]
+
+
+def message_from_dict(data: Dict) -> MessageType:
+    r"""Returns the message serialized by :meth:`BaseMessage.to_dict`. The
+    keys other than the fields of the message are its :obj:`meta_dict`.
+
+    Args:
+        data (Dict): The serialized message.
+
+    Returns:
+        MessageType: The message, a :class:`SystemMessage` or a
+            :class:`UserChatMessage` for these roles, otherwise a
+            :class:`ChatMessage`.
+    """
+    data = dict(data)
+    role_name = data.pop("role_name")
+    role_type = RoleType[data.pop("role_type")]
+    role = data.pop("role")
+    content = data.pop("content")
+    meta_dict = data or None
+    if role == "system":
+        return SystemMessage(role_name=role_name, role_type=role_type,
+                             meta_dict=meta_dict, content=content)
+    if role == "user":
+        return UserChatMessage(role_name=role_name, role_type=role_type,
+                               meta_dict=meta_dict, content=content)
+    return ChatMessage(role_name=role_name, role_type=role_type,
+                       meta_dict=meta_dict, role=role, content=content)
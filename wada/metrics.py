@@ -0,0 +1,484 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from wada.tracing import Span, TraceCallback, tracer
+from wada.typing import SpanKind
+
+LabelValues = Tuple[str, ...]
+
+# Latencies of LLM requests and tools run from a fraction of a second to
+# minutes with retries.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0,
+                   160.0)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"",
+                                               "\\\"").replace("\n", "\\n")
+
+
+class Metric:
+    r"""A metric with a value per combination of label values.
+
+    Args:
+        name (str): The name of the metric.
+        help (str): What the metric measures.
+        label_names (Sequence[str]): The names of the labels.
+            (default: :obj:`()`)
+    """
+
+    type_name = "untyped"
+
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            label_names: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+    def get_label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} has labels "
+                             f"{self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def format_labels(self, label_values: LabelValues,
+                      extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, label_values))
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ""
+        labels = ",".join(f'{name}="{escape_label_value(value)}"'
+                          for name, value in pairs)
+        return "{" + labels + "}"
+
+    def collect(self) -> List[str]:
+        r"""Returns the sample lines of the metric."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    r"""A value that only goes up, e.g. the number of requests."""
+
+    type_name = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self.values.get(self.get_label_values(labels), 0.0)
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [
+            f"{self.name}{self.format_labels(key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+
+class Gauge(Counter):
+    r"""A value that goes up and down, e.g. the number of debates in
+    flight. An unlabelled gauge can also be read from a function when it is
+    collected, see :meth:`set_function`."""
+
+    type_name = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        if len(self.label_names) > 0:
+            raise ValueError("Only unlabelled gauges can use a function")
+        self.function = function
+
+    @contextmanager
+    def track_in_progress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def get(self, **labels: Any) -> float:
+        if self.function is not None:
+            return self.function()
+        return super().get(**labels)
+
+    def collect(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {format_value(self.function())}"]
+        return super().collect()
+
+
+class Histogram(Metric):
+    r"""The distribution of observed values, e.g. the duration of the
+    phases of a debate, counted in cumulative buckets.
+
+    Args:
+        name (str): The name of the metric.
+        help (str): What the metric measures.
+        label_names (Sequence[str]): The names of the labels.
+            (default: :obj:`()`)
+        buckets (Sequence[float]): The upper bounds of the buckets.
+            (default: :obj:`DEFAULT_BUCKETS`)
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf, )
+        # The count of each bucket, the sum and the count of the values.
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self.get_label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts, totals = self.values.setdefault(
+                key, ([0] * len(self.buckets), [0.0, 0.0]))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        r"""Observes the duration in seconds of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels: Any) -> int:
+        values = self.values.get(self.get_label_values(labels))
+        return 0 if values is None else int(values[1][1])
+
+    def get_sum(self, **labels: Any) -> float:
+        values = self.values.get(self.get_label_values(labels))
+        return 0.0 if values is None else values[1][0]
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = sorted((key, (list(counts), list(totals)))
+                            for key, (counts, totals) in self.values.items())
+        lines = []
+        for key, (counts, (total, count)) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self.format_labels(key, ("le", format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self.format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {format_value(count)}")
+        return lines
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+
+class MetricsRegistry:
+    r"""The metrics of the process, rendered together in the Prometheus text
+    format. Metrics are created on first use and shared afterwards."""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, metric_type: type, name: str, help: str,
+                      label_names: Sequence[str], **kwargs: Any) -> Any:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_type(name, help, label_names, **kwargs)
+                self.metrics[name] = metric
+            elif (type(metric) is not metric_type
+                  or metric.label_names != tuple(label_names)):
+                raise ValueError(f"Metric {name} is already registered as "
+                                 f"a {metric.type_name} with labels "
+                                 f"{metric.label_names}")
+            return metric
+
+    def counter(self, name: str, help: str,
+                label_names: Sequence[str] = ()) -> Counter:
+        return self.get_or_create(Counter, name, help, label_names)
+
+    def gauge(self, name: str, help: str,
+              label_names: Sequence[str] = ()) -> Gauge:
+        return self.get_or_create(Gauge, name, help, label_names)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.get_or_create(Histogram, name, help, label_names,
+                                  buckets=buckets)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def reset(self) -> None:
+        r"""Clears the values of every metric, e.g. between tests."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+metrics = MetricsRegistry()
+
+
+def get_resident_memory() -> float:
+    r"""Returns the resident memory of the whole process in bytes, or its
+    peak where the current value is not available, or :obj:`0.0` where
+    neither is (e.g. on Windows)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # Unix only.
+        import resource
+    except ImportError:
+        return 0.0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+DEBATES_IN_FLIGHT = metrics.gauge("wada_debates_in_flight",
+                                  "Debates started and not yet over.")
+DEBATES = metrics.counter("wada_debates_total",
+                          "Debates over, by termination reason.", ["reason"])
+DEBATE_ROUNDS = metrics.histogram("wada_debate_rounds",
+                                  "Rounds of the debates that are over.",
+                                  buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20))
+DEBATE_PHASE_SECONDS = metrics.histogram(
+    "wada_debate_phase_seconds",
+    "Duration of the phases of a debate round: the debaters and the host.",
+    ["phase"])
+TOPIC_PHASE_SECONDS = metrics.histogram(
+    "wada_topic_phase_seconds",
+    "Duration of the phases of the topic elicitation.", ["phase"])
+TOPIC_QUESTIONS = metrics.counter(
+    "wada_topic_questions_total",
+    "Preference questions asked by the topic agent.")
+TOPICS_ELICITED = metrics.counter(
+    "wada_topics_elicited_total",
+    "Topics whose preference summary is ready for a debate.")
+HOST_VERDICTS = metrics.counter("wada_host_verdicts_total",
+                                "Verdicts of the host, by verdict.",
+                                ["verdict"])
+RATE_LIMIT_WAITING = metrics.gauge(
+    "wada_rate_limit_waiting",
+    "Requests waiting for the rate limiter of their deployment.")
+AGENT_STEP_SECONDS = metrics.histogram("wada_agent_step_seconds",
+                                       "Duration of the agent steps.",
+                                       ["role_type"])
+LLM_REQUESTS = metrics.counter("wada_llm_requests_total",
+                               "LLM requests, by model and status.",
+                               ["model", "status"])
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "wada_llm_request_seconds",
+    "Duration of the LLM requests, with their retries.", ["model"])
+LLM_TOKENS = metrics.counter("wada_llm_tokens_total",
+                             "Tokens of the LLM requests, by model and type.",
+                             ["model", "type"])
+LLM_ATTEMPTS = metrics.counter(
+    "wada_llm_attempts_total",
+    "Attempts of the LLM requests, by deployment and outcome.",
+    ["deployment", "outcome"])
+LLM_RETRIES = metrics.counter("wada_llm_retries_total",
+                              "Retried attempts of the LLM requests.",
+                              ["deployment"])
+TOOL_CALLS = metrics.counter("wada_tool_calls_total",
+                             "Tool calls of the debaters, by status.",
+                             ["tool", "status"])
+TOOL_SECONDS = metrics.histogram("wada_tool_seconds",
+                                 "Duration of the tool calls.", ["tool"])
+RESIDENT_MEMORY = metrics.gauge(
+    "wada_process_resident_memory_bytes",
+    "Resident memory of the whole process, shared by the debates in flight.")
+RESIDENT_MEMORY.set_function(get_resident_memory)
+
+
+class MetricsCallback(TraceCallback):
+    r"""Turns the spans of :mod:`wada.tracing` into the metrics of agent
+    steps, LLM requests, retries and tool calls."""
+
+    def on_span_end(self, span: Span) -> None:
+        attributes = span.attributes
+        status = "ok" if span.error is None else "error"
+        if span.kind == SpanKind.AGENT_STEP:
+            AGENT_STEP_SECONDS.observe(
+                span.duration, role_type=attributes.get("role_type", ""))
+        elif span.kind == SpanKind.LLM_REQUEST:
+            model = attributes.get("model", "")
+            if attributes.get("cached"):
+                status = "cached"
+            LLM_REQUESTS.inc(model=model, status=status)
+            LLM_REQUEST_SECONDS.observe(span.duration, model=model)
+            for key in ("prompt_tokens", "completion_tokens"):
+                if key in attributes:
+                    LLM_TOKENS.inc(attributes[key], model=model,
+                                   type=key[:-len("_tokens")])
+        elif span.kind == SpanKind.RETRY:
+            deployment = attributes.get("deployment", "")
+            outcome = attributes.get("error_kind", "ok")
+            LLM_ATTEMPTS.inc(deployment=deployment, outcome=outcome)
+            if attributes.get("attempt", 1) > 1:
+                LLM_RETRIES.inc(deployment=deployment)
+        elif span.kind == SpanKind.TOOL:
+            tool = attributes.get("tool", "")
+            TOOL_CALLS.inc(tool=tool, status=status)
+            TOOL_SECONDS.observe(span.duration, tool=tool)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    registry = metrics
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type",
+                         "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Scrapes are too frequent to log.
+        pass
+
+
+metrics_callback = MetricsCallback()
+
+
+def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+    registry: Optional[MetricsRegistry] = None,
+) -> ThreadingHTTPServer:
+    r"""Serves the metrics in the Prometheus text format on
+    :obj:`http://<host>:<port>/metrics` from a background thread, and
+    starts deriving the metrics of agent steps, LLM requests, retries and
+    tool calls from the trace spans.
+
+    Args:
+        port (int): The port to listen on, :obj:`0` for any free port.
+        host (str): The address to listen on. (default: :obj:`"127.0.0.1"`)
+        registry (Optional[MetricsRegistry]): The metrics to serve. If
+            :obj:`None`, the metrics of the process. (default: :obj:`None`)
+
+    Returns:
+        ThreadingHTTPServer: The server, whose :meth:`shutdown` stops it.
+    """
+    handler = type("Handler", (MetricsRequestHandler, ),
+                   {"registry": registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="wada-metrics",
+                              daemon=True)
+    thread.start()
+    if metrics_callback not in tracer.callbacks:
+        tracer.add_callback(metrics_callback)
+    return server
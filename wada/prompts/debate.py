@@ -91,6 +91,12 @@ class DebatePromptTemplateDict(TextPromptDict):
         """Now you can help me make a decision based on aspects of information you mentioned earlier. And give me reasoning for every aspect. Be concise in your reply."""
     )
 
+    HISTORY_SUMMARIZE_PROMPT = TextPrompt(
+        ("Summarize the conversation below in one concise paragraph. "
+         "Keep every fact, argument, question and answer that later replies "
+         "may depend on, and who said it. Reply with only the summary.\n"
+         "{history}"))
+
     LANGCHAIN_SYS_MSG_PROMPT = """You are a very professional debater and I am your opponent. You can make full use of your professional debating skills to debate with me.
     You have access to the following tools:
     {tool_names}
@@ -140,6 +146,7 @@ class DebatePromptTemplateDict(TextPromptDict):
             "host_decision": self.HOST_DECISION_PROMPT,
             "topic_break_down": self.TOPIC_BREAK_DOWN_PROMPT,
             "topic_abbreviate": self.TOPIC_ABBREVIATE_PROMPT,
+            "history_summarize": self.HISTORY_SUMMARIZE_PROMPT,
             "langchain_sys_msg": self.LANGCHAIN_SYS_MSG_PROMPT,
             "langchain_hmn_msg": self.LANGCHAIN_HMN_MSG_PROMPT,
         })
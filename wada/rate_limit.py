@@ -0,0 +1,364 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from wada.metrics import RATE_LIMIT_WAITING
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    r"""Returns whether an error means the deployment is over its quota.
+    The status is checked instead of the error type, so that the openai
+    package does not have to be imported."""
+    return (getattr(error, "http_status", None) == 429
+            or type(error).__name__ == "RateLimitError")
+
+
+class TokenBucket:
+    r"""A token bucket refilled at a constant rate. Callers reserve tokens
+    and wait for the returned delay, so the bucket can go into debt and
+    later callers queue behind earlier ones.
+
+    Args:
+        rate_per_minute (float): The number of tokens added per minute.
+        capacity (Optional[float]): The maximum number of tokens in the
+            bucket, i.e. the largest burst. If :obj:`None`, a tenth of a
+            minute's worth, which is the window Azure OpenAI enforces its
+            quota over. (default: :obj:`None`)
+        clock (Callable[[], float]): The clock the bucket is refilled by.
+            (default: :obj:`time.monotonic`)
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = (rate_per_minute /
+                         6.0 if capacity is None else capacity)
+        self.clock = clock
+        self.level = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity,
+                         self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        r"""Takes tokens from the bucket.
+
+        Args:
+            amount (float): The number of tokens to take.
+
+        Returns:
+            float: How long in seconds to wait before using the tokens.
+        """
+        with self.lock:
+            self.refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        r"""Gives back tokens that were reserved but not used, or takes more
+        if :obj:`amount` is negative."""
+        with self.lock:
+            self.refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class AIMDLimit:
+    r"""A concurrency limit adjusted by additive increase and multiplicative
+    decrease. Every successful request raises the limit by about one per
+    round trip of the whole window, and every throttled request cuts it.
+    Both threads and coroutines can wait for a slot.
+
+    Args:
+        max_limit (int): The maximum number of requests in flight.
+        min_limit (int): The minimum number of requests in flight.
+            (default: :obj:`1`)
+        decrease (float): The factor the limit is cut by when throttled.
+            (default: :obj:`0.5`)
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        decrease: float = 0.5,
+    ) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease = decrease
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop,
+                                       asyncio.Future]] = []
+
+    def has_slot(self) -> bool:
+        return self.in_flight < max(self.min_limit, math.floor(self.limit))
+
+    def acquire(self) -> None:
+        with self.condition:
+            while not self.has_slot():
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.has_slot():
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self.condition:
+                    if (loop, waiter) in self.async_waiters:
+                        self.async_waiters.remove((loop, waiter))
+
+    def release(self, throttled: bool = False, success: bool = True) -> None:
+        r"""Frees a slot and adjusts the limit.
+
+        Args:
+            throttled (bool): Whether the request was throttled.
+                (default: :obj:`False`)
+            success (bool): Whether the request succeeded. Failures other
+                than throttling leave the limit as it is.
+                (default: :obj:`True`)
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.min_limit),
+                                 self.limit * self.decrease)
+            elif success:
+                self.limit = min(float(self.max_limit),
+                                 self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(self.wake, waiter)
+
+    @staticmethod
+    def wake(waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+class RateLimitLease:
+    r"""A request admitted by a :class:`RateLimiter`.
+
+    Args:
+        limiter (RateLimiter): The limiter that admitted the request.
+        num_tokens (int): The number of tokens reserved for the request.
+    """
+
+    def __init__(self, limiter: "RateLimiter", num_tokens: int) -> None:
+        self.limiter = limiter
+        self.num_tokens = num_tokens
+
+    def record_usage(self, usage: Optional[Dict[str, int]]) -> None:
+        r"""Corrects the reservation with the tokens the request used."""
+        if usage is None or self.limiter.tokens is None:
+            return
+        total_tokens = usage.get("total_tokens", self.num_tokens)
+        self.limiter.tokens.adjust(self.num_tokens - total_tokens)
+        self.num_tokens = total_tokens
+
+
+class RateLimiter:
+    r"""Limits the requests sent to one deployment by requests per minute,
+    tokens per minute and an adaptive number of requests in flight. A limit
+    left as :obj:`None` is not enforced.
+
+    Args:
+        rpm (Optional[float]): The requests per minute quota.
+            (default: :obj:`None`)
+        tpm (Optional[float]): The tokens per minute quota.
+            (default: :obj:`None`)
+        max_concurrency (Optional[int]): The maximum number of requests in
+            flight, which is cut when requests are throttled and grows back
+            as they succeed. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
+        self.requests = TokenBucket(rpm) if rpm is not None else None
+        self.tokens = TokenBucket(tpm) if tpm is not None else None
+        self.concurrency = (AIMDLimit(max_concurrency)
+                            if max_concurrency is not None else None)
+        self.num_throttled = 0
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        r"""Holds back every request for :obj:`seconds`, e.g. for the
+        :obj:`Retry-After` of a throttled response."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def reserve(self, num_tokens: int) -> float:
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(num_tokens))
+        return delay
+
+    def release(self, error: Optional[BaseException]) -> None:
+        throttled = error is not None and is_throttle_error(error)
+        if throttled:
+            self.num_throttled += 1
+        if self.concurrency is not None:
+            self.concurrency.release(throttled=throttled,
+                                     success=error is None)
+
+    @contextmanager
+    def limit(self, num_tokens: int) -> Iterator[RateLimitLease]:
+        r"""Waits until a request of :obj:`num_tokens` prompt tokens may be
+        sent, and frees its slot when the block exits.
+
+        Args:
+            num_tokens (int): The estimated number of tokens of the request.
+
+        Yields:
+            RateLimitLease: The admitted request.
+        """
+        with RATE_LIMIT_WAITING.track_in_progress():
+            delay = self.reserve(num_tokens)
+            if delay > 0:
+                time.sleep(delay)
+            if self.concurrency is not None:
+                self.concurrency.acquire()
+        try:
+            yield RateLimitLease(self, num_tokens)
+        except BaseException as ex:
+            self.release(ex)
+            raise
+        self.release(None)
+
+    @asynccontextmanager
+    async def alimit(self, num_tokens: int) -> AsyncIterator[RateLimitLease]:
+        r"""Asynchronous version of :meth:`limit`."""
+        with RATE_LIMIT_WAITING.track_in_progress():
+            delay = self.reserve(num_tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.concurrency is not None:
+                await self.concurrency.aacquire()
+        try:
+            yield RateLimitLease(self, num_tokens)
+        except BaseException as ex:
+            self.release(ex)
+            raise
+        self.release(None)
+
+
+class RateLimiterRegistry:
+    r"""The rate limiters of the process, one per deployment, so that every
+    agent sending to a deployment shares its quota.
+
+    The default limits apply to deployments without their own and are read
+    from the :obj:`WADA_RPM`, :obj:`WADA_TPM` and
+    :obj:`WADA_MAX_CONCURRENCY` environment variables when not configured.
+    """
+
+    def __init__(self) -> None:
+        self.limits: Dict[Optional[str], Dict[str, Any]] = {}
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_env_limits() -> Dict[str, Any]:
+        rpm = os.getenv("WADA_RPM")
+        tpm = os.getenv("WADA_TPM")
+        max_concurrency = os.getenv("WADA_MAX_CONCURRENCY")
+        return {
+            "rpm": float(rpm) if rpm else None,
+            "tpm": float(tpm) if tpm else None,
+            "max_concurrency":
+            int(max_concurrency) if max_concurrency else None,
+        }
+
+    def configure(
+        self,
+        deployment: Optional[str] = None,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
+        r"""Sets the limits of a deployment.
+
+        Args:
+            deployment (Optional[str]): The deployment. If :obj:`None`, the
+                default limits are set. (default: :obj:`None`)
+            rpm (Optional[float]): The requests per minute quota.
+                (default: :obj:`None`)
+            tpm (Optional[float]): The tokens per minute quota.
+                (default: :obj:`None`)
+            max_concurrency (Optional[int]): The maximum number of requests
+                in flight. (default: :obj:`None`)
+        """
+        with self.lock:
+            self.limits[deployment] = dict(rpm=rpm, tpm=tpm,
+                                           max_concurrency=max_concurrency)
+            if deployment is None:
+                self.limiters.clear()
+            else:
+                self.limiters.pop(deployment, None)
+
+    def get(self, deployment: str) -> RateLimiter:
+        with self.lock:
+            limiter = self.limiters.get(deployment)
+            if limiter is None:
+                limits = self.limits.get(deployment)
+                if limits is None:
+                    limits = self.limits.get(None) or self.get_env_limits()
+                limiter = RateLimiter(**limits)
+                self.limiters[deployment] = limiter
+            return limiter
+
+    def reset(self) -> None:
+        with self.lock:
+            self.limits.clear()
+            self.limiters.clear()
+
+
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,339 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+)
+
+from wada.rate_limit import rate_limiters
+from wada.tracing import tracer
+from wada.typing import ErrorKind, SpanKind
+
+T = TypeVar("T")
+
+THROTTLED_ERRORS = ("RateLimitError", )
+TIMEOUT_ERRORS = ("Timeout", "TimeoutError", "ReadTimeout", "ConnectTimeout")
+SERVER_ERRORS = ("APIError", "ServiceUnavailableError", "APIConnectionError",
+                 "TryAgain", "ConnectionError", "ServerDisconnectedError",
+                 "ClientConnectionError")
+INVALID_REQUEST_ERRORS = ("InvalidRequestError", "AuthenticationError",
+                          "PermissionError", "SignatureVerificationError",
+                          "InvalidAPIType")
+
+
+class CircuitOpenError(RuntimeError):
+    r"""Raised instead of sending a request to a deployment whose circuit
+    breaker is open."""
+
+
+def classify_error(error: BaseException) -> ErrorKind:
+    r"""Classifies an error raised by a chat completion request. Errors are
+    matched by HTTP status and type name, so that the openai package does
+    not have to be imported.
+
+    Args:
+        error (BaseException): The error.
+
+    Returns:
+        ErrorKind: The kind of the error.
+    """
+    names = {cls.__name__ for cls in type(error).__mro__}
+    status = getattr(error, "http_status", None)
+    if status == 429 or names.intersection(THROTTLED_ERRORS):
+        return ErrorKind.THROTTLED
+    if (isinstance(error, (asyncio.TimeoutError, TimeoutError))
+            or status in (408, 504) or names.intersection(TIMEOUT_ERRORS)):
+        return ErrorKind.TIMEOUT
+    if status is not None and 400 <= status < 500:
+        return ErrorKind.INVALID_REQUEST
+    if names.intersection(INVALID_REQUEST_ERRORS):
+        return ErrorKind.INVALID_REQUEST
+    if ((status is not None and status >= 500)
+            or names.intersection(SERVER_ERRORS)):
+        return ErrorKind.SERVER_ERROR
+    return ErrorKind.OTHER
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    r"""Returns the delay in seconds the server asked for with the
+    :obj:`Retry-After` header of an error, if any. A header that is neither
+    a number nor a date is ignored, so the caller backs off instead."""
+    headers = getattr(error, "headers", None)
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in headers.items()}
+    if headers.get("retry-after-ms") is not None:
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    r"""Stops sending requests to a deployment that keeps failing. After
+    :obj:`failure_threshold` consecutive server errors or timeouts the
+    circuit opens and requests fail fast with :class:`CircuitOpenError`.
+    After :obj:`reset_timeout` seconds one trial request is let through,
+    and the circuit closes again if it succeeds.
+
+    Args:
+        failure_threshold (int): The number of consecutive failures that
+            opens the circuit. (default: :obj:`5`)
+        reset_timeout (float): How long in seconds the circuit stays open.
+            (default: :obj:`30.0`)
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.num_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> None:
+        with self.lock:
+            state = self.state
+            if state == "open" or (state == "half_open"
+                                   and self.trial_in_flight):
+                raise CircuitOpenError(
+                    f"Circuit open after {self.num_failures} failures")
+            if state == "half_open":
+                self.trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.num_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self, kind: ErrorKind) -> None:
+        with self.lock:
+            self.trial_in_flight = False
+            if kind not in (ErrorKind.SERVER_ERROR, ErrorKind.TIMEOUT):
+                return
+            self.num_failures += 1
+            if (self.opened_at is not None
+                    or self.num_failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakerRegistry:
+    r"""The circuit breakers of the process, one per deployment.
+
+    Args:
+        failure_threshold (int): See :class:`CircuitBreaker`.
+            (default: :obj:`5`)
+        reset_timeout (float): See :class:`CircuitBreaker`.
+            (default: :obj:`30.0`)
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = threading.Lock()
+
+    def get(self, deployment: str) -> CircuitBreaker:
+        with self.lock:
+            breaker = self.breakers.get(deployment)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold,
+                                         self.reset_timeout)
+                self.breakers[deployment] = breaker
+            return breaker
+
+    def reset(self) -> None:
+        with self.lock:
+            self.breakers.clear()
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+
+class RetryPolicy:
+    r"""Retries the requests to a deployment according to the kind of error.
+    Throttled requests wait for the :obj:`Retry-After` the server asked
+    for, which also holds back the other requests to the deployment through
+    its rate limiter. Timeouts and server errors back off exponentially with
+    jitter and count towards the circuit breaker of the deployment. Invalid
+    requests and other errors are raised at once.
+
+    Args:
+        max_attempts (int): The maximum number of attempts of a request.
+            (default: :obj:`5`)
+        min_wait (float): The minimum backoff in seconds.
+            (default: :obj:`5.0`)
+        max_wait (float): The maximum backoff in seconds, also applied to
+            :obj:`Retry-After`. (default: :obj:`60.0`)
+    """
+
+    RETRIED_KINDS = (ErrorKind.THROTTLED, ErrorKind.TIMEOUT,
+                     ErrorKind.SERVER_ERROR)
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        min_wait: float = 5.0,
+        max_wait: float = 60.0,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+
+    def should_retry(self, error: BaseException) -> bool:
+        return classify_error(error) in self.RETRIED_KINDS
+
+    def wait(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception()
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_wait)
+        backoff = self.min_wait * 2**(retry_state.attempt_number - 1)
+        return min(self.max_wait, backoff) * random.uniform(0.5, 1.0)
+
+    def get_retrying_kwargs(self) -> Dict[str, Any]:
+        return dict(retry=retry_if_exception(self.should_retry),
+                    wait=self.wait, stop=stop_after_attempt(self.max_attempts))
+
+    def record_failure(self, deployment: str, error: BaseException) -> None:
+        kind = classify_error(error)
+        circuit_breakers.get(deployment).record_failure(kind)
+        retry_after = get_retry_after(error)
+        if kind == ErrorKind.THROTTLED and retry_after is not None:
+            rate_limiters.get(deployment).pause(min(retry_after,
+                                                    self.max_wait))
+
+    @contextmanager
+    def guard(self, deployment: str) -> Iterator[None]:
+        r"""Sends the request of the block through the circuit breaker of
+        a deployment, and records its failure against the deployment.
+
+        Args:
+            deployment (str): The key of the deployment the request is sent
+                to, e.g. :obj:`"<endpoint>/<deployment>"` when the
+                requests are spread over an endpoint pool.
+        """
+        breaker = circuit_breakers.get(deployment)
+        breaker.before_call()
+        try:
+            yield
+        except BaseException as ex:
+            self.record_failure(deployment, ex)
+            raise
+        breaker.record_success()
+
+    def call(
+        self,
+        deployment: str,
+        func: Callable[[], T],
+        guarded: bool = True,
+    ) -> T:
+        r"""Calls :obj:`func` with retries.
+
+        Args:
+            deployment (str): The deployment the request is sent to.
+            func (Callable[[], T]): The request.
+            guarded (bool): Whether the attempts go through the circuit
+                breaker of :obj:`deployment`. If :obj:`False`, :obj:`func`
+                guards itself with :meth:`guard` once it knows where the
+                attempt is sent. (default: :obj:`True`)
+
+        Returns:
+            T: The result of :obj:`func`.
+        """
+        attempt_number = 0
+
+        def attempt() -> T:
+            nonlocal attempt_number
+            attempt_number += 1
+            with tracer.span("retry.attempt", SpanKind.RETRY,
+                             deployment=deployment,
+                             attempt=attempt_number) as span:
+                try:
+                    if not guarded:
+                        return func()
+                    with self.guard(deployment):
+                        return func()
+                except BaseException as ex:
+                    span.set_attributes(error_kind=classify_error(ex).value)
+                    raise
+
+        return Retrying(**self.get_retrying_kwargs())(attempt)
+
+    async def acall(
+        self,
+        deployment: str,
+        func: Callable[[], Awaitable[T]],
+        guarded: bool = True,
+    ) -> T:
+        r"""Asynchronous version of :meth:`call`."""
+        attempt_number = 0
+
+        async def attempt() -> T:
+            nonlocal attempt_number
+            attempt_number += 1
+            with tracer.span("retry.attempt", SpanKind.RETRY,
+                             deployment=deployment,
+                             attempt=attempt_number) as span:
+                try:
+                    if not guarded:
+                        return await func()
+                    with self.guard(deployment):
+                        return await func()
+                except BaseException as ex:
+                    span.set_attributes(error_kind=classify_error(ex).value)
+                    raise
+
+        return await AsyncRetrying(**self.get_retrying_kwargs())(attempt)
@@ -0,0 +1,374 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import queue
+import threading
+from contextlib import AsyncExitStack, ExitStack
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from wada.messages import ChatMessage
+
+FINAL_ANSWER_PREFIX = "Final Answer:"
+
+
+class ChunkStream:
+    r"""The chunks of a streamed response, which hold the resources of their
+    request, e.g. its rate limiter lease, its endpoint and its span, until
+    they are exhausted or closed. The resources see the exception raised
+    while the chunks are read, if any, as the outcome of the request.
+
+    Args:
+        chunks (Iterable[Dict[str, Any]]): The chunks of the response.
+        resources (ExitStack): The resources of the request.
+    """
+
+    def __init__(self, chunks: Iterable[Dict[str, Any]],
+                 resources: ExitStack) -> None:
+        self.chunks = chunks
+        self.resources = resources
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with self.resources:
+            try:
+                yield from self.chunks
+            except GeneratorExit:
+                # Closed by the consumer, which is not a failure of the
+                # request.
+                return
+
+    def close(self) -> None:
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+        self.resources.close()
+
+
+class AsyncChunkStream:
+    r"""Asynchronous version of :class:`ChunkStream`.
+
+    Args:
+        chunks (AsyncIterable[Dict[str, Any]]): The chunks of the response.
+        resources (AsyncExitStack): The resources of the request.
+    """
+
+    def __init__(self, chunks: AsyncIterable[Dict[str, Any]],
+                 resources: AsyncExitStack) -> None:
+        self.chunks = chunks
+        self.resources = resources
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        async with self.resources:
+            try:
+                async for chunk in self.chunks:
+                    yield chunk
+            except GeneratorExit:
+                await self.aclose_chunks()
+
+    async def aclose_chunks(self) -> None:
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    async def aclose(self) -> None:
+        await self.aclose_chunks()
+        await self.resources.aclose()
+
+
+class BaseChatStream:
+    r"""Assembles the chunks of a streamed chat completion into a response
+    of the same shape as a non-streamed one.
+
+    Args:
+        on_complete (Callable[[Dict[str, Any]], List[ChatMessage]]): Called
+            with the assembled response once the stream is exhausted. It
+            returns the output messages of the response.
+        on_abort (Optional[Callable[[], None]]): Called if the stream fails
+            or is closed before it is exhausted. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        on_complete: Callable[[Dict[str, Any]], List[ChatMessage]],
+        on_abort: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.on_complete = on_complete
+        self.on_abort = on_abort
+        self.closed = False
+        self.id: Optional[str] = None
+        self.roles: Dict[int, str] = {}
+        self.contents: Dict[int, List[str]] = {}
+        self.finish_reasons: Dict[int, Optional[str]] = {}
+        self.messages: Optional[List[ChatMessage]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.messages is not None
+
+    def add_chunk(self, chunk: Dict[str, Any]) -> str:
+        r"""Adds a chunk to the response.
+
+        Args:
+            chunk (Dict[str, Any]): A chunk of the streamed response.
+
+        Returns:
+            str: The new content of the first choice, empty if the chunk
+                carries none.
+        """
+        self.id = self.id or chunk.get("id")
+        delta_content = ""
+        # Azure sends the content filter results in a chunk without choices.
+        for choice in chunk.get("choices", []):
+            index = choice.get("index", 0)
+            delta = choice.get("delta", {})
+            self.roles[index] = delta.get("role",
+                                          self.roles.get(index, "assistant"))
+            content = delta.get("content") or ""
+            self.contents.setdefault(index, []).append(content)
+            if choice.get("finish_reason") is not None:
+                self.finish_reasons[index] = choice["finish_reason"]
+            if index == 0:
+                delta_content += content
+        return delta_content
+
+    def complete(self) -> None:
+        choices = [{
+            "index": index,
+            "message": {
+                "role": self.roles.get(index, "assistant"),
+                "content": "".join(self.contents[index]),
+            },
+            "finish_reason": self.finish_reasons.get(index),
+        } for index in sorted(self.contents)]
+        response = {"id": self.id, "choices": choices, "usage": None}
+        self.messages = self.on_complete(response)
+
+    def abort(self) -> None:
+        self.closed = True
+        if not self.done and self.on_abort is not None:
+            self.on_abort()
+
+
+class ChatStream(BaseChatStream):
+    r"""An iterator over the content deltas of a streamed chat completion.
+    Once it is exhausted, :obj:`messages` holds the output messages and the
+    info returned with the stream is filled in.
+
+    Args:
+        chunks (Iterable[Dict[str, Any]]): The chunks of the response.
+        on_complete (Callable[[Dict[str, Any]], List[ChatMessage]]): Called
+            with the assembled response once the stream is exhausted.
+        on_abort (Optional[Callable[[], None]]): Called if the stream fails
+            or is closed before it is exhausted. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[Dict[str, Any]],
+        on_complete: Callable[[Dict[str, Any]], List[ChatMessage]],
+        on_abort: Optional[Callable[[], None]] = None,
+    ) -> None:
+        super().__init__(on_complete, on_abort)
+        self.chunks = chunks
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self.chunks:
+                delta = self.add_chunk(chunk)
+                if delta:
+                    yield delta
+            self.complete()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        r"""Releases the request of the stream, which is aborted if it is
+        not exhausted yet."""
+        if self.closed:
+            return
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+        self.abort()
+
+
+class AsyncChatStream(BaseChatStream):
+    r"""Asynchronous version of :class:`ChatStream`.
+
+    Args:
+        chunks (AsyncIterable[Dict[str, Any]]): The chunks of the response.
+        on_complete (Callable[[Dict[str, Any]], List[ChatMessage]]): Called
+            with the assembled response once the stream is exhausted.
+        on_abort (Optional[Callable[[], None]]): Called if the stream fails
+            or is closed before it is exhausted. (default: :obj:`None`)
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterable[Dict[str, Any]],
+        on_complete: Callable[[Dict[str, Any]], List[ChatMessage]],
+        on_abort: Optional[Callable[[], None]] = None,
+    ) -> None:
+        super().__init__(on_complete, on_abort)
+        self.chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.chunks:
+                delta = self.add_chunk(chunk)
+                if delta:
+                    yield delta
+            self.complete()
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        r"""Asynchronous version of :meth:`ChatStream.close`."""
+        if self.closed:
+            return
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        self.abort()
+
+
+class FinalAnswerFilter:
+    r"""Picks the final answer out of the tokens of a ReAct completion, so
+    that only the text after :obj:`"Final Answer:"` is streamed. The
+    :obj:`"###"` markers the debaters put around their arguments are
+    removed, like in the reply returned by
+    :meth:`wada.agents.DebaterAgent.step`.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.text = ""
+        self.answer_start: Optional[int] = None
+        self.num_emitted = 0
+
+    def feed(self, token: str) -> str:
+        r"""Adds a token of the completion.
+
+        Args:
+            token (str): The new token.
+
+        Returns:
+            str: The new text of the final answer, empty if there is none
+                yet.
+        """
+        self.text += token
+        if self.answer_start is None:
+            index = self.text.find(FINAL_ANSWER_PREFIX)
+            if index < 0:
+                return ""
+            self.answer_start = index + len(FINAL_ANSWER_PREFIX)
+        answer = self.text[self.answer_start:].lstrip().replace("###", "")
+        # A trailing "#" may be the start of a marker split across tokens.
+        return self.emit(answer.rstrip("#"))
+
+    def flush(self) -> str:
+        if self.answer_start is None:
+            return ""
+        answer = self.text[self.answer_start:].lstrip().replace("###", "")
+        return self.emit(answer.rstrip())
+
+    def emit(self, answer: str) -> str:
+        delta = answer[self.num_emitted:]
+        self.num_emitted = max(self.num_emitted, len(answer))
+        return delta
+
+
+class ReplyStream:
+    r"""An iterator over the deltas of a reply produced by a blocking call in
+    a background thread. Once it is exhausted, :obj:`result` holds the value
+    returned by the call, and exceptions raised by the call are re-raised.
+
+    Args:
+        target (Callable[[Callable[[str], None]], str]): The blocking call.
+            It is given a function to push deltas with and returns the
+            whole reply.
+    """
+
+    def __init__(self, target: Callable[[Callable[[str], None]], str]) -> None:
+        self.target = target
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.deltas: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def run(self) -> None:
+        try:
+            self.result = self.target(self.deltas.put)
+        except BaseException as ex:
+            self.error = ex
+        finally:
+            self.deltas.put(None)
+
+    def __iter__(self) -> Iterator[str]:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        while True:
+            delta = self.deltas.get()
+            if delta is None:
+                break
+            if delta:
+                yield delta
+        thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class AsyncReplyStream:
+    r"""Asynchronous version of :class:`ReplyStream`. The call runs as a task
+    on the event loop of the consumer.
+
+    Args:
+        target (Callable[[Callable[[str], None]], Awaitable[str]]): The
+            coroutine function producing the reply. It is given a function to
+            push deltas with and returns the whole reply.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[Callable[[str], None]], Awaitable[str]],
+    ) -> None:
+        self.target = target
+        self.result: Optional[str] = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        deltas: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        task = asyncio.ensure_future(self.target(deltas.put_nowait))
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
+        try:
+            while True:
+                delta = await deltas.get()
+                if delta is None:
+                    break
+                if delta:
+                    yield delta
+            self.result = await task
+        finally:
+            task.cancel()
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from typing import Any, Dict
+
 from wada.typing import TopicType
 
 
@@ -45,3 +47,10 @@ class Topic:
     specified_aspects: str = ""
     abbr: str = ""
     catagory: TopicType = TopicType.OTHER
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "catagory": self.catagory.value}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Topic":
+        return cls(**{**data, "catagory": TopicType(data["catagory"])})
@@ -0,0 +1,417 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence
+
+from wada.typing import SpanKind
+
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def add_usage(total: Dict[str, int], usage: Optional[Dict[str, int]]) -> None:
+    r"""Adds the token usage of a response to a running total."""
+    for key in USAGE_KEYS:
+        if usage and key in usage:
+            total[key] = total.get(key, 0) + usage[key]
+
+
+class Span:
+    r"""A timed operation of a debate, e.g. an agent step or a request to
+    the LLM, with the spans it is made of as children.
+
+    Args:
+        name (str): The name of the operation.
+        kind (SpanKind): The kind of the operation.
+        trace_id (str): The id shared by the spans of a trace, as 32 hex
+            digits.
+        parent_id (Optional[str]): The id of the parent span, if any.
+            (default: :obj:`None`)
+        attributes (Optional[Dict[str, Any]]): The attributes of the span,
+            e.g. the model and the token usage. (default: :obj:`None`)
+    """
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id",
+                 "attributes", "start_time", "end_time", "error", "start")
+
+    def __init__(
+        self,
+        name: str,
+        kind: SpanKind,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.error: Optional[str] = None
+        self.start = time.perf_counter_ns()
+
+    @property
+    def duration(self) -> Optional[float]:
+        r"""The duration of the span in seconds, once it has ended."""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) / 1e9
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def set_usage(self, usage: Optional[Dict[str, int]]) -> None:
+        r"""Records the token usage of a response."""
+        if usage is None:
+            return
+        for key in USAGE_KEYS:
+            if key in usage:
+                self.attributes[key] = usage[key]
+
+    def record_error(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+
+    def finish(self) -> None:
+        # The end is measured on the monotonic clock, so that the duration
+        # is right even if the wall clock is adjusted.
+        self.end_time = (self.start_time + time.perf_counter_ns() - self.start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind.value,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time / 1e9,
+            "duration": self.duration,
+            "status": "ok" if self.error is None else "error",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def __repr__(self) -> str:
+        return f"Span({self.name}, {self.kind}, {self.span_id})"
+
+
+class NullSpan:
+    r"""The span handed out while tracing is disabled. It records nothing,
+    so instrumented code does not need to check whether tracing is on."""
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+    def set_usage(self, usage: Optional[Dict[str, int]]) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class TraceCallback:
+    r"""The hooks called when spans start and end. Subclasses override the
+    ones they need."""
+
+    def on_span_start(self, span: Span) -> None:
+        pass
+
+    def on_span_end(self, span: Span) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FileExporter(TraceCallback):
+    r"""Appends every span that ends to a file, one JSON object per line.
+    The file is opened when the first span ends.
+
+    Args:
+        path (str): The path of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file: Optional[IO[str]] = None
+        self.lock = threading.Lock()
+
+    def format(self, span: Span) -> Dict[str, Any]:
+        return span.to_dict()
+
+    def on_span_end(self, span: Span) -> None:
+        line = json.dumps(self.format(span), default=str)
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def shutdown(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class JSONLExporter(FileExporter):
+    r"""Writes the spans as flat JSON lines, see :meth:`Span.to_dict`."""
+
+
+class OTLPJSONExporter(FileExporter):
+    r"""Writes the spans in the JSON encoding of the OpenTelemetry protocol,
+    one :obj:`ExportTraceServiceRequest` per line, which the file receiver
+    of the OpenTelemetry collector reads and forwards to any tracing
+    backend.
+
+    Args:
+        path (str): The path of the file.
+        service_name (str): The :obj:`service.name` of the resource.
+            (default: :obj:`"wada"`)
+    """
+
+    # The requests and the tools are calls to other services.
+    CLIENT_KINDS = (SpanKind.LLM_REQUEST, SpanKind.TOOL)
+
+    def __init__(self, path: str, service_name: str = "wada") -> None:
+        super().__init__(path)
+        self.service_name = service_name
+
+    @staticmethod
+    def format_value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def format_attributes(self, attributes: Dict[str,
+                                                 Any]) -> List[Dict[str, Any]]:
+        return [{
+            "key": key,
+            "value": self.format_value(value)
+        } for key, value in attributes.items() if value is not None]
+
+    def format(self, span: Span) -> Dict[str, Any]:
+        attributes = {"wada.span.kind": span.kind.value, **span.attributes}
+        status = {
+            "code": 1
+        } if span.error is None else {
+            "code": 2,
+            "message": span.error
+        }
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": 3 if span.kind in self.CLIENT_KINDS else 1,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": self.format_attributes(attributes),
+            "status": status,
+        }
+        resource = {
+            "attributes":
+            self.format_attributes({"service.name": self.service_name})
+        }
+        scope_spans = {"scope": {"name": "wada"}, "spans": [otlp_span]}
+        return {
+            "resourceSpans": [{
+                "resource": resource,
+                "scopeSpans": [scope_spans]
+            }]
+        }
+
+
+active_span: ContextVar[Optional[Span]] = ContextVar("wada_active_span",
+                                                     default=None)
+
+
+class Tracer:
+    r"""Creates the spans of the process and hands them to its callbacks.
+    The current span is kept in a context variable, so the spans started
+    while it is current become its children, across :obj:`await` and in
+    the tasks it starts. Without callbacks, tracing is disabled and
+    :meth:`span` returns a shared no-op span.
+
+    Args:
+        callbacks (Sequence[TraceCallback]): The callbacks and exporters.
+            (default: :obj:`()`)
+    """
+
+    def __init__(self, callbacks: Sequence[TraceCallback] = ()) -> None:
+        self.callbacks: List[TraceCallback] = list(callbacks)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        r"""Returns a tracer exporting to the file set by the
+        :obj:`WADA_TRACE_FILE` environment variable, in the format set by
+        :obj:`WADA_TRACE_FORMAT`, :obj:`"jsonl"` (the default) or
+        :obj:`"otlp"`. Without :obj:`WADA_TRACE_FILE`, tracing is
+        disabled."""
+        path = os.getenv("WADA_TRACE_FILE")
+        if not path:
+            return cls()
+        trace_format = os.getenv("WADA_TRACE_FORMAT", "jsonl")
+        if trace_format == "jsonl":
+            return cls([JSONLExporter(path)])
+        if trace_format == "otlp":
+            return cls([OTLPJSONExporter(path)])
+        raise ValueError(f"Unknown trace format: {trace_format}")
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.callbacks) > 0
+
+    def add_callback(self, callback: TraceCallback) -> None:
+        with self.lock:
+            self.callbacks = self.callbacks + [callback]
+
+    def remove_callback(self, callback: TraceCallback) -> None:
+        with self.lock:
+            self.callbacks = [c for c in self.callbacks if c is not callback]
+
+    def current_span(self) -> Optional[Span]:
+        if not self.callbacks:
+            return None
+        return active_span.get()
+
+    def start_span(
+        self,
+        name: str,
+        kind: SpanKind,
+        parent: Optional[Span] = None,
+        **attributes: Any,
+    ) -> Span:
+        r"""Starts a span without making it current. It must be ended with
+        :meth:`end_span`.
+
+        Args:
+            name (str): The name of the operation.
+            kind (SpanKind): The kind of the operation.
+            parent (Optional[Span]): The parent span. If :obj:`None`, the
+                current span is the parent, if any. (default: :obj:`None`)
+            **attributes (Any): The attributes of the span.
+
+        Returns:
+            Span: The span.
+        """
+        parent = parent or active_span.get()
+        if parent is None:
+            span = Span(name, kind, f"{random.getrandbits(128):032x}",
+                        attributes=attributes)
+        else:
+            span = Span(name, kind, parent.trace_id, parent.span_id,
+                        attributes)
+        for callback in self.callbacks:
+            callback.on_span_start(span)
+        return span
+
+    def end_span(self, span: Span,
+                 error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            span.record_error(error)
+        span.finish()
+        for callback in self.callbacks:
+            callback.on_span_end(span)
+
+    def span(self, name: str, kind: SpanKind, **attributes: Any) -> Any:
+        r"""Returns a context manager that runs its block in a new current
+        span, and records the exception the block raises, if any.
+
+        Args:
+            name (str): The name of the operation.
+            kind (SpanKind): The kind of the operation.
+            **attributes (Any): The attributes of the span.
+
+        Returns:
+            Any: The context manager, which yields the span.
+        """
+        if not self.callbacks:
+            return NULL_SPAN
+        return self.use_span(self.start_span(name, kind, **attributes))
+
+    def open_span(self, name: str, kind: SpanKind, **attributes: Any) -> Any:
+        r"""Like :meth:`span`, but the span is not made current, see
+        :meth:`activate`. It can then be held past the block that started
+        it, e.g. by the stream of a response, with an
+        :obj:`contextlib.ExitStack`.
+
+        Args:
+            name (str): The name of the operation.
+            kind (SpanKind): The kind of the operation.
+            **attributes (Any): The attributes of the span.
+
+        Returns:
+            Any: The context manager, which yields the span.
+        """
+        if not self.callbacks:
+            return NULL_SPAN
+        return self.end_on_exit(self.start_span(name, kind, **attributes))
+
+    @contextmanager
+    def end_on_exit(self, span: Span) -> Iterator[Span]:
+        try:
+            yield span
+        except BaseException as ex:
+            self.end_span(span, ex)
+            raise
+        else:
+            self.end_span(span)
+
+    @contextmanager
+    def activate(self, span: Any) -> Iterator[None]:
+        r"""Makes a span returned by :meth:`open_span` current in the
+        block."""
+        if not isinstance(span, Span):
+            yield
+            return
+        token = active_span.set(span)
+        try:
+            yield
+        finally:
+            active_span.reset(token)
+
+    @contextmanager
+    def use_span(self, span: Span) -> Iterator[Span]:
+        with self.end_on_exit(span), self.activate(span):
+            yield span
+
+    def shutdown(self) -> None:
+        for callback in self.callbacks:
+            callback.shutdown()
+
+
+tracer = Tracer.from_env()
@@ -0,0 +1,210 @@
+# Copyright © Microsoft Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict, Iterator, List, Optional, Union, overload
+
+from wada.messages import OpenAIMessage, UserChatMessage, message_from_dict
+from wada.typing import RoleType
+
+
+class TranscriptMessage:
+    r"""A message of a :class:`Transcript`. It holds only the speaker and
+    the content, in slots, and reads like a :class:`wada.messages.
+    UserChatMessage` otherwise.
+
+    Args:
+        role_name (str): The name of the speaker.
+        role_type (RoleType): The type of the speaker.
+        content (str): The content of the message.
+    """
+    __slots__ = ("role_name", "role_type", "content")
+
+    meta_dict = None
+    role = "user"
+
+    def __init__(self, role_name: str, role_type: RoleType,
+                 content: str) -> None:
+        self.role_name = role_name
+        self.role_type = role_type
+        self.content = content
+
+    def to_user_chat_message(self) -> UserChatMessage:
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=self.role_type, content=self.content)
+
+    def to_openai_message(self, role: Optional[str] = None) -> OpenAIMessage:
+        return self.to_user_chat_message().to_openai_message(role)
+
+    def to_dict(self) -> Dict:
+        return self.to_user_chat_message().to_dict()
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, TranscriptMessage):
+            return NotImplemented
+        return (self.role_name == other.role_name
+                and self.role_type == other.role_type
+                and self.content == other.content)
+
+    def __repr__(self) -> str:
+        return (f"TranscriptMessage(role_name={self.role_name!r}, "
+                f"role_type={self.role_type}, content={self.content!r})")
+
+
+class TranscriptWindow:
+    r"""A read-only window on the messages of a :class:`Transcript`
+    between two positions. The messages are not copied, and a window whose
+    end is set keeps showing the same messages as the transcript grows.
+
+    Args:
+        transcript (Transcript): The transcript.
+        start (int): The position of the first message.
+        stop (Optional[int]): The position after the last message. If
+            :obj:`None`, the window follows the end of the transcript.
+    """
+    __slots__ = ("transcript", "start", "stop")
+
+    def __init__(self, transcript: "Transcript", start: int,
+                 stop: Optional[int]) -> None:
+        self.transcript = transcript
+        self.start = start
+        self.stop = stop
+
+    def get_messages(self) -> List[TranscriptMessage]:
+        return self.transcript.messages[self.start:self.stop]
+
+    def __len__(self) -> int:
+        return len(self.get_messages())
+
+    def __iter__(self) -> Iterator[TranscriptMessage]:
+        return iter(self.get_messages())
+
+    def __getitem__(self, index: int) -> TranscriptMessage:
+        return self.get_messages()[index]
+
+    def render(self) -> str:
+        r"""Returns the messages of the window as one text, each under the
+        name of its speaker."""
+        return "".join(f"{message.role_name}:\n\n{message.content}\n"
+                       for message in self.get_messages())
+
+
+class WindowMessage:
+    r"""A message whose content is a :class:`TranscriptWindow`, rendered
+    when it is read. An agent can keep it in its history instead of a copy
+    of the messages of the window.
+
+    Args:
+        role_name (str): The name of the role sending the message.
+        role_type (RoleType): The type of the role.
+        window (TranscriptWindow): The window.
+    """
+    __slots__ = ("role_name", "role_type", "window")
+
+    meta_dict = None
+    role = "user"
+
+    def __init__(self, role_name: str, role_type: RoleType,
+                 window: TranscriptWindow) -> None:
+        self.role_name = role_name
+        self.role_type = role_type
+        self.window = window
+
+    @property
+    def content(self) -> str:
+        return self.window.render()
+
+    def to_user_chat_message(self) -> UserChatMessage:
+        return UserChatMessage(role_name=self.role_name,
+                               role_type=self.role_type, content=self.content)
+
+    def to_openai_message(self, role: Optional[str] = None) -> OpenAIMessage:
+        return self.to_user_chat_message().to_openai_message(role)
+
+    def to_dict(self) -> Dict:
+        return self.to_user_chat_message().to_dict()
+
+
+class Transcript:
+    r"""The messages of a debate, kept once. The simulator appends to it,
+    and the host and the UI read it through windows instead of keeping
+    copies of the rounds.
+    """
+
+    def __init__(self) -> None:
+        self.messages: List[TranscriptMessage] = []
+
+    def append(self, role_name: str, role_type: RoleType,
+               content: str) -> TranscriptMessage:
+        message = TranscriptMessage(role_name, role_type, content)
+        self.messages.append(message)
+        return message
+
+    def window(self, start: int = 0,
+               stop: Optional[int] = None) -> TranscriptWindow:
+        r"""Returns a window on the messages from :obj:`start`. A negative
+        position counts from the current end of the transcript.
+
+        Args:
+            start (int): The position of the first message.
+                (default: :obj:`0`)
+            stop (Optional[int]): The position after the last message. If
+                :obj:`None`, the window follows the end of the transcript.
+                (default: :obj:`None`)
+
+        Returns:
+            TranscriptWindow: The window.
+        """
+        if start < 0:
+            start = max(len(self.messages) + start, 0)
+        if stop is not None and stop < 0:
+            stop = max(len(self.messages) + stop, 0)
+        return TranscriptWindow(self, start, stop)
+
+    def to_dicts(self) -> List[Dict]:
+        return [message.to_dict() for message in self.messages]
+
+    @classmethod
+    def from_dicts(cls, messages: List[Dict]) -> "Transcript":
+        r"""Returns the transcript serialized by :meth:`to_dicts`."""
+        transcript = cls()
+        for data in messages:
+            message = message_from_dict(data)
+            transcript.append(message.role_name, message.role_type,
+                              message.content)
+        return transcript
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[TranscriptMessage]:
+        return iter(self.messages)
+
+    @overload
+    def __getitem__(self, index: int) -> TranscriptMessage:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[TranscriptMessage]:
+        ...
+
+    def __getitem__(
+        self,
+        index: Union[int, slice],
+    ) -> Union[TranscriptMessage, List[TranscriptMessage]]:
+        return self.messages[index]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Transcript):
+            return NotImplemented
+        return self.messages == other.messages
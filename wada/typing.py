@@ -28,6 +28,34 @@ class ModelType(Enum):
     GPT_4_32k = "gpt-4-32k"
 
 
+class OverflowPolicy(Enum):
+    TERMINATE = "terminate"
+    TRIM = "trim"
+    SUMMARIZE = "summarize"
+    ESCALATE = "escalate"
+
+
+class ErrorKind(Enum):
+    THROTTLED = "throttled"
+    TIMEOUT = "timeout"
+    SERVER_ERROR = "server_error"
+    INVALID_REQUEST = "invalid_request"
+    OTHER = "other"
+
+
+class RoutingStrategy(Enum):
+    LEAST_OUTSTANDING = "least_outstanding"
+    WEIGHTED = "weighted"
+
+
+class SpanKind(Enum):
+    AGENT_STEP = "agent_step"
+    LLM_REQUEST = "llm_request"
+    RETRY = "retry"
+    TOOL = "tool"
+    REACT_ITERATION = "react_iteration"
+
+
 class TopicType(Enum):
     CAREER_EDUCATION = "Career and Education"
     PERSONAL_RELATIONSHIPS = "Personal Relationships"
@@ -37,4 +65,7 @@ class TopicType(Enum):
     OTHER = "Other"
 
 
-__all__ = ['RoleType', 'ModelType', 'TopicType']
+__all__ = [
+    'RoleType', 'ModelType', 'OverflowPolicy', 'ErrorKind', 'RoutingStrategy',
+    'SpanKind', 'TopicType'
+]
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import os
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import Any, Callable, List
 
 import tiktoken
@@ -22,6 +22,28 @@ from wada.messages import OpenAIMessage
 from wada.typing import ModelType
 
 
+def count_tokens_openai_chat_message(
+    message: OpenAIMessage,
+    encoding: Any,
+) -> int:
+    r"""Counts the number of tokens a single message adds to an OpenAI chat.
+
+    Args:
+        message (OpenAIMessage): The message.
+        encoding (Any): The encoding method to use.
+
+    Returns:
+        int: The number of tokens required.
+    """
+    # message follows <im_start>{role/name}\n{content}<im_end>\n
+    num_tokens = 4
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":  # if there's a name, the role is omitted
+            num_tokens += -1  # role is always 1 token
+    return num_tokens
+
+
 def count_tokens_openai_chat_models(
     messages: List[OpenAIMessage],
     encoding: Any,
@@ -38,29 +60,21 @@ def count_tokens_openai_chat_models(
     """
     num_tokens = 0
     for message in messages:
-        # message follows <im_start>{role/name}\n{content}<im_end>\n
-        num_tokens += 4
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":  # if there's a name, the role is omitted
-                num_tokens += -1  # role is always 1 token
+        num_tokens += count_tokens_openai_chat_message(message, encoding)
     num_tokens += 2  # every reply is primed with <im_start>assistant
     return num_tokens
 
 
-def num_tokens_from_messages(
-    messages: List[OpenAIMessage],
-    model: ModelType,
-) -> int:
-    r"""Returns the number of tokens used by a list of messages.
+@lru_cache(maxsize=None)
+def get_model_encoding(model: ModelType) -> Any:
+    r"""Returns the tiktoken encoding of a model. Encodings are memoized per
+    model, so the BPE ranks are only loaded once per process.
 
     Args:
-        messages (List[OpenAIMessage]): The list of messages to count the
-            number of tokens for.
         model (ModelType): The OpenAI model used to encode the messages.
 
     Returns:
-        int: The total number of tokens used by the messages.
+        Any: The encoding of the model.
 
     Raises:
         NotImplementedError: If the specified `model` is not implemented.
@@ -70,17 +84,8 @@ def num_tokens_from_messages(
         - https://platform.openai.com/docs/models/gpt-4
         - https://platform.openai.com/docs/models/gpt-3-5
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model.value)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == ModelType.GPT_3_5_TURBO:
-        return count_tokens_openai_chat_models(messages, encoding)
-    elif model == ModelType.GPT_4:
-        return count_tokens_openai_chat_models(messages, encoding)
-    elif model == ModelType.GPT_4_32k:
-        return count_tokens_openai_chat_models(messages, encoding)
-    else:
+    if model not in (ModelType.GPT_3_5_TURBO, ModelType.GPT_4,
+                     ModelType.GPT_4_32k):
         raise NotImplementedError(
             f"`num_tokens_from_messages`` is not presently implemented "
             f"for model {model}. "
@@ -89,6 +94,49 @@ def num_tokens_from_messages(
             f"See https://platform.openai.com/docs/models/gpt-4"
             f"or https://platform.openai.com/docs/models/gpt-3-5"
             f"for information about openai chat models.")
+    try:
+        return tiktoken.encoding_for_model(model.value)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_message(
+    message: OpenAIMessage,
+    model: ModelType,
+) -> int:
+    r"""Returns the number of tokens a single message adds to a chat. Unlike
+    :func:`num_tokens_from_messages`, this does not include the tokens that
+    prime the reply.
+
+    Args:
+        message (OpenAIMessage): The message to count the number of tokens
+            for.
+        model (ModelType): The OpenAI model used to encode the message.
+
+    Returns:
+        int: The number of tokens used by the message.
+    """
+    return count_tokens_openai_chat_message(message, get_model_encoding(model))
+
+
+def num_tokens_from_messages(
+    messages: List[OpenAIMessage],
+    model: ModelType,
+) -> int:
+    r"""Returns the number of tokens used by a list of messages.
+
+    Args:
+        messages (List[OpenAIMessage]): The list of messages to count the
+            number of tokens for.
+        model (ModelType): The OpenAI model used to encode the messages.
+
+    Returns:
+        int: The total number of tokens used by the messages.
+
+    Raises:
+        NotImplementedError: If the specified `model` is not implemented.
+    """
+    return count_tokens_openai_chat_models(messages, get_model_encoding(model))
 
 
 def get_model_token_limit(model: ModelType) -> int: